@@ -18,7 +18,7 @@ import MapViewer2D from './MapViewer2D';
 import { FaMap, FaRoute, FaDrawPolygon, FaChevronLeft, FaChevronRight, FaUpload, FaDownload, FaMapMarkerAlt, FaUtensils, FaShoppingBag, FaBuilding, FaParking, FaInfoCircle, FaMarker, FaUser, FaStore, FaCoffee, FaBook, FaFirstAid, FaWheelchair, FaArrowUp, FaDoorOpen } from 'react-icons/fa';
 import { FaStairs } from "react-icons/fa6";
 import { SiBlockbench } from "react-icons/si";
-import { saveMapData } from "../src/services/api";
+import { saveMapData, getMapData, getSavedMapVersion, importStation, snapRoute, stationExportUrl } from "../src/services/api";
 // Add these constants at the top with other constants
 const PATH_COLORS = {
     primary: '#fcd89a',    // Google Maps blue
@@ -44,80 +44,6 @@ const DR_CONFIG = {
     timeThreshold: 250 // minimum time between steps (ms)
 };
 
-// Add these helper functions at the top level
-const MERGE_THRESHOLD = 0.0001;
-const OBJECT_BUFFER = 0.0002; // Buffer zone around objects where paths won't merge
-
-// Add this helper function to check if a point is near any object
-const isNearObject = (point, objects, buffer = OBJECT_BUFFER) => {
-    return objects.some(obj => {
-        const [lat, lng] = obj.latlng;
-        const distance = Math.sqrt(
-            Math.pow(point.x - lng, 2) +
-            Math.pow(point.y - lat, 2)
-        );
-        return distance < buffer;
-    });
-};
-
-const findNearbyPoints = (point, allRoutes, objects, threshold = MERGE_THRESHOLD) => {
-    // Don't merge if point is near an object
-    if (isNearObject(point, objects)) {
-        return [];
-    }
-
-    const nearby = [];
-
-    allRoutes.forEach(route => {
-        route.path.forEach(pathPoint => {
-            // Skip points that are near objects
-            if (isNearObject(pathPoint, objects)) {
-                return;
-            }
-
-            const distance = Math.sqrt(
-                Math.pow(point.x - pathPoint.x, 2) +
-                Math.pow(point.y - pathPoint.y, 2)
-            );
-
-            if (distance < threshold && distance > 0) {
-                nearby.push(pathPoint);
-            }
-        });
-    });
-
-    return nearby;
-};
-
-const getMergedPath = (route, allRoutes, objects) => {
-    const mergedPath = [];
-
-    route.path.forEach((point) => {
-        const nearbyPoints = findNearbyPoints(point, allRoutes, objects);
-
-        if (nearbyPoints.length > 0) {
-            const avgX = (point.x + nearbyPoints.reduce((sum, p) => sum + p.x, 0)) / (nearbyPoints.length + 1);
-            const avgY = (point.y + nearbyPoints.reduce((sum, p) => sum + p.y, 0)) / (nearbyPoints.length + 1);
-
-            mergedPath.push({
-                x: avgX,
-                y: avgY,
-                merged: true,
-                count: nearbyPoints.length + 1
-            });
-        } else {
-            mergedPath.push({
-                ...point,
-                merged: false,
-                count: 1
-            });
-        }
-    });
-
-    return mergedPath;
-};
-
-
 // Add POI types and icons
 const POI_TYPES = {
     restaurant: { icon: FaUtensils, color: '#e53935', label: 'Restaurant' },
@@ -192,6 +118,7 @@ export default function MapBuilder() {
     const [pathCreationStep, setPathCreationStep] = useState(null);
     const [selectedMarker, setSelectedMarker] = useState(null);
     const [showPathAnchors, setShowPathAnchors] = useState(false);
+    const conflictAlertedRef = useRef(false);
 
     // Define all callbacks at the top level
     const handleSaveToLocalStorage = async () => {
@@ -233,7 +160,9 @@ export default function MapBuilder() {
                     floorData,
                     selectedFloor
                 }));
-                alert('Failed to save to server. Data saved locally as backup.');
+                alert(result.conflict
+                    ? 'The map was changed by another editor since your last save, so it was not overwritten. Your copy is saved locally.'
+                    : 'Failed to save to server. Data saved locally as backup.');
             } else {
                 // Save to localStorage as backup
                 localStorage.setItem('rd_map_data', JSON.stringify({
@@ -288,9 +217,30 @@ export default function MapBuilder() {
         URL.revokeObjectURL(url);
     }, [floors, floorData]);
 
+    // GeoJSON / NDJSON station files go to the server, which replaces the
+    // station and the /api/maps document; the builder then reloads from it
+    const handleImportStation = useCallback(async (file) => {
+        if (!window.confirm('Importing will replace the station on the server. Continue?')) return;
+        try {
+            const summary = await importStation(file);
+            const data = await getMapData();
+            setFloors(data.floors);
+            setFloorData(data.floorData);
+            setSelectedFloor(data.selectedFloor || data.floors[0]?.id);
+            alert(`Imported ${summary.floors} floors.`);
+        } catch (err) {
+            alert('Failed to import: ' + err.message);
+        }
+    }, []);
+
     const handleImportJSON = useCallback((e) => {
         const file = e.target.files[0];
         if (!file) return;
+        e.target.value = '';
+        if (/\.(geojson|ndjson)$/i.test(file.name)) {
+            handleImportStation(file);
+            return;
+        }
         const reader = new FileReader();
         reader.onload = (event) => {
             try {
@@ -311,7 +261,7 @@ export default function MapBuilder() {
             }
         };
         reader.readAsText(file);
-    }, []);
+    }, [handleImportStation]);
 
     // Map initialization effect
     useEffect(() => {
@@ -335,7 +285,12 @@ export default function MapBuilder() {
                     };
 
                     // Save to API
-                    await saveMapData(dataToSave);
+                    const result = await saveMapData(dataToSave);
+                    // Tell the editor once, rather than on every edit
+                    if (result.conflict && !conflictAlertedRef.current) {
+                        conflictAlertedRef.current = true;
+                        alert('The map was changed by another editor, so your edits are no longer saved to the server. They are kept locally.');
+                    }
 
                     // Also save to localStorage as backup
                     localStorage.setItem('rd_map_data', JSON.stringify(dataToSave));
@@ -351,13 +306,25 @@ export default function MapBuilder() {
 
     // Initial data loading effect
     useEffect(() => {
-        const loadData = () => {
+        const loadData = async () => {
             console.log('Starting data load...');
             try {
                 const savedData = localStorage.getItem('rd_map_data');
                 console.log('Saved data from localStorage:', savedData);
 
-                if (savedData) {
+                // A local copy is only worth keeping if we know which server
+                // version it is based on; otherwise start from the server's
+                // map, which also tells saves what version they are based on
+                if (!savedData || getSavedMapVersion() == null) {
+                    const serverData = await getMapData();
+                    if (serverData.floors?.length) {
+                        setFloors(serverData.floors);
+                        setFloorData(serverData.floorData);
+                        setSelectedFloor(serverData.selectedFloor || serverData.floors[0].id);
+                    } else {
+                        initializeDefaultData();
+                    }
+                } else {
                     const parsedData = JSON.parse(savedData);
                     console.log('Parsed data:', parsedData);
 
@@ -371,9 +338,6 @@ export default function MapBuilder() {
                         console.log('Invalid data structure, initializing default data');
                         initializeDefaultData();
                     }
-                } else {
-                    console.log('No saved data found, initializing default data');
-                    initializeDefaultData();
                 }
             } catch (err) {
                 console.error('Error loading data:', err);
@@ -628,28 +592,32 @@ export default function MapBuilder() {
                     { x: toMarker.latlng[1], y: toMarker.latlng[0] } // to marker position
                 ];
 
-                // Get existing routes for merging
-                const existingRoutes = floorData[selectedFloor].routes || [];
-
-                // Create the new path with marker references
-                const newPath = {
-                    id: `path_${Date.now()}`,
-                    type: 'corridor',
-                    from: pathFromMarker?.id,
-                    to: pathToMarker?.id,
-                    path: getMergedPath({ path: adjustedPath }, existingRoutes, floorData[selectedFloor].objects)
-                };
-
-                setFloorData(prev => {
-                    const floor = prev[selectedFloor];
-                    return {
-                        ...prev,
-                        [selectedFloor]: {
-                            ...floor,
-                            routes: [...(floor.routes || []), newPath]
-                        }
-                    };
-                });
+                const floorId = selectedFloor;
+                const pathId = `path_${Date.now()}`;
+                const from = pathFromMarker?.id;
+                const to = pathToMarker?.id;
+
+                // The server merges the path into the floor's existing routes;
+                // if it cannot be reached the path is kept as drawn
+                snapRoute(adjustedPath, floorData[floorId])
+                    .catch(err => {
+                        console.error('Error merging path:', err);
+                        return adjustedPath.map(point => ({ ...point, merged: false, count: 1 }));
+                    })
+                    .then(mergedPath => {
+                        // Create the new path with marker references
+                        const newPath = { id: pathId, type: 'corridor', from, to, path: mergedPath };
+                        setFloorData(prev => {
+                            const floor = prev[floorId];
+                            return {
+                                ...prev,
+                                [floorId]: {
+                                    ...floor,
+                                    routes: [...(floor.routes || []), newPath]
+                                }
+                            };
+                        });
+                    });
             }
 
             // Reset path creation states
@@ -1253,8 +1221,9 @@ export default function MapBuilder() {
                         <button onClick={handleLoadFromLocalStorage} style={{ background: '#1976d2', color: 'white', border: 'none', borderRadius: 4, padding: '8px 0', fontWeight: 500, fontSize: 14 }} title="Load from LocalStorage">Load</button>
                         <button onClick={() => navigate('/viewer')} style={{ background: '#222', color: 'white', border: 'none', borderRadius: 4, padding: '8px 0', fontWeight: 500, fontSize: 14 }} title="View Map">View Map</button>
                         <button onClick={handleExportJSON} style={{ background: '#fff', color: '#4285F4', border: '1px solid #4285F4', borderRadius: 4, padding: '8px 0', fontWeight: 500, fontSize: 14, display: 'flex', alignItems: 'center', gap: 6 }} title="Export JSON"><FaDownload />Export</button>
+                        <a href={stationExportUrl('geojson')} download style={{ background: '#fff', color: '#4285F4', border: '1px solid #4285F4', borderRadius: 4, padding: '8px 0', fontWeight: 500, fontSize: 14, display: 'flex', alignItems: 'center', gap: 6, textDecoration: 'none' }} title="Export the saved station as GeoJSON"><FaDownload />Export GeoJSON</a>
                         <button onClick={() => fileInputRef.current && fileInputRef.current.click()} style={{ background: '#fff', color: '#4285F4', border: '1px solid #4285F4', borderRadius: 4, padding: '8px 0', fontWeight: 500, fontSize: 14, display: 'flex', alignItems: 'center', gap: 6 }} title="Import JSON"><FaUpload />Import</button>
-                        <input ref={fileInputRef} type="file" accept="application/json" style={{ display: 'none' }} onChange={handleImportJSON} />
+                        <input ref={fileInputRef} type="file" accept=".json,.geojson,.ndjson,application/json,application/geo+json" style={{ display: 'none' }} onChange={handleImportJSON} />
                     </div>
                 )}
                 {showSaveToast && (
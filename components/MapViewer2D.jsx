@@ -78,7 +78,7 @@ export default function MapViewer2D() {
                 // First try to load from API/database
                 console.log('Fetching data from API...');
                 try {
-                    const apiResponse = await getMapData();
+                    const apiResponse = await getMapData({ trackVersion: false });
                     console.log('API response:', apiResponse);
                     
                     // Transform the API response into the expected format
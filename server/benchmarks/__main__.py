@@ -0,0 +1,298 @@
+"""
+Load benchmark for the map API.
+
+Starts the server on a scratch database (SQLite by default, or any
+DATABASE_URL such as a local Postgres), loads a synthetic station and
+drives each endpoint in turn, reporting throughput, latency percentiles
+and payload sizes. Results are written as JSON so runs on different
+commits can be compared:
+
+    python -m benchmarks --floors 5 --objects 500 --output before.json
+    python -m benchmarks --floors 5 --objects 500 --compare before.json
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import http.client
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from .station import generate_station
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Client:
+    """Keep-alive JSON client, one connection per thread"""
+
+    def __init__(self, port):
+        self.port = port
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        """(status, request bytes, response bytes, seconds)"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=300)
+        payload = None if body is None else json.dumps(body).encode()
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=payload, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self._local.connection = None
+            raise
+        return response.status, len(payload or b""), len(data), time.perf_counter() - start
+
+    def json(self, method, path, body=None):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=300)
+        try:
+            connection.request(method, path, body=json.dumps(body).encode() if body is not None else None,
+                               headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            data = response.read()
+        finally:
+            connection.close()
+        if response.status >= 400:
+            raise RuntimeError(f"{method} {path} failed with {response.status}: {data[:200]!r}")
+        return json.loads(data)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(database_url, port, workdir):
+    """Run the API in a subprocess; its output goes to server.log in workdir"""
+    env = dict(os.environ, DATABASE_URL=database_url, TILE_CACHE_DIR=os.path.join(workdir, "tiles"))
+    log = open(os.path.join(workdir, "server.log"), "wb")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=SERVER_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    log.close()
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            with open(os.path.join(workdir, "server.log"), errors="replace") as f:
+                raise RuntimeError(f"Server exited during startup:\n{f.read()[-2000:]}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Server did not start within 60 seconds")
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def run_scenario(client, requests, concurrency, warmup=0):
+    """
+    requests: list of (method, path, body). The first `warmup` are sent
+    beforehand and not counted, so cold caches do not skew the
+    percentiles. Returns the scenario's statistics.
+    """
+    for request in requests[:warmup]:
+        client.request(*request)
+
+    def send(request):
+        try:
+            return client.request(*request)
+        except (http.client.HTTPException, OSError):
+            return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(send, requests))
+    elapsed = time.perf_counter() - start
+
+    ok = [s for s in samples if s is not None and s[0] < 400]
+    latencies = sorted(s[3] * 1000 for s in ok)
+    response_bytes = [s[2] for s in ok]
+    request_bytes = [s[1] for s in ok]
+    return {
+        "requests": len(requests),
+        "errors": len(requests) - len(ok),
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 4),
+        "throughput": round(len(ok) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "p50": _round(percentile(latencies, 50)),
+            "p95": _round(percentile(latencies, 95)),
+            "p99": _round(percentile(latencies, 99)),
+            "mean": _round(sum(latencies) / len(latencies)) if latencies else None,
+            "max": _round(latencies[-1]) if latencies else None,
+        },
+        "request_bytes": {"mean": _mean(request_bytes), "max": max(request_bytes, default=None)},
+        "response_bytes": {"mean": _mean(response_bytes), "max": max(response_bytes, default=None)},
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 3)
+
+
+def _mean(values):
+    return round(sum(values) / len(values), 1) if values else None
+
+
+def _renamed(station, n):
+    """The station with one object renamed, so every save writes a change"""
+    floor_id = station["floors"][n % len(station["floors"])]["id"]
+    floor_data = dict(station["floorData"][floor_id])
+    objects = list(floor_data["objects"])
+    if objects:
+        objects[0] = {**objects[0], "name": f"Renamed {n}"}
+    floor_data["objects"] = objects
+    return {**station, "floorData": {**station["floorData"], floor_id: floor_data}}
+
+
+def scenarios(station, floor_ids, args):
+    """(name, requests, concurrency, warmup) in the order they run; writes run one at a time"""
+    n, c, w = args.requests, args.concurrency, args.warmup
+    saves = max(1, n // 20)
+    return [
+        ("GET /api/maps", [("GET", "/api/maps", None)] * n, c, w),
+        ("GET /api/floors/api/maps", [("GET", "/api/floors/api/maps", None)] * n, c, w),
+        ("GET /api/floors/", [("GET", "/api/floors/", None)] * n, c, w),
+        ("GET /api/floors/{id}", [
+            ("GET", f"/api/floors/{floor_ids[i % len(floor_ids)]}", None) for i in range(n)
+        ], c, w),
+        ("GET /api/markers/", [
+            ("GET", f"/api/markers/?floor_id={floor_ids[i % len(floor_ids)]}", None) for i in range(n)
+        ], c, w),
+        ("PUT /api/floors/{id}", [
+            ("PUT", f"/api/floors/{floor_ids[i % len(floor_ids)]}", {"name": f"Level {i}"}) for i in range(n)
+        ], 1, 0),
+        ("POST /api/markers/", [
+            ("POST", f"/api/markers/?floor_id={floor_ids[i % len(floor_ids)]}", {
+                "id": f"bench_{i}", "name": f"Kiosk {i}", "type": "shop", "latlng": [28.643, 77.221]
+            })
+            for i in range(n)
+        ], 1, 0),
+        ("DELETE /api/markers/{id}", [
+            ("DELETE", f"/api/markers/bench_{i}?floor_id={floor_ids[i % len(floor_ids)]}", None) for i in range(n)
+        ], 1, 0),
+        # save_map_data diffs the whole station against the database
+        ("POST /api/floors/api/maps", [
+            ("POST", "/api/floors/api/maps", _renamed(station, i)) for i in range(saves)
+        ], 1, 0),
+        ("POST /api/maps", [("POST", "/api/maps", station)] * saves, 1, 0),
+    ]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=SERVER_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current):
+    """Print per-endpoint changes against a previous run"""
+    print(f"\nCompared with {baseline['meta'].get('commit') or 'baseline'}:")
+    print(f"{'endpoint':32} {'p50 ms':>18} {'p99 ms':>18} {'req/s':>18}")
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        cells = []
+        for old, new in (
+            (before["latency_ms"]["p50"], result["latency_ms"]["p50"]),
+            (before["latency_ms"]["p99"], result["latency_ms"]["p99"]),
+            (before["throughput"], result["throughput"]),
+        ):
+            if old and new is not None:
+                cells.append(f"{new:9.2f} ({(new - old) / old:+6.1%})")
+            else:
+                cells.append(f"{'-':>18}")
+        print(f"{name:32} {cells[0]:>18} {cells[1]:>18} {cells[2]:>18}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--floors", type=int, default=3)
+    parser.add_argument("--objects", type=int, default=200, help="objects per floor")
+    parser.add_argument("--route-points", type=int, default=2000, help="route points per floor")
+    parser.add_argument("--boundaries", type=int, default=20, help="boundaries and inner boundaries per floor")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8, help="parallel clients for reads")
+    parser.add_argument("--warmup", type=int, default=5, help="uncounted requests before each read endpoint")
+    parser.add_argument("--database-url", help="database to run against; a scratch SQLite file by default")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="previous results JSON to compare with")
+    args = parser.parse_args(argv)
+
+    station = generate_station(args.floors, args.objects, args.route_points, args.boundaries, args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        port = _free_port()
+        server = start_server(database_url, port, workdir)
+        try:
+            client = Client(port)
+            client.json("POST", "/api/floors/api/maps", station)
+            client.json("POST", "/api/maps", station)
+            floor_ids = [floor["id"] for floor in client.json("GET", "/api/floors/?limit=1000")]
+
+            results = {}
+            print(f"{'endpoint':32} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'resp B':>10} {'errors':>7}")
+            for name, requests, concurrency, warmup in scenarios(station, floor_ids, args):
+                result = results[name] = run_scenario(client, requests, concurrency, warmup)
+                latency = result["latency_ms"]
+                print(
+                    f"{name:32} {result['throughput'] or 0:9.1f} {latency['p50'] or 0:9.2f} "
+                    f"{latency['p95'] or 0:9.2f} {latency['p99'] or 0:9.2f} "
+                    f"{result['response_bytes']['mean'] or 0:10.0f} {result['errors']:7d}"
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": database_url.split(":", 1)[0] if args.database_url else "sqlite (scratch)",
+            "station": {
+                "floors": args.floors, "objects": args.objects, "route_points": args.route_points,
+                "boundaries": args.boundaries, "seed": args.seed,
+            },
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
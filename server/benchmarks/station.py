@@ -0,0 +1,120 @@
+"""
+Synthetic stations in the builder's localStorage shape
+({"floors", "floorData"}), for loading into the API under benchmark.
+"""
+from math import cos, pi, sin
+import random
+
+# Stations are laid out around this point, the size of a large terminus
+ORIGIN = (28.6419, 77.2194)
+SPAN = 0.004
+
+OBJECT_TYPES = ["platform", "ticket", "shop", "toilet", "exit", "info", "food", "waiting"]
+CONNECTOR_TYPES = ["stairs", "escalator", "elevator"]
+NAMES = {
+    "platform": "Platform", "ticket": "Ticket Counter", "shop": "Shop", "toilet": "Toilet",
+    "exit": "Exit", "info": "Enquiry", "food": "Food Court", "waiting": "Waiting Room",
+    "stairs": "Stairs", "escalator": "Escalator", "elevator": "Lift",
+}
+
+
+def _point(rng):
+    return (ORIGIN[0] + rng.random() * SPAN, ORIGIN[1] + rng.random() * SPAN)
+
+
+def _objects(rng, level, count, connectors):
+    objects = []
+    for i in range(count):
+        object_type = CONNECTOR_TYPES[i % 3] if i < connectors else rng.choice(OBJECT_TYPES)
+        lat, lng = _point(rng)
+        obj = {
+            "id": f"marker_{level}_{i}",
+            "name": f"{NAMES[object_type]} {i}",
+            "type": object_type,
+            "description": f"{NAMES[object_type]} on level {level}",
+            "latlng": [lat, lng],
+            "color": "#ff0000",
+        }
+        if i < connectors:
+            # Same connector on every level, as drawn by the builder
+            obj["connectorId"] = f"connector_{i}"
+            obj["latlng"] = [ORIGIN[0] + SPAN * (i + 1) / (connectors + 1), ORIGIN[1] + SPAN / 2]
+        objects.append(obj)
+    return objects
+
+
+def _routes(rng, level, objects, points):
+    """Corridors between random pairs of objects, points in total, each a jittered polyline"""
+    routes = []
+    remaining = points
+    while remaining > 1 and len(objects) > 1:
+        start, end = rng.sample(objects, 2)
+        n = min(remaining, rng.randint(8, 40))
+        remaining -= n
+        (lat0, lng0), (lat1, lng1) = start["latlng"], end["latlng"]
+        path = []
+        for k in range(n):
+            t = k / (n - 1) if n > 1 else 0
+            path.append({
+                "x": lng0 + (lng1 - lng0) * t + rng.uniform(-1, 1) * 2e-6,
+                "y": lat0 + (lat1 - lat0) * t + rng.uniform(-1, 1) * 2e-6,
+            })
+        path[0].update(x=lng0, y=lat0)
+        path[-1].update(x=lng1, y=lat1)
+        routes.append({
+            "id": f"route_{level}_{len(routes)}",
+            "name": f"Corridor {len(routes)}",
+            "type": "corridor",
+            "from": start["id"],
+            "to": end["id"],
+            "path": path,
+            "color": "#2196f3",
+        })
+    return routes
+
+
+def _polygon(rng, lat, lng, size, corners):
+    ring = []
+    for k in range(corners):
+        angle = 2 * pi * k / corners
+        r = size * rng.uniform(0.7, 1.0)
+        ring.append([lng + r * cos(angle), lat + r * sin(angle)])
+    ring.append(ring[0])
+    return {"type": "Polygon", "coordinates": [ring]}
+
+
+def _boundaries(rng, level, count, prefix, size):
+    boundaries = []
+    for i in range(count):
+        lat, lng = _point(rng)
+        boundaries.append({
+            "id": f"{prefix}_{level}_{i}",
+            "name": f"Area {i}",
+            "type": "area",
+            "geometry": _polygon(rng, lat, lng, size, rng.randint(4, 24)),
+        })
+    return boundaries
+
+
+def generate_station(floors=3, objects=200, route_points=2000, boundaries=20, seed=0):
+    """
+    A station of `floors` levels, each with `objects` markers (the first
+    few are stairs/escalators/lifts linking the levels), routes totalling
+    `route_points` points and `boundaries` outer plus as many inner
+    boundaries. The same arguments always give the same station.
+    """
+    rng = random.Random(seed)
+    connectors = min(objects, 6)
+    station = {"floors": [], "floorData": {}, "selectedFloor": None}
+    for level in range(floors):
+        floor_id = f"floor_{level}"
+        floor_objects = _objects(rng, level, objects, connectors)
+        station["floors"].append({"id": floor_id, "name": f"Level {level}"})
+        station["floorData"][floor_id] = {
+            "objects": floor_objects,
+            "routes": _routes(rng, level, floor_objects, route_points),
+            "boundaries": _boundaries(rng, level, boundaries, "boundary", SPAN / 10),
+            "innerBoundaries": _boundaries(rng, level, boundaries, "inner", SPAN / 40),
+        }
+    station["selectedFloor"] = station["floors"][0]["id"] if station["floors"] else None
+    return station
@@ -0,0 +1,52 @@
+"""
+Production server:
+
+    gunicorn -c gunicorn.conf.py src.main:app
+
+The master process imports the app once, migrates the schema and builds
+every floor's caches, then forks the workers. Workers start warm, share
+that memory copy-on-write until floors change, and new ones (TTIN, or a
+replaced worker) are serving within moments. run.py stays the
+single-process auto-reloading development server.
+
+Settings come from the environment: HOST, PORT, WEB_CONCURRENCY (workers,
+one per CPU by default), WORKER_TIMEOUT, and WARMUP (startup, background
+or off; see src/main.py).
+"""
+import multiprocessing
+import os
+
+# The master migrates below; workers must not race it on import
+os.environ["MIGRATE_ON_STARTUP"] = "false"
+os.environ.setdefault("WARMUP", "startup")
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("WORKER_TIMEOUT", 60))
+graceful_timeout = 30
+keepalive = 5
+
+
+def when_ready(server):
+    """Runs in the master after the app is imported and before any worker is forked"""
+    from src.database import engine
+    from src.main import WARMUP, warm_up
+    from src.migrations import upgrade
+    from src.services.warmup import run_warmup
+
+    upgrade(engine)
+    if WARMUP == "startup":
+        run_warmup(warm_up)
+    # Connections must not be shared with the forked workers
+    engine.dispose()
+
+
+def post_fork(server, worker):
+    from src.database import engine, async_engine
+
+    # Drop pooled connections inherited from the master without closing
+    # them, which would close the master's sockets too
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
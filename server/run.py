@@ -1,4 +1,7 @@
 import uvicorn
- 
+
+# Development server: one process that reloads on code changes. For
+# production use gunicorn -c gunicorn.conf.py src.main:app, which migrates
+# once and forks warm workers.
 if __name__ == "__main__":
-    uvicorn.run("src.main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
+    uvicorn.run("src.main:app", host="0.0.0.0", port=8000, reload=True)
@@ -1,17 +1,45 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, Query, Request
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy import select, text
 from sqlalchemy.orm import Session
-from typing import Dict, Any
-from .database import engine, get_db
-from .models.base import Base, MapData
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, Any, Literal, Optional
+from .database import engine, async_engine, SessionLocal, get_db, get_async_db
+from .models.base import MapData
+from .migrations import upgrade
+from .routes import floors, markers, paths, boundaries, routing, spatial, feed, tracking, tiles, search, offline, history, transfer
+from .services.response_cache import async_cached_json_response, store_json_response, drop_stale_responses
+from .services.geometry import compact_map_data
+from .services.feed import broadcaster
+from .services.logs import capped
+from .services.offline import bundle_store
+from .services.history import load_version
+from .services.maps import normalize_map_data, store_map_data, StaleMapError
+from .services.metrics import MetricsMiddleware, instrument_engine, render
+from .services.singleflight import CoalescedCallTimeout
+from .services.warmup import warmup_state, warm_floors, run_warmup
 import logging
+import os
+import threading
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# Create tables and apply column upgrades. The production launcher
+# (gunicorn.conf.py) migrates once in its master process and turns this off.
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+# When to build every floor's caches: "startup" before serving, "background"
+# while serving, or "off" to build each on first use
+WARMUP = os.getenv("WARMUP", "background").lower()
+# Version of the map a GET /api/maps response holds, for POST's base_version
+MAP_VERSION_HEADER = "X-Map-Version"
+
+if MIGRATE_ON_STARTUP:
+    upgrade(engine)
 
 app = FastAPI()
 
@@ -22,70 +50,192 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    # Editors read the version of /api/maps they loaded to base saves on it
+    expose_headers=[MAP_VERSION_HEADER],
 )
+app.add_middleware(MetricsMiddleware)
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+
+app.include_router(floors.router, prefix="/api/floors", tags=["floors"])
+app.include_router(markers.router, prefix="/api/markers", tags=["markers"])
+app.include_router(paths.router, prefix="/api/paths", tags=["paths"])
+app.include_router(boundaries.router, prefix="/api/boundaries", tags=["boundaries"])
+app.include_router(routing.router, prefix="/api/route", tags=["routing"])
+app.include_router(spatial.router, prefix="/api", tags=["spatial"])
+app.include_router(feed.router, prefix="/api", tags=["feed"])
+app.include_router(tracking.router, prefix="/api/tracking", tags=["tracking"])
+app.include_router(tiles.router, prefix="/api/tiles", tags=["tiles"])
+app.include_router(search.router, prefix="/api", tags=["search"])
+app.include_router(offline.router, prefix="/api", tags=["offline"])
+app.include_router(history.router, prefix="/api", tags=["history"])
+app.include_router(transfer.router, prefix="/api/station", tags=["transfer"])
+
+@app.exception_handler(CoalescedCallTimeout)
+async def coalesced_call_timeout(request: Request, exc: CoalescedCallTimeout):
+    """A request gave up waiting on a concurrent one building the same data"""
+    logger.warning("%s", exc)
+    return JSONResponse(status_code=503, content={"detail": "Server busy, try again"}, headers={"Retry-After": "1"})
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Request, SQL and connection pool metrics of this worker, for Prometheus"""
+    return PlainTextResponse(
+        render({"sync": engine, "async": async_engine.sync_engine}),
+        media_type="text/plain; version=0.0.4"
+    )
+
+@app.get("/ready", include_in_schema=False)
+async def ready(db: AsyncSession = Depends(get_async_db)):
+    """
+    Readiness of this worker: 200 once its caches are warm (or warming
+    failed or is off, as every cache still fills on first use) and the
+    database answers, 503 before
+    """
+    state = warmup_state.as_dict()
+    try:
+        await db.execute(text("SELECT 1"))
+        state["database"] = "ok"
+    except Exception as e:
+        state["database"] = str(e)
+    ready = state["database"] == "ok" and state["status"] not in ("cold", "warming")
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, **state})
+
+@app.on_event("startup")
+async def start_feed():
+    # Every worker hears every write with the postgres feed backend, so
+    # each frees what the write made stale
+    broadcaster.add_listener(drop_stale_responses)
+    await broadcaster.start()
+
+@app.on_event("startup")
+async def start_warmup():
+    # Workers forked from a warmed master find the work already done
+    if WARMUP == "off":
+        if warmup_state.status == "cold":
+            warmup_state.status = "off"
+    elif WARMUP == "startup":
+        await run_in_threadpool(run_warmup, warm_up)
+    else:
+        threading.Thread(target=run_warmup, args=(warm_up,), name="warmup", daemon=True).start()
+
+@app.on_event("shutdown")
+async def stop_feed():
+    await broadcaster.stop()
+
+def warm_up():
+    """Build every floor's caches and encode the current map, as first requests would"""
+    with SessionLocal() as db:
+        warm_floors(db)
+        latest = db.query(MapData).order_by(MapData.id.desc()).first()
+        if latest is not None:
+            store_json_response(("maps", latest.id, "full"), latest.version, normalize_map_data(dict(latest.data)))
+            bundle_store.bundle(latest.id, latest.version, latest.data)
 
 @app.get("/api/maps")
-def get_map_data(db: Session = Depends(get_db)):
-    """Get the latest map data"""
+async def get_map_data(
+    request: Request,
+    format: Literal["full", "compact"] = "full",
+    version: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Get the latest map data, or the saved version `version` of it;
+    format=compact ships geometry as encoded polylines. The version is
+    sent as X-Map-Version (0 before any save), for editors to pass back
+    as base_version when they save.
+    """
     try:
-        # Get the latest map data
-        map_data = db.query(MapData).order_by(MapData.id.desc()).first()
-        logger.info(f"Retrieved map data: {map_data}")
+        # Only the id and version are needed to answer from cache or with 304
+        latest = (await db.execute(
+            select(MapData.id, MapData.version).order_by(MapData.id.desc()).limit(1)
+        )).first()
         
-        if map_data:
-            # Ensure the response has the expected structure
-            data = map_data.data
-            logger.info(f"Raw data from database: {data}")
-            
-            if not isinstance(data, dict):
-                logger.warning(f"Data is not a dictionary: {type(data)}")
-                data = {"floors": [], "floorData": {}, "selectedFloor": None}
-            
-            if "floors" not in data:
-                logger.warning("floors field missing, adding empty array")
-                data["floors"] = []
-            if "floorData" not in data:
-                logger.warning("floorData field missing, adding empty object")
-                data["floorData"] = {}
-            if "selectedFloor" not in data:
-                logger.warning("selectedFloor field missing, adding null")
-                data["selectedFloor"] = None
-                
-            logger.info(f"Returning processed data: {data}")
-            return data
-            
+        if latest:
+            map_id, current = latest
+            key = ("maps", map_id, format)
+            if version is not None and version != current:
+                if version > current:
+                    raise HTTPException(status_code=404, detail=f"Map has no version {version} yet")
+                # Past versions never change, so each is cached under its own key
+                key = (*key, version)
+            else:
+                version = current
+            logger.debug("Serving map data %s at version %s", map_id, version)
+
+            async def build():
+                if version == current:
+                    data = await db.scalar(select(MapData.data).where(MapData.id == map_id))
+                else:
+                    data = await db.run_sync(load_version, map_id, version)
+                    if data is None:
+                        raise HTTPException(status_code=404, detail=f"Version {version} is not in the map history")
+                data = normalize_map_data(data)
+                if format == "compact":
+                    data = {**data, "floorData": {
+                        floor_id: compact_map_data(floor_data)
+                        for floor_id, floor_data in data["floorData"].items()
+                    }}
+                return data
+
+            return await async_cached_json_response(
+                request, key, version, build, {MAP_VERSION_HEADER: str(version)}
+            )
+
+        if version is not None:
+            raise HTTPException(status_code=404, detail="No map saved yet")
         # Return empty data structure if no data exists
         logger.info("No data found in database, returning empty structure")
-        return {
-            "floors": [],
-            "floorData": {},
-            "selectedFloor": None
-        }
+        return JSONResponse(
+            {"floors": [], "floorData": {}, "selectedFloor": None},
+            headers={MAP_VERSION_HEADER: "0"}
+        )
+    except (HTTPException, CoalescedCallTimeout):
+        raise
     except Exception as e:
-        logger.error(f"Error in get_map_data: {str(e)}")
+        logger.exception("Error in get_map_data")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/maps")
-def save_map_data(data: Dict[str, Any], db: Session = Depends(get_db)):
-    """Save map data"""
+def save_map_data(
+    data: Dict[str, Any],
+    background_tasks: BackgroundTasks,
+    base_version: Optional[int] = Query(None, ge=0),
+    db: Session = Depends(get_db)
+):
+    """
+    Save map data. Editors pass the version their copy was loaded or last
+    saved at as base_version, so a save made meanwhile by someone else is
+    refused with 409 instead of overwritten.
+    """
     try:
-        logger.info(f"Received data to save: {data}")
-        
-        # Delete all existing data
-        db.query(MapData).delete()
-        db.commit()
-        logger.info("Deleted existing data")
-        
-        # Create new map data entry
-        new_map_data = MapData(data=data)
-        db.add(new_map_data)
-        db.commit()
-        db.refresh(new_map_data)
-        logger.info(f"Saved new data: {new_map_data.data}")
-        
-        return {"message": "Map data saved successfully", "data": new_map_data.data}
+        logger.debug("Received map data to save: %s", capped(data))
+        map_data = store_map_data(db, data, background_tasks, base_version)
+        return {"message": "Map data saved successfully", "version": map_data.version, "data": map_data.data}
+    except StaleMapError as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(e))
+    except StaleDataError:
+        # Another save committed between our read and our update
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Map was modified by another save, reload and retry")
+    except Exception as e:
+        logger.exception("Error in save_map_data")
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/maps/restore")
+def restore_map_data(version: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    """Save an earlier version of the map again, as a new version; history is never rewritten"""
+    map_data = db.query(MapData).order_by(MapData.id.desc()).first()
+    data = load_version(db, map_data.id, version) if map_data is not None else None
+    if data is None:
+        raise HTTPException(status_code=404, detail=f"Version {version} is not in the map history")
+    try:
+        map_data = store_map_data(db, data, background_tasks)
+        return {"message": f"Restored version {version}", "version": map_data.version, "data": map_data.data}
     except Exception as e:
-        logger.error(f"Error in save_map_data: {str(e)}")
+        logger.exception("Error in restore_map_data")
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -0,0 +1,107 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+from .database import Base
+from .models.base import Floor, MapData, MapVersion, FEATURE_MODELS
+from .services.simplify import compute_lod
+from .services.history import record_version
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Columns added after the first deployment. create_all() only creates missing
+# tables, so existing databases get these through ALTER TABLE.
+ADDED_COLUMNS = {
+    "floors": {
+        "version": "INTEGER NOT NULL DEFAULT 1",
+    },
+    "map_data": {
+        "version": "INTEGER NOT NULL DEFAULT 1",
+    },
+    "markers": {"lod": "JSON"},
+    "paths": {"lod": "JSON"},
+    "boundaries": {"lod": "JSON"},
+    "inner_boundaries": {"lod": "JSON"},
+}
+
+# Rows given levels of detail per transaction by backfill_lod()
+LOD_BATCH = 500
+
+def upgrade(engine):
+    """Create missing tables and add columns introduced since the table was created"""
+    Base.metadata.create_all(bind=engine)
+
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {column["name"] for column in inspector.get_columns(table)}
+            for name, ddl in columns.items():
+                if name not in existing:
+                    logger.info("Adding column %s.%s", table, name)
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+    migrate_map_data_blobs(engine)
+    backfill_lod(engine)
+    backfill_map_history(engine)
+
+def migrate_map_data_blobs(engine):
+    """
+    Move items still stored in the floors.map_data JSON column into the
+    feature tables. Each floor is migrated in its own transaction and its
+    blob is emptied, so this is safe to run on every start.
+    """
+    with Session(engine) as db:
+        pending = [
+            floor_id
+            for floor_id, blob in db.query(Floor.id, Floor.legacy_map_data)
+            if isinstance(blob, dict) and any(blob.get(key) for key in FEATURE_MODELS)
+        ]
+
+        for floor_id in pending:
+            floor = db.get(Floor, floor_id)
+            blob = floor.legacy_map_data
+            floor.map_data = blob
+            floor.legacy_map_data = {}
+            db.commit()
+            logger.info(
+                "Migrated floor %s map_data: %s",
+                floor_id,
+                ", ".join(f"{len(blob.get(key) or [])} {key}" for key in FEATURE_MODELS)
+            )
+
+def backfill_lod(engine):
+    """
+    Compute levels of detail for routes and boundaries saved before they
+    existed. Computed rows always get a (possibly empty) dict, so only
+    rows still NULL are picked up on later starts.
+    """
+    with Session(engine) as db:
+        for key, model in FEATURE_MODELS.items():
+            if model.collection == "objects":
+                continue
+            done = 0
+            while True:
+                rows = db.query(model).filter(model.lod.is_(None)).limit(LOD_BATCH).all()
+                if not rows:
+                    break
+                for row in rows:
+                    row.lod = compute_lod(model.collection, row.data)
+                db.commit()
+                done += len(rows)
+            if done:
+                logger.info("Computed levels of detail for %s %s", done, key)
+
+def backfill_map_history(engine):
+    """Start the version history of maps saved before it existed with a snapshot"""
+    with Session(engine) as db:
+        has_history = db.query(MapVersion.id).filter(MapVersion.map_id == MapData.id).exists()
+        for map_data in db.query(MapData).filter(~has_history).all():
+            record_version(db, map_data.id, map_data.version, None, map_data.data)
+            logger.info("Started version history of map %s at version %s", map_data.id, map_data.version)
+        db.commit()
+
+if __name__ == "__main__":
+    # python -m src.migrations: migrate once, e.g. as a release step before
+    # starting workers with MIGRATE_ON_STARTUP=false
+    from .database import engine
+    logging.basicConfig(level=logging.INFO)
+    upgrade(engine)
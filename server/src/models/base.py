@@ -1,29 +1,136 @@
-from sqlalchemy import Column, Integer, String, JSON, DateTime
+from sqlalchemy import Column, Integer, String, JSON, DateTime, ForeignKey, Index
+from sqlalchemy.orm import relationship, deferred, declared_attr, validates
 from sqlalchemy.sql import func
 from src.database import Base
+from src.services.simplify import compute_lod, apply_lod
 from datetime import datetime
 
+class FeatureMixin:
+    """
+    One item of a floor's map: a marker, route polyline or boundary.
+    The item is kept in `data` exactly as the builder produced it; `uid`
+    is its client-side id and `seq` its position in the floor's list.
+    `lod` holds the vertices each level of detail keeps, recomputed
+    whenever `data` is assigned.
+    """
+    collection = None
+
+
+    id = Column(Integer, primary_key=True)
+    seq = Column(Integer, nullable=False, default=0)
+    uid = Column(String)
+    type = Column(String)
+    data = Column(JSON, nullable=False)
+    lod = Column(JSON)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, onupdate=datetime.utcnow)
+
+    @declared_attr
+    def floor_id(cls):
+        return Column(Integer, ForeignKey("floors.id", ondelete="CASCADE"), nullable=False)
+
+    @declared_attr
+    def __table_args__(cls):
+        return (
+            Index(f"ix_{cls.__tablename__}_floor_seq", "floor_id", "seq"),
+            Index(f"ix_{cls.__tablename__}_floor_uid", "floor_id", "uid"),
+        )
+
+    @validates("data")
+    def _update_lod(self, key, data):
+        self.lod = compute_lod(self.collection, data)
+        return data
+
+    @classmethod
+    def from_item(cls, item, seq):
+        return cls(uid=item.get("id"), type=item.get("type"), seq=seq, data=item)
+
+class Marker(FeatureMixin, Base):
+    __tablename__ = "markers"
+    collection = "objects"
+
+class Path(FeatureMixin, Base):
+    __tablename__ = "paths"
+    collection = "routes"
+
+class Boundary(FeatureMixin, Base):
+    __tablename__ = "boundaries"
+    collection = "boundaries"
+
+class InnerBoundary(FeatureMixin, Base):
+    __tablename__ = "inner_boundaries"
+    collection = "innerBoundaries"
+
+# map_data key -> (model, Floor relationship)
+FEATURE_MODELS = {
+    "objects": Marker,
+    "routes": Path,
+    "boundaries": Boundary,
+    "innerBoundaries": InnerBoundary,
+}
+FEATURE_RELATIONSHIPS = {
+    "objects": "markers",
+    "routes": "paths",
+    "boundaries": "boundaries",
+    "innerBoundaries": "inner_boundaries",
+}
+
 class Floor(Base):
     __tablename__ = "floors"
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
     level = Column(Integer, nullable=False)
-    map_data = Column(JSON, nullable=False, default={
-        "objects": [],
-        "routes": [],
-        "boundaries": [],
-        "innerBoundaries": []
-    })
+    # Pre-normalization blob. Items now live in the feature tables; the
+    # migration moves anything left here into them and empties it.
+    legacy_map_data = deferred(Column("map_data", JSON, nullable=False, default=dict))
+    # Bumped by SQLAlchemy on every UPDATE; derived structures (routing
+    # graphs, caches) are keyed on it so they rebuild only when the floor changes
+    version = Column(Integer, nullable=False, default=1)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, onupdate=datetime.utcnow)
 
-    def to_dict(self):
+    __mapper_args__ = {"version_id_col": version}
+
+    markers = relationship(Marker, order_by=Marker.seq, cascade="all, delete-orphan")
+    paths = relationship(Path, order_by=Path.seq, cascade="all, delete-orphan")
+    boundaries = relationship(Boundary, order_by=Boundary.seq, cascade="all, delete-orphan")
+    inner_boundaries = relationship(InnerBoundary, order_by=InnerBoundary.seq, cascade="all, delete-orphan")
+
+    @property
+    def map_data(self):
+        """The floor's items in the builder's {objects, routes, boundaries, innerBoundaries} shape"""
+        return {
+            key: [feature.data for feature in getattr(self, attr)]
+            for key, attr in FEATURE_RELATIONSHIPS.items()
+        }
+
+    def map_data_at(self, level):
+        """map_data with geometry at a level of detail from lod_level()"""
+        if level is None:
+            return self.map_data
+        return {
+            key: [apply_lod(key, feature.data, feature.lod, level) for feature in getattr(self, attr)]
+            for key, attr in FEATURE_RELATIONSHIPS.items()
+        }
+
+    @map_data.setter
+    def map_data(self, value):
+        """Replace every item of the floor"""
+        value = value or {}
+        for key, attr in FEATURE_RELATIONSHIPS.items():
+            model = FEATURE_MODELS[key]
+            items = [item for item in value.get(key, []) or [] if isinstance(item, dict)]
+            setattr(self, attr, [model.from_item(item, seq) for seq, item in enumerate(items)])
+        self.updated_at = datetime.utcnow()
+
+    def to_dict(self, level=None):
         return {
             "id": self.id,
             "name": self.name,
             "level": self.level,
-            "map_data": self.map_data
+            "version": self.version,
+            "map_data": self.map_data_at(level)
         }
 
 class MapData(Base):
@@ -35,13 +142,37 @@ class MapData(Base):
         "floorData": {},
         "selectedFloor": None
     })
+    version = Column(Integer, nullable=False, default=1)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, onupdate=datetime.utcnow)
 
+    __mapper_args__ = {"version_id_col": version}
+
     def to_dict(self):
         return {
             "id": self.id,
             "data": self.data,
+            "version": self.version,
             "created_at": self.created_at,
             "updated_at": self.updated_at
-        } 
\ No newline at end of file
+        } 
+
+class MapVersion(Base):
+    """
+    One saved version of a MapData document: in full for snapshots, or as
+    the ops from the previous version for deltas (see services/history.py)
+    """
+    __tablename__ = "map_versions"
+
+    id = Column(Integer, primary_key=True)
+    map_id = Column(Integer, ForeignKey("map_data.id", ondelete="CASCADE"), nullable=False)
+    version = Column(Integer, nullable=False)
+    kind = Column(String, nullable=False)
+    data = deferred(Column(JSON, nullable=False))
+    # Bytes of data as compact JSON, to decide when to take the next snapshot
+    size = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_map_versions_map_version", "map_id", "version", unique=True),
+    )
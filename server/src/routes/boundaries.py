@@ -1,54 +1,107 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any
-from ..database import get_db
-from ..models.base import Floor
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Dict, Any, Optional, Literal
+from ..database import get_db, get_async_db
+from ..services.features import (
+    floor_version, bump_floor_version, list_features, get_feature, add_feature, delete_feature
+)
+from ..services.response_cache import async_cached_json_response
+from ..services.geometry import compact_items
+from ..services.simplify import lod_level, simplify_items
+from ..services.tiles import tile_cache, item_bboxes
+from ..services.feed import publish_floor_change, item_pointer
+from ..services.spatial import spatial_cache, floor_spatial_index, parse_bbox
 
 router = APIRouter()
 
+def _collection(inner: bool) -> str:
+    # inner=true addresses the floor's innerBoundaries (facilities inside a boundary)
+    return "innerBoundaries" if inner else "boundaries"
+
 @router.get("/")
-def get_boundaries(
+async def get_boundaries(
+    request: Request,
     floor_id: int = None,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    bbox: Optional[str] = None,
+    format: Literal["full", "compact"] = "full",
+    zoom: Optional[int] = Query(None, ge=0),
+    tolerance: Optional[float] = Query(None, gt=0),
+    inner: bool = False,
+    db: AsyncSession = Depends(get_async_db)
 ):
     if floor_id is None:
         raise HTTPException(status_code=400, detail="floor_id is required")
-    
-    floor = db.query(Floor).filter(Floor.id == floor_id).first()
-    if not floor:
+
+    # zoom (map zoom level) or tolerance (degrees) pick a precomputed
+    # simplification of the geometry; neither means full resolution
+    level = lod_level(zoom, tolerance)
+
+    if bbox is not None:
+        # Only what is inside the viewport, answered from the spatial index
+        try:
+            bounds = parse_bbox(bbox)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        index = await floor_spatial_index(db, floor_id)
+        if index is None:
+            raise HTTPException(status_code=404, detail="Floor not found")
+        items = simplify_items(_collection(inner), index.query_bbox(_collection(inner), bounds)[skip:skip + limit], level)
+        return compact_items(_collection(inner), items) if format == "compact" else items
+
+    version = await db.run_sync(floor_version, floor_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Floor not found")
-    
-    boundaries = floor.map_data.get("boundaries", [])
-    return boundaries[skip:skip + limit]
+
+    collection = _collection(inner)
+
+    async def build():
+        items = await db.run_sync(list_features, collection, floor_id, skip, limit, level)
+        # format=compact ships geometry as encoded polylines
+        return compact_items(collection, items) if format == "compact" else items
+
+    return await async_cached_json_response(request, (collection, floor_id, skip, limit, format, level), version, build)
+
+@router.get("/{boundary_id}")
+async def get_boundary(
+    boundary_id: str,
+    floor_id: int,
+    inner: bool = False,
+    db: AsyncSession = Depends(get_async_db)
+):
+    boundary = await db.run_sync(get_feature, _collection(inner), floor_id, boundary_id)
+    if boundary is None:
+        raise HTTPException(status_code=404, detail="Boundary not found")
+    return boundary
 
 @router.post("/")
-def create_boundary(boundary: Dict[str, Any], floor_id: int, db: Session = Depends(get_db)):
-    floor = db.query(Floor).filter(Floor.id == floor_id).first()
-    if not floor:
+def create_boundary(boundary: Dict[str, Any], floor_id: int, inner: bool = False, db: Session = Depends(get_db)):
+    version = bump_floor_version(db, floor_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Floor not found")
-    
-    # Add boundary to floor's map_data
-    if "boundaries" not in floor.map_data:
-        floor.map_data["boundaries"] = []
-    
-    floor.map_data["boundaries"].append(boundary)
+
+    add_feature(db, _collection(inner), floor_id, boundary)
     db.commit()
+    spatial_cache.update(floor_id, version, lambda index: index.add(_collection(inner), boundary))
+    tile_cache.touch(floor_id, version, item_bboxes(_collection(inner), [boundary]))
+    publish_floor_change(floor_id, version, [{"op": "add", "path": f"/{_collection(inner)}/-", "value": boundary}])
     return boundary
 
 @router.delete("/{boundary_id}")
-def delete_boundary(boundary_id: str, floor_id: int, db: Session = Depends(get_db)):
-    floor = db.query(Floor).filter(Floor.id == floor_id).first()
-    if not floor:
+def delete_boundary(boundary_id: str, floor_id: int, inner: bool = False, db: Session = Depends(get_db)):
+    version = bump_floor_version(db, floor_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Floor not found")
-    
-    # Remove boundary from floor's map_data
-    if "boundaries" in floor.map_data:
-        floor.map_data["boundaries"] = [
-            boundary for boundary in floor.map_data["boundaries"]
-            if boundary.get("id") != boundary_id
-        ]
-        db.commit()
-    
-    return {"message": "Boundary deleted successfully"} 
\ No newline at end of file
+
+    deleted = delete_feature(db, _collection(inner), floor_id, boundary_id)
+    if not deleted:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Boundary not found")
+
+    db.commit()
+    spatial_cache.update(floor_id, version, lambda index: index.remove(_collection(inner), boundary_id))
+    tile_cache.touch(floor_id, version, item_bboxes(_collection(inner), deleted))
+    publish_floor_change(floor_id, version, [{"op": "remove", "path": item_pointer(_collection(inner), boundary_id)}])
+    return {"message": "Boundary deleted successfully"}
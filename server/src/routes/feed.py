@@ -0,0 +1,59 @@
+import asyncio
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from ..services.feed import broadcaster, MAPS_TOPIC, RESYNC
+from ..services.response_cache import dumps
+
+router = APIRouter()
+
+# Comment lines sent while idle so proxies keep the stream open
+HEARTBEAT_SECONDS = 15
+
+
+def _sse(event, data):
+    return b"event: " + event.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+
+
+@router.get("/feed")
+async def get_feed(request: Request, floors: str = "", maps: bool = False):
+    """
+    Server-Sent Events stream of committed changes to the given floors
+    (floors=1,2) and, with maps=true, to the /api/maps document.
+
+    "change" events carry {floor_id, version, ops}: ops are patch operations
+    to apply on top of version - 1, or null when the floor must be re-read.
+    A "resync" event means events were dropped because the client fell
+    behind, so everything it shows should be re-read.
+    """
+    try:
+        topics = {int(floor_id) for floor_id in floors.split(",") if floor_id.strip()}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="floors must be a comma separated list of floor ids")
+    if maps:
+        topics.add(MAPS_TOPIC)
+    if not topics:
+        raise HTTPException(status_code=400, detail="Subscribe to at least one floor or to maps")
+
+    subscription = broadcaster.subscribe(topics)
+
+    async def stream():
+        try:
+            yield b"retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await subscription.get(timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                if event is RESYNC:
+                    yield _sse("resync", {})
+                else:
+                    yield _sse("change", {key: value for key, value in event.items() if key != "topic"})
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
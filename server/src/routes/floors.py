@@ -1,27 +1,226 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any
-from src.database import get_db
-from src.models.base import Floor
-from src.schemas.base import FloorCreate, FloorUpdate, FloorResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.exc import StaleDataError
+from typing import List, Dict, Any, Literal, Optional
+from datetime import datetime
+from starlette.concurrency import run_in_threadpool
+from src.database import get_db, get_async_db
+from src.models.base import Floor, FEATURE_MODELS
+from src.schemas.base import FloorCreate, FloorUpdate, FloorResponse, FloorPatch, MapPatch
+from src.services.features import floor_query, load_map_data, cached_floor_entry
+from src.services.snap import SnapIndex, snap_cache
+from src.services.feed import publish_floor_change
+from src.services.tiles import tile_cache
+from src.services.density import density, cell_center, DENSITY_CELL
+from src.services.floor_caches import forget_floor
+from src.services.spatial import floor_spatial_index
+from src.services.patch import apply_floor_patch, sync_map_data, PatchError, StaleVersionError
+from src.services.response_cache import async_cached_json_response, make_etag, etag_matches
+from src.services.singleflight import CoalescedCallTimeout
+from src.services.bundle import stream_floor_bundle
+from src.services.geometry import compact_map_data
+from src.services.simplify import lod_level
 
 router = APIRouter()
 
+def _floor_dict(floor: Floor, format: str, level=None):
+    data = floor.to_dict(level)
+    if format == "compact":
+        data["map_data"] = compact_map_data(data["map_data"])
+    return data
+
 @router.get("/")
-def get_floors(
+async def get_floors(
+    request: Request,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    format: Literal["full", "compact"] = "full",
+    zoom: Optional[int] = Query(None, ge=0),
+    tolerance: Optional[float] = Query(None, gt=0),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # zoom (map zoom level) or tolerance (degrees) pick a precomputed
+    # simplification of the geometry; neither means full resolution
+    level = lod_level(zoom, tolerance)
+    # The page's floor versions identify its content
+    page = (await db.execute(
+        select(Floor.id, Floor.version).order_by(Floor.id).offset(skip).limit(limit)
+    )).all()
+
+    def build(session: Session):
+        floors = floor_query(session).filter(Floor.id.in_([floor_id for floor_id, _ in page])).order_by(Floor.id).all()
+        return [_floor_dict(floor, format, level) for floor in floors]
+
+    return await async_cached_json_response(
+        request, ("floors", skip, limit, format, level), tuple(tuple(row) for row in page),
+        lambda: db.run_sync(build)
+    )
+
+@router.get("/bundle")
+async def get_floor_bundle(
+    request: Request,
+    ids: str,
+    fields: str = ",".join(FEATURE_MODELS),
+    format: Literal["full", "compact"] = "full",
+    db: AsyncSession = Depends(get_async_db)
 ):
-    floors = db.query(Floor).offset(skip).limit(limit).all()
-    return [floor.to_dict() for floor in floors]
+    """
+    Several floors in one round trip, each with only the requested
+    collections: ids=1,2,3&fields=objects,routes. Floors are streamed in id
+    order as {"floors": [{id, name, level, version, map_data}, ...]}.
+    """
+    try:
+        floor_ids = list(dict.fromkeys(int(i) for i in ids.split(",") if i.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma separated list of floor ids")
+    if not floor_ids:
+        raise HTTPException(status_code=400, detail="ids is required")
+
+    field_list = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in field_list if f not in FEATURE_MODELS]
+    if unknown or not field_list:
+        raise HTTPException(
+            status_code=400,
+            detail=f"fields must be a comma separated subset of {', '.join(FEATURE_MODELS)}"
+        )
+
+    floors = (await db.execute(
+        select(Floor.id, Floor.name, Floor.level, Floor.version)
+        .where(Floor.id.in_(floor_ids))
+        .order_by(Floor.id)
+    )).all()
+    missing = set(floor_ids) - {floor.id for floor in floors}
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Floors not found: {', '.join(map(str, sorted(missing)))}")
+
+    etag = make_etag(
+        ("bundle", tuple(sorted(floor_ids)), tuple(field_list), format),
+        tuple((floor.id, floor.version) for floor in floors)
+    )
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    return StreamingResponse(
+        stream_floor_bundle(floors, field_list, compact=format == "compact"),
+        media_type="application/json",
+        headers=headers
+    )
 
 @router.get("/{floor_id}")
-def get_floor(floor_id: int, db: Session = Depends(get_db)):
-    floor = db.query(Floor).filter(Floor.id == floor_id).first()
-    if not floor:
+async def get_floor(
+    floor_id: int,
+    request: Request,
+    format: Literal["full", "compact"] = "full",
+    zoom: Optional[int] = Query(None, ge=0),
+    tolerance: Optional[float] = Query(None, gt=0),
+    db: AsyncSession = Depends(get_async_db)
+):
+    version = await db.scalar(select(Floor.version).where(Floor.id == floor_id))
+    if version is None:
         raise HTTPException(status_code=404, detail="Floor not found")
-    return floor.to_dict()
+
+    level = lod_level(zoom, tolerance)
+
+    def build(session: Session):
+        return _floor_dict(floor_query(session).filter(Floor.id == floor_id).first(), format, level)
+
+    return await async_cached_json_response(
+        request, ("floor", floor_id, format, level), version, lambda: db.run_sync(build)
+    )
+
+@router.post("/routes:snap")
+async def snap_route_to(route: Dict[str, Any]):
+    """
+    Merge a newly drawn corridor like /{floor_id}/routes:snap, but into the
+    routes and objects sent with it, for editors whose floors live in the
+    /api/maps document rather than as Floor rows (MapBuilder).
+    Body: {"path": [...], "routes": [...], "objects": [...]}
+    """
+    path, routes, objects = route.get("path"), route.get("routes", []), route.get("objects", [])
+    if not isinstance(path, list):
+        raise HTTPException(status_code=400, detail="route.path must be a list of points")
+    if not isinstance(routes, list) or not isinstance(objects, list):
+        raise HTTPException(status_code=400, detail="routes and objects must be lists")
+
+    def merge():
+        return SnapIndex(None, None, {"routes": routes, "objects": objects}).merge_path(path)
+
+    try:
+        merged_path = await run_in_threadpool(merge)
+    except (TypeError, ValueError, OverflowError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"path": merged_path}
+
+@router.post("/{floor_id}/routes:snap")
+async def snap_route(floor_id: int, route: Dict[str, Any], db: AsyncSession = Depends(get_async_db)):
+    """
+    Merge a newly drawn corridor into the floor's existing routes: each
+    point is averaged with route points closer than MERGE_THRESHOLD unless
+    it or they are near an object. Returns the path to save with the route.
+    """
+    path = route.get("path")
+    if not isinstance(path, list):
+        raise HTTPException(status_code=400, detail="route.path must be a list of points")
+
+    version = await db.scalar(select(Floor.version).where(Floor.id == floor_id))
+    if version is None:
+        raise HTTPException(status_code=404, detail="Floor not found")
+
+    index = await cached_floor_entry(snap_cache, floor_id, version)
+    try:
+        merged_path = index.merge_path(path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {"floor_id": floor_id, "version": version, "path": merged_path}
+
+@router.get("/{floor_id}/density")
+async def get_density(
+    floor_id: int,
+    window: int = 300,
+    group: Literal["cells", "boundaries"] = "cells",
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Tracked position counts over the last `window` seconds, per grid cell
+    as [lat, lng, count] at the cell centre, or per boundary and inner
+    boundary with group=boundaries.
+    """
+    version = await db.scalar(select(Floor.version).where(Floor.id == floor_id))
+    if version is None:
+        raise HTTPException(status_code=404, detail="Floor not found")
+    try:
+        counts = density.counts(floor_id, window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if group == "cells":
+        return {
+            "floor_id": floor_id,
+            "window": window,
+            "cell_size": DENSITY_CELL,
+            "cells": [[*cell_center(cell), n] for cell, n in counts.items()]
+        }
+
+    index = await floor_spatial_index(db, floor_id)
+    totals = {"boundaries": {}, "innerBoundaries": {}}
+    for cell, n in counts.items():
+        lat, lng = cell_center(cell)
+        for collection, boundary in index.containing(lng, lat):
+            entry = totals[collection].setdefault(
+                boundary.get("id"), {"id": boundary.get("id"), "name": boundary.get("name"), "count": 0}
+            )
+            entry["count"] += n
+    return {
+        "floor_id": floor_id,
+        "window": window,
+        "boundaries": list(totals["boundaries"].values()),
+        "innerBoundaries": list(totals["innerBoundaries"].values())
+    }
 
 @router.post("/")
 def create_floor(floor: FloorCreate, db: Session = Depends(get_db)):
@@ -42,8 +241,57 @@ def update_floor(floor_id: int, floor: FloorUpdate, db: Session = Depends(get_db
     
     db.commit()
     db.refresh(db_floor)
+    tile_cache.touch(db_floor.id, db_floor.version)
+    publish_floor_change(db_floor.id, db_floor.version)
     return db_floor.to_dict()
 
+@router.patch("/")
+def patch_floors(patch: MapPatch, db: Session = Depends(get_db)):
+    """
+    Apply patches to several floors in one transaction. Either every floor
+    is still at the version its patch was made against and all of them are
+    applied, or nothing is written.
+    Body: {"floors": [{"id": 1, "version": 4, "ops": [...]}, ...]}
+    """
+    try:
+        versions = {
+            item.id: apply_floor_patch(db, item.id, item.version, item.ops)
+            for item in patch.floors
+        }
+        db.commit()
+    except StaleVersionError as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(e))
+    except PatchError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    for item in patch.floors:
+        tile_cache.touch(item.id, versions[item.id])
+        publish_floor_change(item.id, versions[item.id], [op.dict() for op in item.ops])
+    return {"message": "Map patched successfully", "versions": versions}
+
+@router.patch("/{floor_id}")
+def patch_floor(floor_id: int, patch: FloorPatch, db: Session = Depends(get_db)):
+    """
+    Apply JSON-patch style operations to one floor. Items are addressed by
+    id, e.g. {"op": "replace", "path": "/objects/marker_1/name", "value": "Exit"}.
+    Returns 409 if the floor is no longer at patch.version.
+    """
+    if not db.query(Floor.id).filter(Floor.id == floor_id).first():
+        raise HTTPException(status_code=404, detail="Floor not found")
+    try:
+        version = apply_floor_patch(db, floor_id, patch.version, patch.ops)
+        db.commit()
+    except StaleVersionError as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(e))
+    except PatchError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    tile_cache.touch(floor_id, version)
+    publish_floor_change(floor_id, version, [op.dict() for op in patch.ops])
+    return {"message": "Floor patched successfully", "version": version}
+
 @router.delete("/{floor_id}")
 def delete_floor(floor_id: int, db: Session = Depends(get_db)):
     floor = db.query(Floor).filter(Floor.id == floor_id).first()
@@ -52,10 +300,18 @@ def delete_floor(floor_id: int, db: Session = Depends(get_db)):
     
     db.delete(floor)
     db.commit()
+    forget_floor(floor_id)
+    publish_floor_change(floor_id, None, deleted=True)
     return {"message": "Floor deleted successfully"}
 
 @router.get("/api/maps")
-def get_map_data(db: Session = Depends(get_db)):
+async def get_map_data(
+    request: Request,
+    format: Literal["full", "compact"] = "full",
+    zoom: Optional[int] = Query(None, ge=0),
+    tolerance: Optional[float] = Query(None, gt=0),
+    db: AsyncSession = Depends(get_async_db)
+):
     """
     Get all map data in the format matching localStorage structure.
     Returns:
@@ -77,30 +333,42 @@ def get_map_data(db: Session = Depends(get_db)):
     }
     """
     try:
+        level = lod_level(zoom, tolerance)
         # Get all floors ordered by level
-        floors = db.query(Floor).order_by(Floor.level).all()
-        
-        # Format floors list
-        floors_list = [
-            {
-                "id": f"floor_{floor.level}",
-                "name": floor.name
+        floors = (await db.execute(
+            select(Floor.id, Floor.level, Floor.name, Floor.version).order_by(Floor.level)
+        )).all()
+
+        async def build():
+            # Format floors list
+            floors_list = [
+                {
+                    "id": f"floor_{floor.level}",
+                    "name": floor.name
+                }
+                for floor in floors
+            ]
+            
+            # Format floor data
+            map_data = await db.run_sync(load_map_data, [floor.id for floor in floors], level)
+            floor_data = {
+                f"floor_{floor.level}": (
+                    compact_map_data(map_data[floor.id]) if format == "compact" else map_data[floor.id]
+                )
+                for floor in floors
             }
-            for floor in floors
-        ]
-        
-        # Format floor data
-        floor_data = {
-            f"floor_{floor.level}": floor.map_data
-            for floor in floors
-        }
-        
-        # Return data in localStorage format
-        return {
-            "floors": floors_list,
-            "floorData": floor_data,
-            "selectedFloor": floors_list[0]["id"] if floors_list else None
-        }
+            
+            # Return data in localStorage format
+            return {
+                "floors": floors_list,
+                "floorData": floor_data,
+                "selectedFloor": floors_list[0]["id"] if floors_list else None
+            }
+
+        version = tuple((floor.id, floor.version) for floor in floors)
+        return await async_cached_json_response(request, ("floor_maps", format, level), version, build)
+    except CoalescedCallTimeout:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -126,25 +394,58 @@ def save_map_data(data: Dict[str, Any], db: Session = Depends(get_db)):
     }
     """
     try:
-        # Delete all existing floors
-        db.query(Floor).delete()
-        db.commit()
+        # Match saved floors to existing ones by level and write only what
+        # changed, all in one transaction
+        existing = {}
+        for db_floor in db.query(Floor).order_by(Floor.id).all():
+            existing.setdefault(db_floor.level, []).append(db_floor)
 
-        # Create new floors with their data
+        updated_floors = 0
+        changed_floors = []
+        deleted_ids = []
         for floor in data["floors"]:
             # Extract level from floor id (e.g., "floor_1" -> 1)
             level = int(floor["id"].split("_")[1])
             floor_data = data["floorData"][floor["id"]]
-            
-            new_floor = Floor(
-                name=floor["name"],
-                level=level,
-                map_data=floor_data
-            )
-            db.add(new_floor)
-        
+
+            db_floor = existing[level].pop(0) if existing.get(level) else None
+            if db_floor is None:
+                db.add(Floor(
+                    name=floor["name"],
+                    level=level,
+                    map_data=floor_data
+                ))
+                updated_floors += 1
+                continue
+
+            changed = sync_map_data(db, db_floor, floor_data)
+            if db_floor.name != floor["name"]:
+                db_floor.name = floor["name"]
+                changed = True
+            if changed:
+                # Bumps the floor version; fails if another save got there first
+                db_floor.updated_at = datetime.utcnow()
+                changed_floors.append(db_floor)
+                updated_floors += 1
+
+        # Floors missing from the payload were removed in the builder
+        for leftovers in existing.values():
+            for db_floor in leftovers:
+                db.delete(db_floor)
+                deleted_ids.append(db_floor.id)
+                updated_floors += 1
+
         db.commit()
-        return {"message": "Map data saved successfully"}
+        for db_floor in changed_floors:
+            tile_cache.touch(db_floor.id, db_floor.version)
+            publish_floor_change(db_floor.id, db_floor.version)
+        for floor_id in deleted_ids:
+            forget_floor(floor_id)
+            publish_floor_change(floor_id, None, deleted=True)
+        return {"message": "Map data saved successfully", "updated_floors": updated_floors}
+    except StaleDataError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Map was modified by another save, reload and retry")
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
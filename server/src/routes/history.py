@@ -0,0 +1,57 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from ..database import get_async_db
+from ..models.base import MapData
+from ..services.history import list_versions, version_diff
+from ..services.response_cache import async_cached_json_response
+
+router = APIRouter()
+
+async def _latest(db: AsyncSession):
+    latest = (await db.execute(
+        select(MapData.id, MapData.version).order_by(MapData.id.desc()).limit(1)
+    )).first()
+    if latest is None:
+        raise HTTPException(status_code=404, detail="No map saved yet")
+    return latest
+
+@router.get("/maps/history")
+async def get_map_history(
+    before: Optional[int] = Query(None, ge=1),
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Saved versions of the map, newest first; page with before=<oldest version seen>"""
+    map_id, version = await _latest(db)
+    versions = await db.run_sync(list_versions, map_id, before, limit)
+    return {"current_version": version, "versions": versions}
+
+@router.get("/maps/diff")
+async def get_map_diff(
+    request: Request,
+    from_version: int = Query(..., ge=1),
+    to_version: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Changes between two saved versions of the map (to_version defaults to
+    the current one) as ["set", path, value], ["remove", path] and
+    ["splice", path, start, delete_count, items] ops, applied in order.
+    Paths are lists of keys and list indices.
+    """
+    map_id, current = await _latest(db)
+    to_version = current if to_version is None else to_version
+    if max(from_version, to_version) > current:
+        raise HTTPException(status_code=404, detail=f"Map is at version {current}")
+
+    async def build():
+        ops = await db.run_sync(version_diff, map_id, from_version, to_version)
+        if ops is None:
+            raise HTTPException(status_code=404, detail="Version is not in the map history")
+        return {"from_version": from_version, "to_version": to_version, "ops": ops}
+
+    # A diff between two saved versions never changes
+    key = ("maps-diff", map_id, from_version, to_version)
+    return await async_cached_json_response(request, key, to_version, build)
@@ -1,54 +1,87 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any
-from ..database import get_db
-from ..models.base import Floor
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Dict, Any, Optional
+from ..database import get_db, get_async_db
+from ..services.features import (
+    floor_version, bump_floor_version, list_features, get_feature, add_feature, delete_feature
+)
+from ..services.response_cache import async_cached_json_response
+from ..services.tiles import tile_cache, item_bboxes
+from ..services.feed import publish_floor_change, item_pointer
+from ..services.spatial import spatial_cache, floor_spatial_index, parse_bbox
+from ..services.search import search_cache
 
 router = APIRouter()
 
 @router.get("/")
-def get_markers(
+async def get_markers(
+    request: Request,
     floor_id: int = None,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    bbox: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
     if floor_id is None:
         raise HTTPException(status_code=400, detail="floor_id is required")
-    
-    floor = db.query(Floor).filter(Floor.id == floor_id).first()
-    if not floor:
+
+    if bbox is not None:
+        # Only what is inside the viewport, answered from the spatial index
+        try:
+            bounds = parse_bbox(bbox)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        index = await floor_spatial_index(db, floor_id)
+        if index is None:
+            raise HTTPException(status_code=404, detail="Floor not found")
+        return index.query_bbox("objects", bounds)[skip:skip + limit]
+
+    version = await db.run_sync(floor_version, floor_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Floor not found")
-    
-    markers = floor.map_data.get("objects", [])
-    return markers[skip:skip + limit]
+
+    collection = "objects"
+    return await async_cached_json_response(
+        request, (collection, floor_id, skip, limit), version,
+        lambda: db.run_sync(list_features, collection, floor_id, skip, limit)
+    )
+
+@router.get("/{marker_id}")
+async def get_marker(marker_id: str, floor_id: int, db: AsyncSession = Depends(get_async_db)):
+    marker = await db.run_sync(get_feature, "objects", floor_id, marker_id)
+    if marker is None:
+        raise HTTPException(status_code=404, detail="Marker not found")
+    return marker
 
 @router.post("/")
 def create_marker(marker: Dict[str, Any], floor_id: int, db: Session = Depends(get_db)):
-    floor = db.query(Floor).filter(Floor.id == floor_id).first()
-    if not floor:
+    version = bump_floor_version(db, floor_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Floor not found")
-    
-    # Add marker to floor's map_data
-    if "objects" not in floor.map_data:
-        floor.map_data["objects"] = []
-    
-    floor.map_data["objects"].append(marker)
+
+    add_feature(db, "objects", floor_id, marker)
     db.commit()
+    spatial_cache.update(floor_id, version, lambda index: index.add("objects", marker))
+    search_cache.update(floor_id, version, lambda index: index.add(marker))
+    tile_cache.touch(floor_id, version, item_bboxes("objects", [marker]))
+    publish_floor_change(floor_id, version, [{"op": "add", "path": "/objects/-", "value": marker}])
     return marker
 
 @router.delete("/{marker_id}")
 def delete_marker(marker_id: str, floor_id: int, db: Session = Depends(get_db)):
-    floor = db.query(Floor).filter(Floor.id == floor_id).first()
-    if not floor:
+    version = bump_floor_version(db, floor_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Floor not found")
-    
-    # Remove marker from floor's map_data
-    if "objects" in floor.map_data:
-        floor.map_data["objects"] = [
-            obj for obj in floor.map_data["objects"]
-            if obj.get("id") != marker_id
-        ]
-        db.commit()
-    
-    return {"message": "Marker deleted successfully"} 
\ No newline at end of file
+
+    deleted = delete_feature(db, "objects", floor_id, marker_id)
+    if not deleted:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Marker not found")
+
+    db.commit()
+    spatial_cache.update(floor_id, version, lambda index: index.remove("objects", marker_id))
+    search_cache.update(floor_id, version, lambda index: index.remove(marker_id))
+    tile_cache.touch(floor_id, version, item_bboxes("objects", deleted))
+    publish_floor_change(floor_id, version, [{"op": "remove", "path": item_pointer("objects", marker_id)}])
+    return {"message": "Marker deleted successfully"}
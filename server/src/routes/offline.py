@@ -0,0 +1,62 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from ..database import get_async_db
+from ..models.base import MapData
+from ..services.offline import bundle_store
+from ..services.response_cache import etag_matches
+
+router = APIRouter()
+
+BUNDLE_MEDIA_TYPE = "application/octet-stream"
+
+async def _latest(db: AsyncSession):
+    latest = (await db.execute(
+        select(MapData.id, MapData.version).order_by(MapData.id.desc()).limit(1)
+    )).first()
+    if latest is None:
+        raise HTTPException(status_code=404, detail="No map saved yet")
+    return latest
+
+@router.get("/maps/bundle")
+async def get_bundle(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    The current map compiled into a memory-mappable binary bundle
+    (see services/offline.py for the layout). X-Map-Version tells which
+    version it is, to ask for deltas from later.
+    """
+    map_id, version = await _latest(db)
+    etag = f'"bundle-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Map-Version": str(version)}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    path = await run_in_threadpool(bundle_store.bundle, map_id, version)
+    if path is None:
+        data = await db.scalar(select(MapData.data).where(MapData.id == map_id))
+        path = await run_in_threadpool(bundle_store.bundle, map_id, version, data or {})
+    return FileResponse(path, media_type=BUNDLE_MEDIA_TYPE, headers=headers)
+
+@router.get("/maps/bundle/delta")
+async def get_bundle_delta(from_version: int, db: AsyncSession = Depends(get_async_db)):
+    """
+    Binary delta from the bundle of from_version to the current one.
+    204 if from_version is current; 410 if that version is no longer kept,
+    in which case the client downloads the full bundle again.
+    """
+    map_id, version = await _latest(db)
+    headers = {"X-Map-Version": str(version), "Cache-Control": "no-cache"}
+    if from_version == version:
+        return Response(status_code=204, headers=headers)
+    if from_version > version:
+        raise HTTPException(status_code=400, detail="from_version is newer than the current map")
+
+    if await run_in_threadpool(bundle_store.bundle, map_id, version) is None:
+        data = await db.scalar(select(MapData.data).where(MapData.id == map_id))
+        await run_in_threadpool(bundle_store.bundle, map_id, version, data or {})
+    path = await run_in_threadpool(bundle_store.delta, map_id, from_version, version)
+    if path is None:
+        raise HTTPException(status_code=410, detail="Base version no longer available; download the full bundle")
+    return FileResponse(path, media_type=BUNDLE_MEDIA_TYPE, headers=headers)
@@ -1,54 +1,97 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any
-from ..database import get_db
-from ..models.base import Floor
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Dict, Any, Optional, Literal
+from ..database import get_db, get_async_db
+from ..services.features import (
+    floor_version, bump_floor_version, list_features, get_feature, add_feature, delete_feature
+)
+from ..services.response_cache import async_cached_json_response
+from ..services.geometry import compact_items
+from ..services.simplify import lod_level, simplify_items
+from ..services.tiles import tile_cache, item_bboxes
+from ..services.feed import publish_floor_change, item_pointer
+from ..services.spatial import spatial_cache, floor_spatial_index, parse_bbox
 
 router = APIRouter()
 
 @router.get("/")
-def get_paths(
+async def get_paths(
+    request: Request,
     floor_id: int = None,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    bbox: Optional[str] = None,
+    format: Literal["full", "compact"] = "full",
+    zoom: Optional[int] = Query(None, ge=0),
+    tolerance: Optional[float] = Query(None, gt=0),
+    db: AsyncSession = Depends(get_async_db)
 ):
     if floor_id is None:
         raise HTTPException(status_code=400, detail="floor_id is required")
-    
-    floor = db.query(Floor).filter(Floor.id == floor_id).first()
-    if not floor:
+
+    # zoom (map zoom level) or tolerance (degrees) pick a precomputed
+    # simplification of the geometry; neither means full resolution
+    level = lod_level(zoom, tolerance)
+
+    if bbox is not None:
+        # Only what is inside the viewport, answered from the spatial index
+        try:
+            bounds = parse_bbox(bbox)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        index = await floor_spatial_index(db, floor_id)
+        if index is None:
+            raise HTTPException(status_code=404, detail="Floor not found")
+        items = simplify_items("routes", index.query_bbox("routes", bounds)[skip:skip + limit], level)
+        return compact_items("routes", items) if format == "compact" else items
+
+    version = await db.run_sync(floor_version, floor_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Floor not found")
-    
-    paths = floor.map_data.get("routes", [])
-    return paths[skip:skip + limit]
+
+    collection = "routes"
+
+    async def build():
+        items = await db.run_sync(list_features, collection, floor_id, skip, limit, level)
+        # format=compact ships geometry as encoded polylines
+        return compact_items(collection, items) if format == "compact" else items
+
+    return await async_cached_json_response(request, (collection, floor_id, skip, limit, format, level), version, build)
+
+@router.get("/{path_id}")
+async def get_path(path_id: str, floor_id: int, db: AsyncSession = Depends(get_async_db)):
+    path = await db.run_sync(get_feature, "routes", floor_id, path_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Path not found")
+    return path
 
 @router.post("/")
 def create_path(path: Dict[str, Any], floor_id: int, db: Session = Depends(get_db)):
-    floor = db.query(Floor).filter(Floor.id == floor_id).first()
-    if not floor:
+    version = bump_floor_version(db, floor_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Floor not found")
-    
-    # Add path to floor's map_data
-    if "routes" not in floor.map_data:
-        floor.map_data["routes"] = []
-    
-    floor.map_data["routes"].append(path)
+
+    add_feature(db, "routes", floor_id, path)
     db.commit()
+    spatial_cache.update(floor_id, version, lambda index: index.add("routes", path))
+    tile_cache.touch(floor_id, version, item_bboxes("routes", [path]))
+    publish_floor_change(floor_id, version, [{"op": "add", "path": "/routes/-", "value": path}])
     return path
 
 @router.delete("/{path_id}")
 def delete_path(path_id: str, floor_id: int, db: Session = Depends(get_db)):
-    floor = db.query(Floor).filter(Floor.id == floor_id).first()
-    if not floor:
+    version = bump_floor_version(db, floor_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Floor not found")
-    
-    # Remove path from floor's map_data
-    if "routes" in floor.map_data:
-        floor.map_data["routes"] = [
-            route for route in floor.map_data["routes"]
-            if route.get("id") != path_id
-        ]
-        db.commit()
-    
-    return {"message": "Path deleted successfully"} 
\ No newline at end of file
+
+    deleted = delete_feature(db, "routes", floor_id, path_id)
+    if not deleted:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Path not found")
+
+    db.commit()
+    spatial_cache.update(floor_id, version, lambda index: index.remove("routes", path_id))
+    tile_cache.touch(floor_id, version, item_bboxes("routes", deleted))
+    publish_floor_change(floor_id, version, [{"op": "remove", "path": item_pointer("routes", path_id)}])
+    return {"message": "Path deleted successfully"}
@@ -0,0 +1,165 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from math import inf
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from starlette.concurrency import run_in_threadpool
+from ..database import get_async_db
+from ..models.base import Floor
+from ..schemas.base import DistanceMatrixRequest
+from ..services.routing import graph_cache, shortest_path, distance_matrix
+from ..services.facilities import facility_cache
+from ..services.station import station_cache
+from ..services.features import cached_floor_entry
+
+router = APIRouter()
+
+# Largest origins x destinations matrix computed in one request
+MAX_MATRIX_CELLS = 250000
+
+async def _station(db: AsyncSession):
+    floors = (await db.execute(select(Floor.id, Floor.level, Floor.version))).all()
+    graphs = [
+        (floor_id, level, await cached_floor_entry(graph_cache, floor_id, version))
+        for floor_id, level, version in floors
+    ]
+    # Connecting the floors is CPU-bound too
+    station = station_cache.peek(graphs)
+    if station is None:
+        station = await run_in_threadpool(station_cache.get, graphs)
+    return station
+
+@router.get("")
+async def get_route(
+    from_id: str = Query(..., alias="from"),
+    to_id: str = Query(..., alias="to"),
+    floor_id: Optional[int] = None,
+    accessible: bool = False,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Shortest walking route between two objects.
+    With floor_id the search stays on that floor; without it the route may
+    change levels through stairs, escalators and elevators. accessible=true
+    only changes levels by elevator.
+    """
+    if floor_id is None:
+        return _station_route(await _station(db), from_id, to_id, accessible)
+
+    version = await db.scalar(select(Floor.version).where(Floor.id == floor_id))
+    if version is None:
+        raise HTTPException(status_code=404, detail="Floor not found")
+
+    graph = await cached_floor_entry(graph_cache, floor_id, version)
+
+    source = graph.object_nodes.get(from_id)
+    target = graph.object_nodes.get(to_id)
+    if source is None or target is None:
+        raise HTTPException(status_code=404, detail="Object not found")
+
+    result = shortest_path(graph, source, target)
+    if result is None:
+        raise HTTPException(status_code=404, detail="No route found between these objects")
+
+    distance, nodes = result
+    return {
+        "floor_id": floor_id,
+        "version": version,
+        "from": from_id,
+        "to": to_id,
+        "distance": round(distance, 2),
+        "path": [graph.point(node) for node in nodes],
+        "objects": [graph.node_objects[node] for node in nodes if node in graph.node_objects]
+    }
+
+@router.post("/matrix")
+async def get_distance_matrix(request: DistanceMatrixRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Walking distances in metres from every origin object to every
+    destination object of a floor, as distances[origin][destination],
+    null where there is no route.
+    """
+    if len(request.origins) * len(request.destinations) > MAX_MATRIX_CELLS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_MATRIX_CELLS} origin/destination pairs")
+
+    version = await db.scalar(select(Floor.version).where(Floor.id == request.floor_id))
+    if version is None:
+        raise HTTPException(status_code=404, detail="Floor not found")
+
+    graph = await cached_floor_entry(graph_cache, request.floor_id, version)
+    missing = [
+        object_id for object_id in dict.fromkeys(request.origins + request.destinations)
+        if object_id not in graph.object_nodes
+    ]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Objects not found: {', '.join(missing)}")
+
+    rows = await run_in_threadpool(
+        distance_matrix, graph,
+        [graph.object_nodes[object_id] for object_id in request.origins],
+        [graph.object_nodes[object_id] for object_id in request.destinations],
+    )
+    return {
+        "floor_id": request.floor_id,
+        "version": version,
+        "origins": request.origins,
+        "destinations": request.destinations,
+        "distances": [[round(d, 2) if d < inf else None for d in row] for row in rows]
+    }
+
+@router.get("/facilities")
+async def get_nearest_facilities(
+    floor_id: int,
+    from_id: str = Query(..., alias="from"),
+    type: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    The closest object of each type (or only of type) by walking distance
+    from an object, e.g. the nearest toilet, exit and elevator from a
+    platform. Answered from a table precomputed per floor version.
+    """
+    version = await db.scalar(select(Floor.version).where(Floor.id == floor_id))
+    if version is None:
+        raise HTTPException(status_code=404, detail="Floor not found")
+
+    table = await cached_floor_entry(facility_cache, floor_id, version)
+    nearest = table.lookup(from_id, type)
+    if nearest is None:
+        raise HTTPException(status_code=404, detail="Object not found")
+    return {
+        "floor_id": floor_id,
+        "version": version,
+        "from": from_id,
+        "nearest": {
+            facility_type: {"object": object_id, "distance": round(distance, 2)}
+            for facility_type, (object_id, distance) in nearest.items()
+        }
+    }
+
+def _station_route(station, from_id: str, to_id: str, accessible: bool):
+    try:
+        result = station.route(from_id, to_id, accessible=accessible)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Object not found")
+    if result is None:
+        raise HTTPException(status_code=404, detail="No route found between these objects")
+
+    distance, legs = result
+    response_legs = []
+    for floor_id, nodes in legs:
+        level, graph = station.floors[floor_id]
+        response_legs.append({
+            "floor_id": floor_id,
+            "level": level,
+            "path": [graph.point(node) for node in nodes],
+            "objects": [graph.node_objects[node] for node in nodes if node in graph.node_objects]
+        })
+
+    return {
+        "from": from_id,
+        "to": to_id,
+        "accessible": accessible,
+        "distance": round(distance, 2),
+        "legs": response_legs
+    }
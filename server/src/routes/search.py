@@ -0,0 +1,43 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from ..database import get_async_db
+from ..models.base import Floor
+from ..services.features import cached_floor_entry
+from ..services.search import search_cache, rank
+from ..services.spatial import check_point
+
+router = APIRouter()
+
+@router.get("/search")
+async def search(
+    q: str,
+    floor: Optional[int] = None,
+    near: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Objects whose name, type or description match q, best first, across
+    all floors or only floor. near=lat,lng ranks closer objects higher.
+    """
+    point = None
+    if near is not None:
+        try:
+            lat, lng = (float(part) for part in near.split(","))
+            check_point(lat, lng)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="near must be lat,lng as finite numbers")
+        point = (lat, lng)
+
+    query = select(Floor.id, Floor.version).order_by(Floor.id)
+    if floor is not None:
+        query = query.where(Floor.id == floor)
+    versions = (await db.execute(query)).all()
+    if floor is not None and not versions:
+        raise HTTPException(status_code=404, detail="Floor not found")
+
+    # Only floors changed since their index was built are reloaded
+    indexes = [await cached_floor_entry(search_cache, floor_id, version) for floor_id, version in versions]
+    return {"results": rank(indexes, q, near=point, limit=limit)}
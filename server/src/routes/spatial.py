@@ -0,0 +1,46 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from ..database import get_async_db
+from ..services.spatial import floor_spatial_index, check_point
+
+router = APIRouter()
+
+@router.get("/nearest")
+async def get_nearest(
+    floor_id: int,
+    lat: float,
+    lng: float,
+    type: Optional[str] = None,
+    limit: int = Query(1, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Objects closest to a point, optionally only of one type"""
+    _check_point(lat, lng)
+    index = await floor_spatial_index(db, floor_id)
+    if index is None:
+        raise HTTPException(status_code=404, detail="Floor not found")
+
+    return [
+        {"distance": round(distance, 2), "object": obj}
+        for distance, obj in index.nearest(lng, lat, type=type, limit=limit)
+    ]
+
+@router.get("/locate")
+async def locate(floor_id: int, lat: float, lng: float, db: AsyncSession = Depends(get_async_db)):
+    """Boundaries and inner boundaries that contain a point"""
+    _check_point(lat, lng)
+    index = await floor_spatial_index(db, floor_id)
+    if index is None:
+        raise HTTPException(status_code=404, detail="Floor not found")
+
+    boundaries = {"boundaries": [], "innerBoundaries": []}
+    for collection, boundary in index.containing(lng, lat):
+        boundaries[collection].append(boundary)
+    return boundaries
+
+def _check_point(lat: float, lng: float):
+    try:
+        check_point(lat, lng)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,56 @@
+from hashlib import blake2b
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from ..database import get_async_db
+from ..models.base import Floor
+from ..services.response_cache import etag_matches
+from ..services.singleflight import AsyncSingleFlight
+from ..services.spatial import spatial_cache
+from ..services.features import cached_floor_entry
+from ..services.tiles import tile_cache, build_tile, MAX_ZOOM
+
+router = APIRouter()
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+# A map view opening at a new version asks for the same tiles from many clients
+tile_flight = AsyncSingleFlight("tile")
+
+@router.get("/{floor_id}/{z}/{x}/{y}.mvt")
+async def get_tile(
+    floor_id: int,
+    z: int,
+    x: int,
+    y: int,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Mapbox vector tile of a floor with boundaries, innerBoundaries, routes
+    and objects layers, simplified to one pixel at z and clipped to the tile
+    """
+    if not 0 <= z <= MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=400, detail="Tile coordinates out of range")
+
+    version = await db.scalar(select(Floor.version).where(Floor.id == floor_id))
+    if version is None:
+        raise HTTPException(status_code=404, detail="Floor not found")
+
+    async def build():
+        index = await cached_floor_entry(spatial_cache, floor_id, version)
+        body = await run_in_threadpool(build_tile, index, z, x, y)
+        await run_in_threadpool(tile_cache.put, floor_id, version, z, x, y, body)
+        return body
+
+    body = await run_in_threadpool(tile_cache.get, floor_id, version, z, x, y)
+    if body is None:
+        body = await tile_flight.do((floor_id, version, z, x, y), build)
+
+    # Content-based, so a tile no write touched keeps its ETag across versions
+    etag = f'"{blake2b(body, digest_size=8).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=MVT_MEDIA_TYPE, headers=headers)
@@ -0,0 +1,106 @@
+import json
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from ..database import get_async_db
+from ..models.base import Floor
+from ..services.features import cached_floor_entry
+from ..services.tracking import tracker, segment_cache, parse_batch
+from ..services.density import density
+
+router = APIRouter()
+
+# Devices fused per tick when reading an NDJSON stream
+TICK_DEVICES = 1000
+
+
+async def _segment_indexes(db: AsyncSession, floor_ids):
+    """Current SegmentIndex of each existing floor among floor_ids"""
+    versions = (await db.execute(
+        select(Floor.id, Floor.version).where(Floor.id.in_(floor_ids))
+    )).all()
+
+    return {
+        floor_id: await cached_floor_entry(segment_cache, floor_id, version)
+        for floor_id, version in versions
+    }
+
+
+async def _tick(db: AsyncSession, raw_batches):
+    try:
+        batches = [parse_batch(batch) for batch in raw_batches]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    indexes = await _segment_indexes(db, {floor_id for _, floor_id, _, _ in batches})
+    try:
+        positions = await run_in_threadpool(tracker.ingest, batches, indexes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Only floors that exist feed the congestion heatmap
+    density.record([position for position in positions if position["floor_id"] in indexes])
+    return positions
+
+
+@router.post("/samples")
+async def ingest_samples(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    Fuse batched motion samples into map-matched positions.
+
+    The body is either {"devices": [batch, ...]} or, with
+    Content-Type: application/x-ndjson, one batch per line, read as it
+    arrives and fused TICK_DEVICES devices at a time. A batch is
+    {"device_id", "floor_id", "t": [ms, ...], "ax": [...], "ay": [...],
+    "az": [...], "heading": [degrees, ...]} plus a "lat"/"lng" fix, which
+    is required the first time a device reports.
+    """
+    positions = []
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        pending, pending_ids, buffer = [], set(), b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            if not chunk and buffer:
+                # End of the body without a trailing newline
+                lines.append(buffer)
+                buffer = b""
+            for line in lines:
+                if not line.strip():
+                    continue
+                batch = _parse_line(line)
+                device_id = batch.get("device_id") if isinstance(batch, dict) else None
+                # A device's later samples go into the next tick
+                if len(pending) >= TICK_DEVICES or device_id in pending_ids:
+                    positions += await _tick(db, pending)
+                    pending, pending_ids = [], set()
+                pending.append(batch)
+                pending_ids.add(device_id)
+        if pending:
+            positions += await _tick(db, pending)
+    else:
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be JSON")
+        devices = body.get("devices") if isinstance(body, dict) else None
+        if not isinstance(devices, list):
+            raise HTTPException(status_code=400, detail="devices must be a list of batches")
+        if devices:
+            positions = await _tick(db, devices)
+
+    return {"positions": positions}
+
+
+def _parse_line(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Each NDJSON line must be a JSON object")
+
+
+@router.get("/{device_id}")
+def get_position(device_id: str):
+    position = tracker.devices.position(device_id)
+    if position is None:
+        raise HTTPException(status_code=404, detail="Device not tracked")
+    return position
@@ -0,0 +1,100 @@
+from codecs import getincrementaldecoder
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.exc import StaleDataError
+from starlette.concurrency import run_in_threadpool
+from typing import Literal, Optional
+from ..database import get_db, get_async_db
+from ..models.base import Floor
+from ..services.floor_caches import forget_floor
+from ..services.feed import publish_floor_change
+from ..services.tiles import tile_cache
+from ..services.response_cache import make_etag, etag_matches
+from ..services.transfer import (
+    FeatureCollectionReader, LineReader, StationImporter, StationImportError, stream_station
+)
+
+router = APIRouter()
+
+MEDIA_TYPES = {"geojson": "application/geo+json", "ndjson": "application/x-ndjson"}
+
+@router.get("/export")
+async def export_station(
+    request: Request,
+    format: Literal["geojson", "ndjson"] = "geojson",
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Every floor and item as one GeoJSON FeatureCollection, or one Feature
+    per line with format=ndjson (see services/transfer.py for the mapping).
+    Streamed straight from the database, whatever the size of the station.
+    """
+    floors = (await db.execute(
+        select(Floor.id, Floor.name, Floor.level, Floor.version).order_by(Floor.id)
+    )).all()
+    etag = make_etag(("station", format), tuple((floor.id, floor.version) for floor in floors))
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "Content-Disposition": f'attachment; filename="station.{format}"',
+    }
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    return StreamingResponse(stream_station(floors, format), media_type=MEDIA_TYPES[format], headers=headers)
+
+@router.post("/import")
+async def import_station(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    format: Optional[Literal["geojson", "ndjson"]] = None,
+    dry_run: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Replace the station with an upload in either export format; the format
+    defaults from the Content-Type. The /api/maps document is replaced too,
+    as a new version in its history. The body is read and validated as it
+    arrives and written in batches, all in one transaction: an invalid
+    upload changes nothing. dry_run=true validates and counts only.
+    """
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        format = "ndjson" if "ndjson" in content_type or "json-seq" in content_type else "geojson"
+    reader = LineReader() if format == "ndjson" else FeatureCollectionReader()
+    decoder = getincrementaldecoder("utf-8")()
+    importer = StationImporter(db)
+
+    try:
+        await run_in_threadpool(importer.begin)
+        async for chunk in request.stream():
+            for event in reader.feed(decoder.decode(chunk)):
+                if importer.add(event):
+                    await run_in_threadpool(importer.flush)
+        for event in reader.feed(decoder.decode(b"", final=True), final=True):
+            importer.add(event)
+        summary = await run_in_threadpool(importer.finish, background_tasks, dry_run)
+    except UnicodeDecodeError:
+        db.rollback()
+        raise HTTPException(status_code=422, detail="The upload is not UTF-8")
+    except StationImportError as e:
+        db.rollback()
+        raise HTTPException(status_code=422, detail=str(e))
+    except StaleDataError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Station was modified during the import, retry")
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if not dry_run:
+        for floor_id, version in importer.changed:
+            tile_cache.touch(floor_id, version)
+            publish_floor_change(floor_id, version)
+        for floor_id in importer.deleted:
+            forget_floor(floor_id)
+            publish_floor_change(floor_id, None, deleted=True)
+    return summary
@@ -84,4 +84,24 @@ class Boundary(BoundaryBase):
     updated_at: Optional[datetime] = None
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True
+
+class PatchOperation(BaseModel):
+    op: str
+    path: str
+    value: Any = None
+
+class FloorPatch(BaseModel):
+    version: int
+    ops: List[PatchOperation]
+
+class FloorPatchItem(FloorPatch):
+    id: int
+
+class MapPatch(BaseModel):
+    floors: List[FloorPatchItem]
+
+class DistanceMatrixRequest(BaseModel):
+    floor_id: int
+    origins: List[str]
+    destinations: List[str]
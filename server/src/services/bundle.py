@@ -0,0 +1,44 @@
+from ..database import AsyncSessionLocal
+from .features import bundle_query
+from .geometry import compact_map_data
+from .response_cache import dumps
+
+
+def _floor_chunk(floor, map_data, first, compact):
+    body = dumps({
+        "id": floor.id,
+        "name": floor.name,
+        "level": floor.level,
+        "version": floor.version,
+        "map_data": compact_map_data(map_data) if compact else map_data,
+    })
+    return body if first else b"," + body
+
+
+async def stream_floor_bundle(floors, fields, compact=False):
+    """
+    Yield {"floors": [...]} for the given floor rows (ordered by id), each
+    with only the requested collections in its map_data. Items are read
+    with one streamed query and each floor is written out as soon as its
+    rows are complete, so only one floor is held in memory.
+
+    Uses its own session: the request's session is closed before the body
+    is streamed.
+    """
+    yield b'{"floors":['
+    position = 0
+    map_data = {key: [] for key in fields}
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(bundle_query([floor.id for floor in floors], fields))
+        async for floor_id, field, _, data in result:
+            while floors[position].id != floor_id:
+                yield _floor_chunk(floors[position], map_data, position == 0, compact)
+                position += 1
+                map_data = {key: [] for key in fields}
+            map_data[fields[field]].append(data)
+
+    while position < len(floors):
+        yield _floor_chunk(floors[position], map_data, position == 0, compact)
+        position += 1
+        map_data = {key: [] for key in fields}
+    yield b"]}"
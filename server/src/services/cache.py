@@ -0,0 +1,62 @@
+import threading
+from .singleflight import SingleFlight
+
+
+class FloorCache:
+    """
+    Per-floor derived structures (routing graphs, spatial indexes, ...)
+    keyed by floor version. `build(floor_id, version, map_data)` must return
+    an object with a `version` attribute; it runs only when the cached entry
+    is missing or older than the requested version, and concurrent misses
+    for the same floor version share one load and build.
+    """
+
+    def __init__(self, build, name):
+        self._build = build
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._flight = SingleFlight(name)
+
+    def peek(self, floor_id, version):
+        """The cached entry for this floor version, or None without building it"""
+        entry = self._entries.get(floor_id)
+        if entry is not None and entry.version == version:
+            return entry
+        return None
+
+    def get(self, floor_id, version, load_map_data):
+        entry = self.peek(floor_id, version)
+        if entry is not None:
+            return entry
+        return self._flight.do((floor_id, version), lambda: self._build_entry(floor_id, version, load_map_data))
+
+    def _build_entry(self, floor_id, version, load_map_data):
+        entry = self._build(floor_id, version, load_map_data() or {})
+        with self._lock:
+            current = self._entries.get(floor_id)
+            if current is None or current.version <= version:
+                self._entries[floor_id] = entry
+        return entry
+
+    def update(self, floor_id, version, apply):
+        """
+        Bring a cached entry from version - 1 to version in place by calling
+        apply(entry). If the entry is at any other version it is dropped and
+        rebuilt on the next read.
+        """
+        with self._lock:
+            entry = self._entries.get(floor_id)
+            if entry is None:
+                return
+            if entry.version == version - 1:
+                apply(entry)
+                entry.version = version
+            elif entry.version != version:
+                del self._entries[floor_id]
+
+    def invalidate(self, floor_id=None):
+        with self._lock:
+            if floor_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(floor_id, None)
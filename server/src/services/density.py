@@ -0,0 +1,130 @@
+from collections import Counter, deque
+from math import floor
+import threading
+import time
+
+# Grid cell edge in degrees (~11 m), roughly a platform width
+DENSITY_CELL = 0.0001
+
+# Recent windows are counted in 10 s buckets; longer ones only in 5 min
+# buckets, which is all that is kept of anything older than 15 minutes
+FINE_SECONDS = 10
+FINE_WINDOWS = (60, 300, 900)
+COARSE_SECONDS = 300
+COARSE_WINDOWS = (3600, 21600, 86400)
+WINDOWS = FINE_WINDOWS + COARSE_WINDOWS
+
+# New cells in one bucket beyond this are not counted, so stray positions
+# cannot grow memory without bound
+MAX_CELLS_PER_BUCKET = 20000
+
+
+def density_cell(lat, lng):
+    return (floor(lng / DENSITY_CELL), floor(lat / DENSITY_CELL))
+
+
+def cell_center(cell):
+    """(lat, lng) at the middle of a cell"""
+    return ((cell[1] + 0.5) * DENSITY_CELL, (cell[0] + 0.5) * DENSITY_CELL)
+
+
+class _Tier:
+    """
+    Time buckets at one resolution. Every window this tier serves keeps a
+    running per-cell total and the buckets it currently includes; buckets
+    are subtracted from a window's total as they age out of it, so reading
+    a window costs O(cells) and never rescans pings.
+    """
+
+    def __init__(self, bucket_seconds, windows):
+        self.bucket_seconds = bucket_seconds
+        self.windows = windows
+        self.totals = {window: Counter() for window in windows}
+        self.included = {window: deque() for window in windows}
+
+    def expire(self, now):
+        current = int(now // self.bucket_seconds)
+        for window in self.windows:
+            oldest = current - window // self.bucket_seconds
+            included, total = self.included[window], self.totals[window]
+            while included and included[0][0] <= oldest:
+                _, counts = included.popleft()
+                for cell, n in counts.items():
+                    remaining = total[cell] - n
+                    if remaining > 0:
+                        total[cell] = remaining
+                    else:
+                        del total[cell]
+
+    def add(self, now, counts):
+        self.expire(now)
+        index = int(now // self.bucket_seconds)
+        newest = self.included[self.windows[0]]
+        if newest and newest[-1][0] == index:
+            bucket = newest[-1][1]
+        else:
+            bucket = Counter()
+            for window in self.windows:
+                self.included[window].append((index, bucket))
+
+        for cell, n in counts.items():
+            if cell not in bucket and len(bucket) >= MAX_CELLS_PER_BUCKET:
+                continue
+            bucket[cell] += n
+            for window in self.windows:
+                self.totals[window][cell] += n
+
+
+class FloorDensity:
+    def __init__(self):
+        self.tiers = (_Tier(FINE_SECONDS, FINE_WINDOWS), _Tier(COARSE_SECONDS, COARSE_WINDOWS))
+
+    def add(self, now, counts):
+        for tier in self.tiers:
+            tier.add(now, counts)
+
+    def counts(self, window, now):
+        for tier in self.tiers:
+            if window in tier.totals:
+                tier.expire(now)
+                return dict(tier.totals[window])
+        raise ValueError(f"window must be one of {', '.join(map(str, WINDOWS))}")
+
+
+class DensityAggregator:
+    """Position counts per floor and grid cell over sliding time windows"""
+
+    def __init__(self):
+        self._floors = {}
+        self._lock = threading.Lock()
+
+    def record(self, positions, now=None):
+        """Count positions ({"floor_id", "lat", "lng", ...}) seen at now"""
+        now = time.time() if now is None else now
+        per_floor = {}
+        for position in positions:
+            cell = density_cell(position["lat"], position["lng"])
+            per_floor.setdefault(position["floor_id"], Counter())[cell] += 1
+
+        with self._lock:
+            for floor_id, counts in per_floor.items():
+                density = self._floors.get(floor_id)
+                if density is None:
+                    density = self._floors[floor_id] = FloorDensity()
+                density.add(now, counts)
+
+    def counts(self, floor_id, window, now=None):
+        """{cell: count} for a floor over the last window seconds"""
+        if window not in WINDOWS:
+            raise ValueError(f"window must be one of {', '.join(map(str, WINDOWS))}")
+        now = time.time() if now is None else now
+        with self._lock:
+            density = self._floors.get(floor_id)
+            return density.counts(window, now) if density is not None else {}
+
+    def forget(self, floor_id):
+        with self._lock:
+            self._floors.pop(floor_id, None)
+
+
+density = DensityAggregator()
@@ -0,0 +1,43 @@
+from math import inf
+from .cache import FloorCache
+from .routing import graph_cache, two_nearest_sources
+
+
+class FacilityTable:
+    """
+    Nearest object of every type from every object of one floor, by
+    walking distance, never the object itself. Built with one multi-source
+    sweep per type, so a lookup afterwards is two dict reads.
+    """
+
+    def __init__(self, floor_id, version, map_data):
+        self.floor_id = floor_id
+        self.version = version
+        graph = graph_cache.get(floor_id, version, lambda: map_data)
+
+        by_type = {}
+        for object_id, object_type in graph.object_types.items():
+            if object_type is not None:
+                by_type.setdefault(object_type, []).append(object_id)
+
+        # object id -> {type: (facility id, metres)}
+        self.nearest = {object_id: {} for object_id in graph.object_nodes}
+        for object_type, facilities in by_type.items():
+            labels = two_nearest_sources(graph, [graph.object_nodes[f] for f in facilities])
+            own = {object_id: index for index, object_id in enumerate(facilities)}
+            for object_id, node in graph.object_nodes.items():
+                # A facility's nearest of its own type is the closest other one
+                for dist, owner in labels:
+                    if dist[node] < inf and owner[node] != own.get(object_id, -1):
+                        self.nearest[object_id][object_type] = (facilities[owner[node]], dist[node])
+                        break
+
+    def lookup(self, object_id, object_type=None):
+        """{type: (facility id, metres)}, or only object_type's entry; None for unknown objects"""
+        table = self.nearest.get(object_id)
+        if table is None or object_type is None:
+            return table
+        return {object_type: table[object_type]} if object_type in table else {}
+
+
+facility_cache = FloorCache(FacilityTable, "facilities")
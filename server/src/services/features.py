@@ -0,0 +1,144 @@
+from datetime import datetime
+from sqlalchemy import delete, func, literal_column, select, union_all
+from sqlalchemy.orm import Session, selectinload
+from starlette.concurrency import run_in_threadpool
+from ..database import SessionLocal
+from ..models.base import Floor, FEATURE_MODELS, FEATURE_RELATIONSHIPS
+from .simplify import apply_lod
+
+def floor_query(db: Session):
+    """Floor query that loads all items of the returned floors in one query per table"""
+    return db.query(Floor).options(
+        *[selectinload(getattr(Floor, attr)) for attr in FEATURE_RELATIONSHIPS.values()]
+    )
+
+def load_map_data(db: Session, floor_ids, level=None):
+    """
+    Assemble map_data dicts for the given floors without loading the Floor
+    rows, with geometry at a level of detail from lod_level() if given
+    """
+    floor_ids = list(floor_ids)
+    result = {floor_id: {key: [] for key in FEATURE_MODELS} for floor_id in floor_ids}
+    if not floor_ids:
+        return result
+
+    for key, model in FEATURE_MODELS.items():
+        if level is None:
+            rows = (
+                db.query(model.floor_id, model.data)
+                .filter(model.floor_id.in_(floor_ids))
+                .order_by(model.floor_id, model.seq)
+            )
+            for floor_id, data in rows:
+                result[floor_id][key].append(data)
+            continue
+        rows = (
+            db.query(model.floor_id, model.data, model.lod)
+            .filter(model.floor_id.in_(floor_ids))
+            .order_by(model.floor_id, model.seq)
+        )
+        for floor_id, data, lod in rows:
+            result[floor_id][key].append(apply_lod(key, data, lod, level))
+    return result
+
+async def cached_floor_entry(cache, floor_id, version):
+    """
+    A FloorCache's entry for a floor version, for async handlers. Building
+    one is CPU-bound, so on a miss the items are loaded with a sync session
+    and the entry built in the threadpool, keeping the event loop free.
+    """
+    entry = cache.peek(floor_id, version)
+    if entry is None:
+        entry = await run_in_threadpool(_fill_floor_entry, cache, floor_id, version)
+    return entry
+
+def _fill_floor_entry(cache, floor_id, version):
+    with SessionLocal() as db:
+        return cache.get(floor_id, version, lambda: load_map_data(db, [floor_id])[floor_id])
+
+def bundle_query(floor_ids, fields):
+    """
+    A single UNION ALL select of (floor_id, field, seq, data) over the
+    feature tables named in fields, where field is the position in fields.
+    Rows come ordered by floor, field and seq so they can be streamed.
+    """
+    selects = [
+        select(
+            model.floor_id.label("floor_id"),
+            literal_column(str(position)).label("field"),
+            model.seq.label("seq"),
+            model.data.label("data"),
+        ).where(model.floor_id.in_(floor_ids))
+        for position, model in enumerate(FEATURE_MODELS[key] for key in fields)
+    ]
+    return union_all(*selects).order_by("floor_id", "field", "seq")
+
+def bump_floor_version(db: Session, floor_id: int):
+    """
+    Mark a floor as changed after one of its items was written.
+    Returns the new version, or None if the floor does not exist.
+    """
+    updated = (
+        db.query(Floor)
+        .filter(Floor.id == floor_id)
+        .update(
+            {Floor.version: Floor.version + 1, Floor.updated_at: datetime.utcnow()},
+            synchronize_session=False
+        )
+    )
+    if not updated:
+        return None
+    return db.query(Floor.version).filter(Floor.id == floor_id).scalar()
+
+def floor_version(db: Session, floor_id: int):
+    """Current version of a floor, or None if it does not exist"""
+    return db.query(Floor.version).filter(Floor.id == floor_id).scalar()
+
+def list_features(db: Session, key: str, floor_id: int, skip: int = 0, limit: int = 100, level=None):
+    model = FEATURE_MODELS[key]
+    if level is None:
+        rows = (
+            db.query(model.data)
+            .filter(model.floor_id == floor_id)
+            .order_by(model.seq)
+            .offset(skip)
+            .limit(limit)
+        )
+        return [data for data, in rows]
+    rows = (
+        db.query(model.data, model.lod)
+        .filter(model.floor_id == floor_id)
+        .order_by(model.seq)
+        .offset(skip)
+        .limit(limit)
+    )
+    return [apply_lod(key, data, lod, level) for data, lod in rows]
+
+def get_feature(db: Session, key: str, floor_id: int, uid: str):
+    model = FEATURE_MODELS[key]
+    return (
+        db.query(model.data)
+        .filter(model.floor_id == floor_id, model.uid == uid)
+        .order_by(model.seq)
+        .limit(1)
+        .scalar()
+    )
+
+def add_feature(db: Session, key: str, floor_id: int, item):
+    """Append an item to the end of a floor's list. Does not commit."""
+    model = FEATURE_MODELS[key]
+    last = db.query(func.max(model.seq)).filter(model.floor_id == floor_id).scalar()
+    feature = model.from_item(item, 0 if last is None else last + 1)
+    feature.floor_id = floor_id
+    db.add(feature)
+    return feature
+
+def delete_feature(db: Session, key: str, floor_id: int, uid: str) -> list:
+    """Delete the items with the given id from a floor and return them. Does not commit."""
+    model = FEATURE_MODELS[key]
+    rows = db.execute(
+        delete(model)
+        .where(model.floor_id == floor_id, model.uid == uid)
+        .returning(model.data)
+    )
+    return [data for data, in rows]
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from ..database import engine, SQLALCHEMY_DATABASE_URL
+from .response_cache import dumps
+
+logger = logging.getLogger(__name__)
+
+# "memory" fans out within this process only; "postgres" goes through
+# LISTEN/NOTIFY so subscribers on every worker see every write
+FEED_BACKEND = os.getenv("FEED_BACKEND", "memory")
+# Events buffered per connection before it is told to resync instead
+FEED_QUEUE_SIZE = int(os.getenv("FEED_QUEUE_SIZE", 100))
+
+# Topic for the whole-map document saved through /api/maps
+MAPS_TOPIC = "maps"
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+NOTIFY_MAX_BYTES = 7900
+
+RESYNC = {"type": "resync"}
+
+
+class Subscription:
+    """
+    One connection's view of the feed: the topics it follows and a bounded
+    queue of events. When the consumer falls FEED_QUEUE_SIZE events behind,
+    the backlog is dropped and replaced by a single resync event telling it
+    to re-read what it shows.
+    """
+
+    def __init__(self, topics, maxsize=FEED_QUEUE_SIZE):
+        self.topics = frozenset(topics)
+        self.queue = asyncio.Queue(maxsize)
+        self.loop = asyncio.get_running_loop()
+        self.dropped = 0
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    def deliver(self, event):
+        # Writes commit on threadpool threads; the queue belongs to the loop
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class Broadcaster:
+    """
+    In-process fan-out of change events to the subscriptions of their
+    topic, and to listeners that get every event (to drop stale caches)
+    """
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def subscribe(self, topics):
+        subscription = Subscription(topics)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def add_listener(self, listener):
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def publish(self, event):
+        self.deliver(event)
+
+    def deliver(self, event):
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception:
+                logger.exception("Change listener failed for %s", event["topic"])
+        topic = event["topic"]
+        with self._lock:
+            subscriptions = [s for s in self._subscriptions if topic in s.topics]
+        for subscription in subscriptions:
+            try:
+                subscription.deliver(event)
+            except RuntimeError:
+                # Its event loop is already closed
+                self.unsubscribe(subscription)
+
+
+class PostgresBroadcaster(Broadcaster):
+    """
+    Publishes with NOTIFY and delivers what a LISTEN connection receives,
+    including this worker's own events.
+    """
+
+    CHANNEL = "map_changes"
+
+    def __init__(self, database_url=SQLALCHEMY_DATABASE_URL):
+        super().__init__()
+        self._dsn = make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+        self._connection = None
+
+    async def start(self):
+        import asyncpg
+
+        self._connection = await asyncpg.connect(self._dsn)
+        await self._connection.add_listener(self.CHANNEL, self._on_notify)
+
+    async def stop(self):
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            self.deliver(json.loads(payload))
+        except (ValueError, KeyError):
+            logger.warning("Ignoring malformed change notification")
+
+    def publish(self, event):
+        payload = dumps(event)
+        if len(payload) >= NOTIFY_MAX_BYTES:
+            # Too big to carry the delta; subscribers re-read instead
+            payload = dumps({**event, "ops": None})
+        with engine.begin() as conn:
+            conn.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": self.CHANNEL, "payload": payload.decode()}
+            )
+
+
+def create_broadcaster(backend=FEED_BACKEND):
+    if backend == "postgres":
+        return PostgresBroadcaster()
+    return Broadcaster()
+
+
+broadcaster = create_broadcaster()
+
+
+def publish_floor_change(floor_id, version, ops=None, deleted=False):
+    """
+    Announce a committed write to a floor. ops are the patch operations
+    (see services/patch.py) that bring a subscriber from version - 1 to
+    version; None means the change is too broad to describe and the floor
+    should be re-read.
+    """
+    event = {"topic": floor_id, "floor_id": floor_id, "version": version, "ops": ops}
+    if deleted:
+        event["deleted"] = True
+    _publish(event)
+
+
+def publish_map_change(version):
+    """Announce a new version of the /api/maps document"""
+    _publish({"topic": MAPS_TOPIC, "version": version, "ops": None})
+
+
+def _publish(event):
+    # A failed notification must not fail a write that already committed
+    try:
+        broadcaster.publish(event)
+    except Exception:
+        logger.exception("Failed to publish change event for %s", event["topic"])
+
+
+def item_pointer(key, uid):
+    """JSON pointer to an item, escaped as services/patch.py expects"""
+    return f"/{key}/" + str(uid).replace("~", "~0").replace("/", "~1")
@@ -0,0 +1,19 @@
+from .routing import graph_cache
+from .spatial import spatial_cache
+from .search import search_cache
+from .snap import snap_cache
+from .facilities import facility_cache
+from .tracking import segment_cache
+from .density import density
+from .tiles import tile_cache
+
+# Derived structures every floor gets on its first read of each kind
+FLOOR_CACHES = (graph_cache, spatial_cache, search_cache, snap_cache, facility_cache, segment_cache)
+
+
+def forget_floor(floor_id):
+    """Drop everything this worker holds for a deleted floor"""
+    for cache in FLOOR_CACHES:
+        cache.invalidate(floor_id)
+    density.forget(floor_id)
+    tile_cache.forget(floor_id)
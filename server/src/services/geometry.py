@@ -0,0 +1,105 @@
+from array import array
+
+# Compact geometry: coordinates quantized to 1e-7 degrees (~1 cm) and
+# delta-encoded with the encoded polyline algorithm
+POLYLINE_PRECISION = 7
+COMPACT_ENCODING = f"polyline{POLYLINE_PRECISION}"
+
+
+def encode_polyline(points, precision=POLYLINE_PRECISION):
+    """Encode [(lat, lng), ...] as an encoded polyline string"""
+    scale = 10 ** precision
+    values = array("q")
+    for lat, lng in points:
+        values.append(round(lat * scale))
+        values.append(round(lng * scale))
+
+    chunks = []
+    previous_lat = previous_lng = 0
+    for i in range(0, len(values), 2):
+        lat, lng = values[i], values[i + 1]
+        _encode_value(lat - previous_lat, chunks)
+        _encode_value(lng - previous_lng, chunks)
+        previous_lat, previous_lng = lat, lng
+    return "".join(chunks)
+
+
+def _encode_value(value, chunks):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+
+
+def decode_polyline(encoded, precision=POLYLINE_PRECISION):
+    """Decode an encoded polyline string to [(lat, lng), ...]"""
+    scale = 10 ** precision
+    points = []
+    index = lat = lng = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        points.append((lat / scale, lng / scale))
+    return points
+
+
+def compact_route(route):
+    """
+    Route with its path of {x, y, merged, count} points replaced by an
+    encoded polyline. Merge counts, when present, become a parallel list;
+    `merged` is implied by count > 1 as in the builder.
+    """
+    points = [
+        p for p in route.get("path", []) or []
+        if isinstance(p, dict) and p.get("x") is not None and p.get("y") is not None
+    ]
+    compact = {**route, "path": encode_polyline((p["y"], p["x"]) for p in points), "encoding": COMPACT_ENCODING}
+    if any("count" in p for p in points):
+        compact["counts"] = [p.get("count", 1) for p in points]
+    return compact
+
+
+def compact_boundary(boundary):
+    """Boundary with each GeoJSON ring of [lng, lat] pairs replaced by an encoded polyline"""
+    geometry = boundary.get("geometry")
+    if not isinstance(geometry, dict) or geometry.get("type") != "Polygon":
+        return boundary
+    rings = [
+        encode_polyline((c[1], c[0]) for c in ring if isinstance(c, (list, tuple)) and len(c) >= 2)
+        for ring in geometry.get("coordinates") or []
+    ]
+    return {**boundary, "geometry": {**geometry, "coordinates": rings}, "encoding": COMPACT_ENCODING}
+
+
+COMPACTORS = {
+    "routes": compact_route,
+    "boundaries": compact_boundary,
+    "innerBoundaries": compact_boundary,
+}
+
+
+def compact_items(collection, items):
+    compactor = COMPACTORS.get(collection)
+    if compactor is None:
+        return items
+    return [compactor(item) if isinstance(item, dict) else item for item in items]
+
+
+def compact_map_data(map_data):
+    """A floor's map_data with every route and boundary geometry compacted"""
+    if not isinstance(map_data, dict):
+        return map_data
+    return {key: compact_items(key, value) if isinstance(value, list) else value for key, value in map_data.items()}
@@ -0,0 +1,220 @@
+from difflib import SequenceMatcher
+import json
+import os
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from ..models.base import MapVersion
+
+# Every saved version of the /api/maps document is kept in map_versions,
+# either as a full snapshot or as the ops turning the previous version
+# into it. A new snapshot is taken once the deltas since the last one add
+# up to its size, so history grows with the size of the edits (at most
+# twice) and any version is rebuilt from one snapshot plus deltas no
+# larger than it in total. The count cap bounds the rows read per rebuild
+# when edits are tiny.
+SNAPSHOT_MAX_DELTAS = int(os.getenv("MAP_SNAPSHOT_MAX_DELTAS", 256))
+
+SNAPSHOT = "snapshot"
+DELTA = "delta"
+
+
+def _canonical(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def _item_key(item):
+    """Items with an id are matched by it, so editing one is not a delete and an insert"""
+    if isinstance(item, dict) and "id" in item:
+        return "id:" + _canonical(item["id"])
+    return _canonical(item)
+
+
+def _same(old, new):
+    """
+    Equality that also tells 1, 1.0 and True apart, which == does not but
+    the JSON document does. == rejects most differences first in C.
+    """
+    if type(old) is not type(new) or old != new:
+        return False
+    if isinstance(old, dict):
+        return all(_same(value, new[key]) for key, value in old.items())
+    if isinstance(old, list):
+        return all(_same(a, b) for a, b in zip(old, new))
+    return True
+
+
+def _diff(old, new, path, ops):
+    if _same(old, new):
+        return
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                ops.append(["remove", path + [key]])
+        for key, value in new.items():
+            if key in old:
+                _diff(old[key], value, path + [key], ops)
+            else:
+                ops.append(["set", path + [key], value])
+    elif isinstance(old, list) and isinstance(new, list):
+        _diff_list(old, new, path, ops)
+    else:
+        ops.append(["set", path, new])
+
+
+def _diff_list(old, new, path, ops):
+    # Unchanged ends are common (one object edited among hundreds) and
+    # cheaper to skip than to hash
+    start = 0
+    while start < len(old) and start < len(new) and _same(old[start], new[start]):
+        start += 1
+    end = 0
+    while end < len(old) - start and end < len(new) - start and _same(old[-1 - end], new[-1 - end]):
+        end += 1
+    old_middle = old[start:len(old) - end]
+    new_middle = new[start:len(new) - end]
+
+    matcher = SequenceMatcher(None, [_item_key(item) for item in old_middle],
+                              [_item_key(item) for item in new_middle], autojunk=False)
+    # Emitted back to front, so each op's indices are still valid when the
+    # ops are applied in order
+    for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+        if tag == "equal" or (tag == "replace" and i2 - i1 == j2 - j1):
+            for i, j in zip(range(i2 - 1, i1 - 1, -1), range(j2 - 1, j1 - 1, -1)):
+                _diff(old_middle[i], new_middle[j], path + [start + i], ops)
+        else:
+            ops.append(["splice", path, start + i1, i2 - i1, new_middle[j1:j2]])
+
+
+def diff(old, new):
+    """
+    Ops turning the JSON document old into new:
+    ["set", path, value], ["remove", path] for a dict key, and
+    ["splice", path, start, delete_count, items] for a list. A path is a
+    list of dict keys and list indices; [] is the whole document.
+    """
+    ops = []
+    _diff(old, new, [], ops)
+    return ops
+
+
+def apply_ops(document, ops):
+    """Apply diff() ops to document, modifying it in place; returns the result"""
+    for op in ops:
+        kind, path = op[0], op[1]
+        if kind == "set" and not path:
+            document = op[2]
+            continue
+        target = document
+        for segment in path[:-1] if kind != "splice" else path:
+            target = target[segment]
+        if kind == "set":
+            target[path[-1]] = op[2]
+        elif kind == "remove":
+            del target[path[-1]]
+        elif kind == "splice":
+            start, count, items = op[2], op[3], op[4]
+            target[start:start + count] = items
+        else:
+            raise ValueError(f"Unknown op: {kind!r}")
+    return document
+
+
+def _size(value):
+    return len(_canonical(value).encode())
+
+
+def record_version(db: Session, map_id: int, version: int, previous, data, snapshot=False):
+    """
+    Add version of map_id to the history, as a delta from previous (the
+    document at version - 1, None if unknown) or as a snapshot. With
+    snapshot, always a snapshot and previous is not diffed. Does not commit.
+    """
+    if snapshot:
+        previous = None
+    snapshot = (
+        db.query(MapVersion.version, MapVersion.size)
+        .filter(MapVersion.map_id == map_id, MapVersion.kind == SNAPSHOT, MapVersion.version < version)
+        .order_by(MapVersion.version.desc())
+        .first()
+    )
+    if previous is not None and snapshot is not None:
+        count, total = (
+            db.query(func.count(MapVersion.id), func.coalesce(func.sum(MapVersion.size), 0))
+            .filter(MapVersion.map_id == map_id, MapVersion.version > snapshot.version)
+            .one()
+        )
+        # Deltas only chain onto an unbroken run of versions
+        if snapshot.version + count == version - 1 and count < SNAPSHOT_MAX_DELTAS:
+            ops = diff(previous, data)
+            size = _size(ops)
+            if total + size < snapshot.size:
+                db.add(MapVersion(map_id=map_id, version=version, kind=DELTA, data=ops, size=size))
+                return DELTA
+
+    db.add(MapVersion(map_id=map_id, version=version, kind=SNAPSHOT, data=data, size=_size(data)))
+    return SNAPSHOT
+
+
+def load_version(db: Session, map_id: int, version: int):
+    """The document of map_id at version, or None if the history does not reach it"""
+    snapshot = (
+        db.query(MapVersion.version, MapVersion.data)
+        .filter(MapVersion.map_id == map_id, MapVersion.kind == SNAPSHOT, MapVersion.version <= version)
+        .order_by(MapVersion.version.desc())
+        .first()
+    )
+    if snapshot is None:
+        return None
+    deltas = (
+        db.query(MapVersion.version, MapVersion.data)
+        .filter(MapVersion.map_id == map_id, MapVersion.version > snapshot.version, MapVersion.version <= version)
+        .order_by(MapVersion.version)
+        .all()
+    )
+    if [row.version for row in deltas] != list(range(snapshot.version + 1, version + 1)):
+        return None
+
+    document = snapshot.data
+    for row in deltas:
+        document = apply_ops(document, row.data)
+    return document
+
+
+def version_diff(db: Session, map_id: int, from_version: int, to_version: int):
+    """
+    Ops turning from_version into to_version, or None if either is not in
+    the history. Forward over deltas only, the stored ops are concatenated
+    without rebuilding either document.
+    """
+    if from_version < to_version:
+        rows = (
+            db.query(MapVersion.version, MapVersion.kind, MapVersion.data)
+            .filter(MapVersion.map_id == map_id, MapVersion.version > from_version, MapVersion.version <= to_version)
+            .order_by(MapVersion.version)
+            .all()
+        )
+        if (
+            [row.version for row in rows] == list(range(from_version + 1, to_version + 1))
+            and all(row.kind == DELTA for row in rows)
+            and db.query(MapVersion.id).filter(MapVersion.map_id == map_id, MapVersion.version == from_version).first()
+        ):
+            return [op for row in rows for op in row.data]
+
+    old = load_version(db, map_id, from_version)
+    new = load_version(db, map_id, to_version)
+    if old is None or new is None:
+        return None
+    return diff(old, new)
+
+
+def list_versions(db: Session, map_id: int, before: int = None, limit: int = 50):
+    """Newest first, without their data"""
+    query = db.query(MapVersion.version, MapVersion.kind, MapVersion.size, MapVersion.created_at).filter(
+        MapVersion.map_id == map_id
+    )
+    if before is not None:
+        query = query.filter(MapVersion.version < before)
+    return [
+        {"version": row.version, "kind": row.kind, "size": row.size, "created_at": row.created_at}
+        for row in query.order_by(MapVersion.version.desc()).limit(limit)
+    ]
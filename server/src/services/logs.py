@@ -0,0 +1,32 @@
+import os
+import reprlib
+
+# Longest payload representation written to the log
+LOG_PAYLOAD_CHARS = int(os.getenv("LOG_PAYLOAD_CHARS", 1000))
+
+_repr = reprlib.Repr()
+_repr.maxlevel = 4
+_repr.maxdict = 8
+_repr.maxlist = 8
+_repr.maxstring = 80
+_repr.maxother = 80
+
+
+class capped:
+    """
+    Log argument that renders a payload only if the record is emitted, and
+    then only its first few keys and items up to LOG_PAYLOAD_CHARS:
+
+        logger.debug("Received %s", capped(data))
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        text = _repr.repr(self.value)
+        if len(text) > LOG_PAYLOAD_CHARS:
+            text = text[:LOG_PAYLOAD_CHARS] + "..."
+        return text
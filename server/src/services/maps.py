@@ -0,0 +1,76 @@
+import logging
+from fastapi import BackgroundTasks
+from sqlalchemy.orm import Session
+from ..models.base import MapData, MapVersion
+from .feed import publish_map_change
+from .history import record_version
+from .offline import bundle_store
+from .response_cache import store_json_response
+
+logger = logging.getLogger(__name__)
+
+
+class StaleMapError(Exception):
+    """The map was saved by someone else since the version a save is based on"""
+
+    def __init__(self, expected, current):
+        super().__init__(f"Map is at version {current}, not {expected}; reload and reapply your changes")
+        self.expected = expected
+        self.current = current
+
+
+def normalize_map_data(data):
+    """Ensure the response has the expected structure"""
+    if not isinstance(data, dict):
+        logger.warning("Data is not a dictionary: %s", type(data))
+        data = {"floors": [], "floorData": {}, "selectedFloor": None}
+    
+    if "floors" not in data:
+        logger.warning("floors field missing, adding empty array")
+        data["floors"] = []
+    if "floorData" not in data:
+        logger.warning("floorData field missing, adding empty object")
+        data["floorData"] = {}
+    if "selectedFloor" not in data:
+        logger.warning("selectedFloor field missing, adding null")
+        data["selectedFloor"] = None
+    return data
+
+
+def store_map_data(db: Session, data, background_tasks: BackgroundTasks, base_version=None, snapshot=False):
+    """
+    Make data the current map and add it to the version history; commits,
+    along with anything else pending in db. With base_version, raises
+    StaleMapError unless the map is still at that version, 0 meaning no
+    map saved yet. With snapshot, the version is stored whole instead of
+    diffed against the previous one.
+    """
+    # Overwrite the single stored map in place, in one transaction, so
+    # readers never see an empty map between a delete and an insert
+    map_data = db.query(MapData).order_by(MapData.id.desc()).first()
+    current = map_data.version if map_data is not None else 0
+    if base_version is not None and base_version != current:
+        raise StaleMapError(base_version, current)
+    if map_data is None:
+        map_data = MapData(data=data)
+        db.add(map_data)
+        previous = None
+    else:
+        previous, previous_version = map_data.data, map_data.version
+        map_data.data = data
+        db.query(MapData).filter(MapData.id != map_data.id).delete()
+        db.query(MapVersion).filter(MapVersion.map_id != map_data.id).delete()
+    db.flush()
+    if previous is None or map_data.version != previous_version:
+        record_version(db, map_data.id, map_data.version, previous, data, snapshot=snapshot)
+    db.commit()
+    db.refresh(map_data)
+    # Encode the new version once here; other workers notice the new
+    # version on their next read
+    store_json_response(("maps", map_data.id, "full"), map_data.version, normalize_map_data(dict(map_data.data)))
+    publish_map_change(map_data.version)
+    # Compile the offline bundle after responding, so kiosks that
+    # follow the change notification find it ready
+    background_tasks.add_task(bundle_store.bundle, map_data.id, map_data.version, map_data.data)
+    logger.info("Saved map data %s at version %s", map_data.id, map_data.version)
+    return map_data
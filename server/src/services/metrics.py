@@ -0,0 +1,210 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+import os
+import threading
+import time
+from sqlalchemy import event
+from .profiler import SlowRequestProfiler
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# Requests slower than this many milliseconds are profiled; 0 disables
+# the sampling profiler
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 0))
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, in Prometheus' model"""
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [bucket counts..., +Inf count, sum]
+        self._series = {}
+
+    def observe(self, label_values, value):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series.setdefault(label_values, [0] * (len(self.buckets) + 1) + [0.0])
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, series in list(self._series.items()):
+            labels = _labels(self.labels, label_values)
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in list(self._values.items()):
+            lines.append(f"{self.name}{{{_labels(self.labels, label_values)}}} {value}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+ROUTE_LABELS = ("method", "route")
+
+requests_total = Counter("http_requests_total", "Requests handled", ("method", "route", "status"))
+request_seconds = Histogram("http_request_duration_seconds", "Request latency", ROUTE_LABELS, LATENCY_BUCKETS)
+request_bytes = Histogram("http_request_size_bytes", "Request body size", ROUTE_LABELS, SIZE_BUCKETS)
+response_bytes = Histogram("http_response_size_bytes", "Response body size", ROUTE_LABELS, SIZE_BUCKETS)
+db_queries = Histogram("db_queries_per_request", "SQL statements executed per request", ROUTE_LABELS, QUERY_BUCKETS)
+db_seconds = Histogram("db_query_duration_seconds", "Time spent in SQL per request", ROUTE_LABELS, LATENCY_BUCKETS)
+# outcome: executed (ran the computation), coalesced (shared another
+# call's result), error (ran or shared one that raised), timeout
+single_flight_calls = Counter(
+    "single_flight_calls_total", "Cache-miss computations run or shared between concurrent calls", ("name", "outcome")
+)
+
+METRICS = (requests_total, request_seconds, request_bytes, response_bytes, db_queries, db_seconds, single_flight_calls)
+_lock = threading.Lock()
+
+# [statement count, seconds] of the request being handled
+_request_db = ContextVar("request_db", default=None)
+
+
+def instrument_engine(engine):
+    """Count statements and their time against the current request"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = _request_db.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += elapsed
+
+
+def record_single_flight(name, outcome):
+    with _lock:
+        single_flight_calls.inc((name, outcome))
+
+
+def _pool_lines(engines):
+    """Pool gauges read at scrape time; pools without a size (SQLite's) are skipped"""
+    gauges = {
+        "db_pool_size": ("Connections the pool keeps open", []),
+        "db_pool_checked_out": ("Connections in use", []),
+        "db_pool_overflow": ("Connections opened beyond the pool size", []),
+        "db_pool_saturation": ("Connections in use over the most the pool allows", []),
+    }
+    for name, engine in engines.items():
+        pool = engine.pool
+        if not all(hasattr(pool, attr) for attr in ("size", "checkedout", "overflow")):
+            continue
+        size, checked_out = pool.size(), pool.checkedout()
+        limit = size + max(getattr(pool, "_max_overflow", 0), 0)
+        values = {
+            "db_pool_size": size,
+            "db_pool_checked_out": checked_out,
+            "db_pool_overflow": max(pool.overflow(), 0),
+            "db_pool_saturation": round(checked_out / limit, 4) if limit else 0,
+        }
+        for metric, value in values.items():
+            gauges[metric][1].append(f'{metric}{{engine="{name}"}} {value}')
+
+    lines = []
+    for metric, (help, samples) in gauges.items():
+        if samples:
+            lines += [f"# HELP {metric} {help}", f"# TYPE {metric} gauge", *samples]
+    return lines
+
+
+def render(engines):
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        for metric in METRICS:
+            lines += metric.collect()
+    lines += _pool_lines(engines)
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    Records latency, status, body sizes and SQL statements per route.
+    Routes are labelled by their path template, so ids in URLs do not
+    create new series; unmatched paths share one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.profiler = SlowRequestProfiler(SLOW_REQUEST_MS / 1000) if SLOW_REQUEST_MS > 0 else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        sizes = [0, 0]
+        status = [500]
+        stats = [0, 0.0]
+        token = _request_db.set(stats)
+        if self.profiler is not None:
+            self.profiler.begin()
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes[0] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes[1] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            _request_db.reset(token)
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            labels = (scope["method"], getattr(route, "path_format", None) or "unmatched")
+            with _lock:
+                requests_total.inc((*labels, status[0]))
+                request_seconds.observe(labels, elapsed)
+                request_bytes.observe(labels, sizes[0])
+                response_bytes.observe(labels, sizes[1])
+                db_queries.observe(labels, stats[0])
+                db_seconds.observe(labels, stats[1])
+            if self.profiler is not None:
+                self.profiler.end(start, elapsed, labels, stats)
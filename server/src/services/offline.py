@@ -0,0 +1,401 @@
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import zlib
+import numpy as np
+from .routing import build_graph
+
+# Offline station bundles: one binary file per map version that kiosks and
+# phones can memory-map and read without parsing, plus binary deltas
+# between versions.
+#
+# Layout (little-endian, every section starts on an 8-byte boundary):
+#
+#     header    magic "RDSB", format u16, reserved u16, map version u64,
+#               section count u32, reserved u32, total length u64
+#     sections  count x (tag 8 ASCII bytes, offset u64, length u64, records u64)
+#
+# Section records are fixed-size structs (see the dtypes below). Strings
+# are (offset, length) pairs into the floor's own slice of STRINGS, and
+# node, edge, point and object indices are relative to the floor's first
+# one, so an edit on one floor leaves the bytes of the others unchanged
+# apart from their position. That is what keeps deltas small.
+MAGIC = b"RDSB"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHHQIIQ")
+SECTION = struct.Struct("<8sQQQ")
+NO_NODE = 0xFFFFFFFF
+
+BUNDLE_DIR = os.getenv("BUNDLE_DIR", os.path.join(tempfile.gettempdir(), "raildisha-bundles"))
+# Versions kept on disk as delta bases
+BUNDLE_KEEP = int(os.getenv("BUNDLE_KEEP", 20))
+
+_u4 = "<u4"
+# Where each floor's records start in every section (record indices; a
+# byte offset for STRINGS) and how many it has
+FLOOR_DTYPE = np.dtype([
+    ("id_off", _u4), ("id_len", _u4), ("name_off", _u4), ("name_len", _u4),
+    ("strings", _u4), ("strings_len", _u4),
+    ("nodes", _u4), ("node_count", _u4),
+    ("edges", _u4), ("edge_count", _u4),
+    ("objects", _u4), ("object_count", _u4),
+    ("routes", _u4), ("route_count", _u4),
+    ("route_points", _u4), ("route_point_count", _u4),
+    ("areas", _u4), ("area_count", _u4),
+    ("area_points", _u4), ("area_point_count", _u4),
+])
+POINT_DTYPE = np.dtype([("x", "<f8"), ("y", "<f8")])
+# First edge of each node (relative to the floor's edges) and its edge count
+ADJ_DTYPE = np.dtype([("first", _u4), ("count", _u4)])
+EDGE_DTYPE = np.dtype([("target", _u4), ("weight", "<f4")])
+OBJECT_DTYPE = np.dtype([
+    ("id_off", _u4), ("id_len", _u4), ("name_off", _u4), ("name_len", _u4),
+    ("type_off", _u4), ("type_len", _u4), ("node", _u4), ("reserved", _u4),
+    ("lat", "<f8"), ("lng", "<f8"),
+])
+ROUTE_DTYPE = np.dtype([
+    ("id_off", _u4), ("id_len", _u4), ("name_off", _u4), ("name_len", _u4),
+    ("points", _u4), ("point_count", _u4),
+])
+AREA_DTYPE = np.dtype([
+    ("id_off", _u4), ("id_len", _u4), ("name_off", _u4), ("name_len", _u4),
+    ("type_off", _u4), ("type_len", _u4), ("inner", _u4), ("points", _u4),
+    ("point_count", _u4), ("reserved", _u4),
+])
+# Every object of the station ordered by case-folded name, for binary search
+NAME_DTYPE = np.dtype([("floor", _u4), ("object", _u4)])
+
+SECTIONS = (
+    ("FLOORS", FLOOR_DTYPE), ("NODES", POINT_DTYPE), ("ADJ", ADJ_DTYPE), ("EDGES", EDGE_DTYPE),
+    ("OBJECTS", OBJECT_DTYPE), ("ROUTES", ROUTE_DTYPE), ("ROUTEPTS", POINT_DTYPE),
+    ("AREAS", AREA_DTYPE), ("AREAPTS", POINT_DTYPE), ("NAMES", NAME_DTYPE), ("STRINGS", None),
+)
+
+
+class _Strings:
+    """One floor's string slice; equal strings are stored once"""
+
+    def __init__(self):
+        self.blob = bytearray()
+        self._refs = {}
+
+    def ref(self, value):
+        value = "" if value is None else str(value)
+        ref = self._refs.get(value)
+        if ref is None:
+            encoded = value.encode()
+            ref = self._refs[value] = (len(self.blob), len(encoded))
+            self.blob += encoded
+        return ref
+
+
+def _points(pairs):
+    return np.array(pairs, dtype=POINT_DTYPE) if pairs else np.zeros(0, POINT_DTYPE)
+
+
+def _ring(item):
+    geometry = item.get("geometry") or {}
+    coordinates = geometry.get("coordinates") or []
+    if not coordinates or not isinstance(coordinates[0], list):
+        return []
+    return [(float(c[0]), float(c[1])) for c in coordinates[0] if isinstance(c, (list, tuple)) and len(c) >= 2]
+
+
+def compile_bundle(version, data):
+    """The bundle bytes of a map version from its {"floors", "floorData"} data"""
+    parts = {tag: [] for tag, _ in SECTIONS}
+    totals = {tag: 0 for tag, _ in SECTIONS}
+    floors = []
+    names = []
+
+    for floor_index, floor in enumerate(data.get("floors") or []):
+        floor_data = (data.get("floorData") or {}).get(floor.get("id")) or {}
+        strings = _Strings()
+        graph = build_graph(floor.get("id"), version, floor_data)
+        record = {
+            "strings": totals["STRINGS"],
+            "nodes": totals["NODES"], "edges": totals["EDGES"], "objects": totals["OBJECTS"],
+            "routes": totals["ROUTES"], "route_points": totals["ROUTEPTS"],
+            "areas": totals["AREAS"], "area_points": totals["AREAPTS"],
+        }
+        record["id_off"], record["id_len"] = strings.ref(floor.get("id"))
+        record["name_off"], record["name_len"] = strings.ref(floor.get("name"))
+
+        # Navigation graph in CSR form, as NavGraph holds it
+        offsets = np.frombuffer(graph.offsets, dtype=np.int64 if graph.offsets.itemsize == 8 else np.int32)
+        adjacency = np.zeros(len(graph), ADJ_DTYPE)
+        adjacency["first"] = offsets[:-1]
+        adjacency["count"] = np.diff(offsets)
+        edges = np.zeros(len(graph.targets), EDGE_DTYPE)
+        edges["target"] = np.frombuffer(graph.targets, dtype=offsets.dtype)
+        edges["weight"] = np.frombuffer(graph.weights, dtype=np.float64)
+        nodes = np.zeros(len(graph), POINT_DTYPE)
+        nodes["x"] = np.frombuffer(graph.xs, dtype=np.float64)
+        nodes["y"] = np.frombuffer(graph.ys, dtype=np.float64)
+
+        objects = []
+        for obj in floor_data.get("objects") or []:
+            if not isinstance(obj, dict):
+                continue
+            latlng = obj.get("latlng")
+            lat, lng = np.nan, np.nan
+            if isinstance(latlng, (list, tuple)) and len(latlng) >= 2:
+                lat, lng = float(latlng[0]), float(latlng[1])
+            names.append((str(obj.get("name") or "").casefold(), floor_index, len(objects)))
+            objects.append((
+                *strings.ref(obj.get("id")), *strings.ref(obj.get("name")), *strings.ref(obj.get("type")),
+                graph.object_nodes.get(obj.get("id"), NO_NODE), 0, lat, lng,
+            ))
+
+        routes, route_points = [], []
+        for route in floor_data.get("routes") or []:
+            if not isinstance(route, dict):
+                continue
+            points = [
+                (float(p["x"]), float(p["y"])) for p in route.get("path") or []
+                if isinstance(p, dict) and p.get("x") is not None and p.get("y") is not None
+            ]
+            routes.append((*strings.ref(route.get("id")), *strings.ref(route.get("name")), len(route_points), len(points)))
+            route_points += points
+
+        areas, area_points = [], []
+        for inner, key in ((0, "boundaries"), (1, "innerBoundaries")):
+            for area in floor_data.get(key) or []:
+                if not isinstance(area, dict):
+                    continue
+                ring = _ring(area)
+                areas.append((
+                    *strings.ref(area.get("id")), *strings.ref(area.get("name")), *strings.ref(area.get("type")),
+                    inner, len(area_points), len(ring), 0,
+                ))
+                area_points += ring
+
+        for tag, array in (
+            ("NODES", nodes), ("ADJ", adjacency), ("EDGES", edges),
+            ("OBJECTS", np.array(objects, dtype=OBJECT_DTYPE)),
+            ("ROUTES", np.array(routes, dtype=ROUTE_DTYPE)), ("ROUTEPTS", _points(route_points)),
+            ("AREAS", np.array(areas, dtype=AREA_DTYPE)), ("AREAPTS", _points(area_points)),
+        ):
+            parts[tag].append(array.tobytes())
+            totals[tag] += len(array)
+        # Keep every floor's strings 8-byte aligned so its slice can be mapped on its own
+        blob = bytes(strings.blob) + b"\0" * (-len(strings.blob) % 8)
+        parts["STRINGS"].append(blob)
+        totals["STRINGS"] += len(blob)
+
+        record["strings_len"] = len(strings.blob)
+        record["node_count"], record["edge_count"] = len(nodes), len(edges)
+        record["object_count"], record["route_count"] = len(objects), len(routes)
+        record["route_point_count"], record["area_count"] = len(route_points), len(areas)
+        record["area_point_count"] = len(area_points)
+        floors.append(tuple(record[name] for name in FLOOR_DTYPE.names))
+
+    parts["FLOORS"] = [np.array(floors, dtype=FLOOR_DTYPE).tobytes()]
+    totals["FLOORS"] = len(floors)
+    names.sort()
+    parts["NAMES"] = [np.array([(f, o) for _, f, o in names], dtype=NAME_DTYPE).tobytes()]
+    totals["NAMES"] = len(names)
+
+    offset = HEADER.size + SECTION.size * len(SECTIONS)
+    table, body = [], []
+    for tag, _ in SECTIONS:
+        section = b"".join(parts[tag])
+        table.append(SECTION.pack(tag.encode().ljust(8, b"\0"), offset, len(section), totals[tag]))
+        padded = section + b"\0" * (-len(section) % 8)
+        body.append(padded)
+        offset += len(padded)
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, 0, version, len(SECTIONS), 0, offset)
+    return header + b"".join(table) + b"".join(body)
+
+
+def read_sections(bundle):
+    """{tag: numpy view or memoryview} over a bundle, without copying"""
+    magic, fmt, _, version, count, _, length = HEADER.unpack_from(bundle, 0)
+    if magic != MAGIC or fmt != FORMAT_VERSION:
+        raise ValueError("Not a station bundle of a supported format")
+    dtypes = dict(SECTIONS)
+    sections = {"version": version}
+    for i in range(count):
+        tag, offset, size, records = SECTION.unpack_from(bundle, HEADER.size + i * SECTION.size)
+        tag = tag.rstrip(b"\0").decode()
+        dtype = dtypes.get(tag)
+        if dtype is None:
+            sections[tag] = memoryview(bundle)[offset:offset + size]
+        else:
+            sections[tag] = np.frombuffer(bundle, dtype=dtype, count=records, offset=offset)
+    return sections
+
+
+# Delta: "RDSD", from version u64, to version u64, target length u64,
+# sha256 of the target, then a zlib stream of ops. An op is a varint
+# (length << 1 | kind): kind 0 copies length bytes from a varint offset in
+# the base bundle, kind 1 inserts the length bytes that follow.
+DELTA_MAGIC = b"RDSD"
+DELTA_HEADER = struct.Struct("<4sQQQ32s")
+DELTA_BLOCK = 16
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return out
+
+
+def make_delta(base, base_version, target, target_version):
+    """Binary delta turning base into target"""
+    # Every aligned block of the base by content; sections of unchanged
+    # floors appear at shifted positions in the target and still match
+    blocks = {}
+    for offset in range(0, len(base) - DELTA_BLOCK + 1, DELTA_BLOCK):
+        blocks.setdefault(base[offset:offset + DELTA_BLOCK], offset)
+
+    ops = bytearray()
+    literal_start = 0
+    i, end = 0, len(target)
+    while i + DELTA_BLOCK <= end:
+        match = blocks.get(target[i:i + DELTA_BLOCK])
+        if match is None:
+            i += 1
+            continue
+        # Extend the match backwards into the pending literal and forwards
+        start, source = i, match
+        while start > literal_start and source > 0 and target[start - 1] == base[source - 1]:
+            start -= 1
+            source -= 1
+        length = i + DELTA_BLOCK - start
+        step = 4096
+        while step:
+            while start + length + step <= end and source + length + step <= len(base) and \
+                    target[start + length:start + length + step] == base[source + length:source + length + step]:
+                length += step
+            step //= 8
+        if start > literal_start:
+            ops += _varint((start - literal_start) << 1 | 1) + target[literal_start:start]
+        ops += _varint(length << 1) + _varint(source)
+        i = literal_start = start + length
+    if literal_start < end:
+        ops += _varint((end - literal_start) << 1 | 1) + target[literal_start:]
+
+    digest = hashlib.sha256(target).digest()
+    return DELTA_HEADER.pack(DELTA_MAGIC, base_version, target_version, len(target), digest) + zlib.compress(bytes(ops), 9)
+
+
+def apply_delta(base, delta):
+    """The target bundle of a delta; raises ValueError if it does not check out"""
+    magic, _, _, length, digest = DELTA_HEADER.unpack_from(delta, 0)
+    if magic != DELTA_MAGIC:
+        raise ValueError("Not a station bundle delta")
+    ops = zlib.decompress(delta[DELTA_HEADER.size:])
+    out = bytearray()
+    i = 0
+
+    def varint():
+        nonlocal i
+        value = shift = 0
+        while True:
+            byte = ops[i]
+            i += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    while i < len(ops):
+        op = varint()
+        size = op >> 1
+        if op & 1:
+            out += ops[i:i + size]
+            i += size
+        else:
+            source = varint()
+            out += base[source:source + size]
+    if len(out) != length or hashlib.sha256(out).digest() != digest:
+        raise ValueError("Delta does not apply to this base")
+    return bytes(out)
+
+
+class BundleStore:
+    """
+    Compiled bundles and deltas on disk, shared by workers and keyed by
+    MapData id and version. Files are written under a temporary name and
+    renamed, so readers never see a partial one; the newest BUNDLE_KEEP
+    versions are kept as delta bases.
+    """
+
+    def __init__(self, directory=BUNDLE_DIR, keep=BUNDLE_KEEP):
+        self.directory = directory
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def _path(self, map_id, *versions):
+        kind = "station" if len(versions) == 1 else "delta"
+        return os.path.join(self.directory, f"{kind}-{map_id}-{'-'.join(map(str, versions))}.bin")
+
+    def _write(self, path, body):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temporary, "wb") as f:
+            f.write(body)
+        os.replace(temporary, path)
+
+    def bundle(self, map_id, version, data=None):
+        """Path of a version's bundle, compiled from data if missing; None if neither"""
+        path = self._path(map_id, version)
+        if os.path.exists(path):
+            return path
+        if data is None:
+            return None
+        self._write(path, compile_bundle(version, data))
+        self._prune(map_id)
+        return path
+
+    def delta(self, map_id, base_version, version):
+        """Path of the delta between two stored versions, or None if either is gone"""
+        path = self._path(map_id, base_version, version)
+        if os.path.exists(path):
+            return path
+        try:
+            with open(self._path(map_id, base_version), "rb") as f:
+                base = f.read()
+            with open(self._path(map_id, version), "rb") as f:
+                target = f.read()
+        except OSError:
+            return None
+        self._write(path, make_delta(base, base_version, target, version))
+        return path
+
+    def _prune(self, map_id):
+        """Drop bundles beyond the newest `keep` versions, and deltas from or to them"""
+        with self._lock:
+            try:
+                # kind-map_id-version[-version].bin
+                files = [
+                    (name, name[:-4].split("-")) for name in os.listdir(self.directory)
+                    if name.endswith(".bin") and name.startswith(("station-", "delta-"))
+                ]
+            except OSError:
+                return
+            files = [(name, fields) for name, fields in files if fields[1] == str(map_id)]
+            versions = sorted(
+                (int(fields[2]) for _, fields in files if fields[0] == "station"),
+                reverse=True,
+            )
+            stale = set(versions[self.keep:])
+            for name, fields in files:
+                if any(int(v) in stale for v in fields[2:]):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except OSError:
+                        pass
+
+
+bundle_store = BundleStore()
@@ -0,0 +1,217 @@
+from copy import deepcopy
+from datetime import datetime
+from sqlalchemy.orm import Session
+from ..models.base import Floor, FEATURE_MODELS
+from .features import add_feature
+
+def _valid_name(value):
+    return isinstance(value, str) and bool(value.strip())
+
+
+def _valid_level(value):
+    # bool is an int subclass, but True is not a level
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# Floor columns a patch may replace, with the check and message for the value
+FLOOR_FIELDS = {
+    "name": (_valid_name, "a non-empty string"),
+    "level": (_valid_level, "an integer"),
+}
+
+
+class PatchError(ValueError):
+    """The patch is malformed or addresses something that does not exist"""
+
+
+class StaleVersionError(Exception):
+    """The floor changed since the client read the version it is patching"""
+
+    def __init__(self, floor_id, expected, current):
+        super().__init__(f"Floor {floor_id} is at version {current}, patch was made against {expected}")
+        self.floor_id = floor_id
+        self.expected = expected
+        self.current = current
+
+
+def _parse_pointer(path):
+    """Split an RFC 6901 JSON pointer into unescaped segments"""
+    if not path.startswith("/"):
+        raise PatchError(f"Invalid path: {path!r}")
+    return [segment.replace("~1", "/").replace("~0", "~") for segment in path[1:].split("/")]
+
+
+def _apply_nested(document, op, segments, value):
+    """Apply an add/replace/remove operation inside one item's JSON"""
+    parent = document
+    for segment in segments[:-1]:
+        try:
+            parent = parent[int(segment)] if isinstance(parent, list) else parent[segment]
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise PatchError(f"Path segment {segment!r} not found")
+
+    last = segments[-1]
+    if isinstance(parent, list):
+        if op == "add" and last == "-":
+            parent.append(value)
+            return
+        try:
+            index = int(last)
+            if op == "add":
+                parent.insert(index, value)
+            elif op == "replace":
+                parent[index] = value
+            else:
+                del parent[index]
+        except (IndexError, ValueError):
+            raise PatchError(f"Invalid array index {last!r}")
+    elif isinstance(parent, dict):
+        if op == "remove":
+            if last not in parent:
+                raise PatchError(f"Path segment {last!r} not found")
+            del parent[last]
+        elif op == "replace" and last not in parent:
+            raise PatchError(f"Path segment {last!r} not found")
+        else:
+            parent[last] = value
+    else:
+        raise PatchError("Cannot apply an operation inside a scalar value")
+
+
+def _apply_op(db: Session, floor_id: int, operation):
+    op, path, value = operation.op, operation.path, operation.value
+    if op not in ("add", "replace", "remove"):
+        raise PatchError(f"Unsupported op: {op!r}")
+
+    segments = _parse_pointer(path)
+    key = segments[0]
+
+    if key in FLOOR_FIELDS and len(segments) == 1:
+        if op != "replace":
+            raise PatchError(f"Only replace is supported for /{key}")
+        valid, expected = FLOOR_FIELDS[key]
+        if not valid(value):
+            raise PatchError(f"/{key} must be {expected}")
+        db.query(Floor).filter(Floor.id == floor_id).update({key: value}, synchronize_session=False)
+        return
+
+    model = FEATURE_MODELS.get(key)
+    if model is None:
+        raise PatchError(f"Unknown collection: {key!r}")
+
+    # /objects or /objects/- appends a new item
+    if len(segments) == 1 or (len(segments) == 2 and segments[1] == "-"):
+        if op != "add" or not isinstance(value, dict):
+            raise PatchError(f"Appending to /{key} needs an add op with an object value")
+        add_feature(db, key, floor_id, value)
+        return
+
+    uid = segments[1]
+    rows = db.query(model).filter(model.floor_id == floor_id, model.uid == uid).all()
+
+    if len(segments) == 2:
+        if op == "add":
+            # add on an existing id behaves as upsert
+            if not isinstance(value, dict):
+                raise PatchError("Item value must be an object")
+            if not rows:
+                add_feature(db, key, floor_id, {**value, "id": uid})
+                return
+            op = "replace"
+        if not rows:
+            raise PatchError(f"{key} item {uid!r} not found")
+        for row in rows:
+            if op == "remove":
+                db.delete(row)
+            else:
+                if not isinstance(value, dict):
+                    raise PatchError("Item value must be an object")
+                row.data = {**value, "id": uid}
+                row.type = value.get("type")
+        return
+
+    if not rows:
+        raise PatchError(f"{key} item {uid!r} not found")
+    if segments[2] == "id":
+        raise PatchError("Item ids cannot be changed")
+    for row in rows:
+        data = deepcopy(row.data)
+        _apply_nested(data, op, segments[2:], value)
+        row.data = data
+        row.type = data.get("type")
+
+
+def apply_floor_patch(db: Session, floor_id: int, version: int, operations):
+    """
+    Apply JSON-patch style operations to one floor if it is still at `version`.
+    Paths address items by id rather than array index, e.g.
+    /objects/marker_1, /routes/path_2/path/0/x or /name.
+    Does not commit; returns the floor's new version.
+    """
+    # Compare-and-swap on the version so two editors cannot both win
+    updated = (
+        db.query(Floor)
+        .filter(Floor.id == floor_id, Floor.version == version)
+        .update(
+            {Floor.version: Floor.version + 1, Floor.updated_at: datetime.utcnow()},
+            synchronize_session=False
+        )
+    )
+    if not updated:
+        current = db.query(Floor.version).filter(Floor.id == floor_id).scalar()
+        if current is None:
+            raise PatchError(f"Floor {floor_id} not found")
+        raise StaleVersionError(floor_id, version, current)
+
+    # Sessions do not autoflush, so flush after each op to let the next one
+    # see the rows it added or removed
+    for operation in operations:
+        _apply_op(db, floor_id, operation)
+        db.flush()
+    return version + 1
+
+
+def sync_map_data(db: Session, floor: Floor, map_data) -> bool:
+    """
+    Bring a floor's items in line with a full map_data dict, writing only
+    the items that were added, changed, moved or removed. Items are matched
+    by id. Does not commit; returns True if anything was written.
+    """
+    changed = False
+    map_data = map_data or {}
+
+    for key, model in FEATURE_MODELS.items():
+        items = [item for item in map_data.get(key, []) or [] if isinstance(item, dict)]
+        rows = db.query(model).filter(model.floor_id == floor.id).order_by(model.seq).all()
+
+        by_uid = {}
+        for row in rows:
+            by_uid.setdefault(row.uid, []).append(row)
+
+        last_seq = -1
+        for item in items:
+            candidates = by_uid.get(item.get("id"))
+            row = candidates.pop(0) if candidates else None
+            if row is None:
+                row = model.from_item(item, last_seq + 1)
+                row.floor_id = floor.id
+                db.add(row)
+                changed = True
+            else:
+                if row.data != item:
+                    row.data = item
+                    row.type = item.get("type")
+                    changed = True
+                # Keep existing positions where they are still in order so
+                # appends and deletes do not renumber the rest of the list
+                if row.seq <= last_seq:
+                    row.seq = last_seq + 1
+                    changed = True
+            last_seq = row.seq
+
+        for leftover in by_uid.values():
+            for row in leftover:
+                db.delete(row)
+                changed = True
+
+    return changed
@@ -0,0 +1,85 @@
+from collections import Counter, deque
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Stack sampling period while any request is in flight
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+# Most frequent stacks logged per slow request
+PROFILE_TOP_STACKS = int(os.getenv("PROFILE_TOP_STACKS", 5))
+# Samples kept, enough for a few seconds of every worker thread
+MAX_SAMPLES = 20000
+MAX_DEPTH = 40
+
+# Threads parked in these files are idle (event loop select, threadpool
+# workers waiting for a job) and not worth attributing time to
+IDLE_FILES = ("selectors.py", "threading.py", "queue.py")
+
+
+def _stack(frame):
+    """Folded stack, outermost call first, as "file:function" entries"""
+    entries = []
+    while frame is not None and len(entries) < MAX_DEPTH:
+        code = frame.f_code
+        entries.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    entries.reverse()
+    return ";".join(entries)
+
+
+class SlowRequestProfiler:
+    """
+    Samples every thread's stack while requests are in flight. When a
+    request turns out slower than the threshold, the samples taken during
+    it are folded into their most frequent stacks and logged. Samples are
+    not tied to a request, so with concurrent requests the report shows
+    everything the process was doing at the time.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self._samples = deque(maxlen=MAX_SAMPLES)
+        self._in_flight = 0
+        self._active = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def begin(self):
+        with self._lock:
+            self._in_flight += 1
+            self._active.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+                self._thread.start()
+
+    def end(self, start, elapsed, labels, db_stats):
+        with self._lock:
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._active.clear()
+        if elapsed < self.threshold:
+            return
+
+        stop = start + elapsed
+        stacks = Counter(stack for at, stack in list(self._samples) if start <= at <= stop)
+        logger.warning(
+            "Slow request %s %s took %.0f ms (%d SQL statements, %.0f ms in SQL); %d stack samples:\n%s",
+            labels[0], labels[1], elapsed * 1000, db_stats[0], db_stats[1] * 1000, sum(stacks.values()),
+            "\n".join(f"{n:6d} {stack}" for stack, n in stacks.most_common(PROFILE_TOP_STACKS)),
+        )
+
+    def _run(self):
+        me = threading.get_ident()
+        interval = PROFILE_INTERVAL_MS / 1000
+        while True:
+            self._active.wait()
+            now = time.perf_counter()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me or os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                    continue
+                self._samples.append((now, _stack(frame)))
+            time.sleep(interval)
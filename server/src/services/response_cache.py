@@ -0,0 +1,220 @@
+from collections import OrderedDict
+from hashlib import blake2b
+import gzip
+import json
+import os
+import threading
+from fastapi import Request, Response
+from starlette.concurrency import run_in_threadpool
+from .singleflight import AsyncSingleFlight
+
+try:
+    import orjson
+except ImportError:  # falls back to the stdlib encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # gzip is still offered
+    brotli = None
+
+# Upper bound on cached response bodies per worker, all encodings included
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Bodies smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 9
+
+
+def dumps(content):
+    """Serialize to compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def encode_variants(body):
+    """The body in every content-coding we can serve, computed once"""
+    variants = {"identity": body}
+    if len(body) >= COMPRESS_MIN_BYTES:
+        variants["gzip"] = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+        if brotli is not None:
+            variants["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+    return variants
+
+
+class CachedResponse:
+    __slots__ = ("version", "etag", "variants", "size")
+
+    def __init__(self, version, etag, variants):
+        self.version = version
+        self.etag = etag
+        self.variants = variants
+        self.size = sum(len(body) for body in variants.values())
+
+
+def make_etag(key, version):
+    """
+    ETag for a resource at a version; the body is a pure function of both.
+    Weak because the same version is served in several content-codings.
+    """
+    digest = blake2b(repr((key, version)).encode(), digest_size=8).hexdigest()
+    return f'W/"{digest}"'
+
+
+class ResponseCache:
+    """
+    LRU cache of serialized response bodies. Each key (a map, a floor, a
+    floor list page) holds only its latest version, and least recently used
+    keys are evicted once the total body size exceeds max_bytes.
+
+    Entries are looked up by the version read from the database, so a worker
+    never serves a body older than the row it just checked, even when the
+    write happened in another worker; invalidate() only frees memory early,
+    driven by the change feed through drop_stale_responses().
+    """
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, version, body):
+        entry = CachedResponse(version, make_etag(key, version), encode_variants(body))
+        if entry.size > self.max_bytes:
+            return entry
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous.size
+            self._entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+        return entry
+
+    def invalidate(self, match=None, below=None):
+        """
+        Drop the entries whose key match(key) accepts (every entry without
+        match), or only those of them at a version below `below`
+        """
+        with self._lock:
+            for key in [key for key in self._entries if match is None or match(key)]:
+                if below is None or self._entries[key].version < below:
+                    self.size -= self._entries.pop(key).size
+
+
+response_cache = ResponseCache()
+response_flight = AsyncSingleFlight("response")
+
+
+def etag_matches(request: Request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison
+    opaque = etag.removeprefix("W/")
+    tags = (tag.strip() for tag in header.split(","))
+    return any(tag.removeprefix("W/") == opaque for tag in tags)
+
+
+def accepted_encodings(request: Request):
+    """Content-codings from Accept-Encoding with a non-zero q-value"""
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        token, _, params = part.partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(token)
+    if "*" in accepted:
+        accepted.update(("br", "gzip"))
+    return accepted
+
+
+def encoded_response(request: Request, entry: CachedResponse, headers):
+    """Pick the smallest precomputed variant the client accepts"""
+    accepted = accepted_encodings(request)
+    for encoding in ("br", "gzip"):
+        if encoding in accepted and encoding in entry.variants:
+            return Response(
+                content=entry.variants[encoding],
+                media_type="application/json",
+                headers={**headers, "Content-Encoding": encoding},
+            )
+    return Response(content=entry.variants["identity"], media_type="application/json", headers=headers)
+
+
+async def async_cached_json_response(request: Request, key, version, build, headers=None):
+    """
+    Serve build()'s JSON for a resource at a version: 304 if the client
+    already has it, the cached encoded bytes if this worker has them,
+    otherwise build, serialize, compress and cache them. headers are added
+    to every response, including the 304. build is awaited,
+    and the body is serialized and compressed in the threadpool so the
+    event loop keeps serving other requests meanwhile. Concurrent misses
+    for the same key and version wait for one build instead of each
+    querying and encoding.
+    """
+    etag = make_etag(key, version)
+    headers = {**(headers or {}), "ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    entry = response_cache.get(key, version)
+    if entry is None:
+        async def build_entry():
+            content = await build()
+            return await run_in_threadpool(lambda: response_cache.put(key, version, dumps(content)))
+
+        entry = await response_flight.do((key, version), build_entry)
+    return encoded_response(request, entry, headers)
+
+
+# Cache keys of per-floor responses are (kind, floor_id, ...)
+FLOOR_RESPONSE_KINDS = ("floor", "objects", "routes", "boundaries", "innerBoundaries")
+
+
+def drop_stale_responses(event):
+    """
+    Change feed listener: free the bodies a committed write made stale in
+    this worker, all of a deleted floor's, as soon as the event arrives
+    rather than when LRU eviction gets to them
+    """
+    floor_id = event.get("floor_id")
+    if floor_id is not None:
+        response_cache.invalidate(
+            lambda key: key[0] in FLOOR_RESPONSE_KINDS and key[1] == floor_id,
+            None if event.get("deleted") else event["version"]
+        )
+    elif event.get("topic") == "maps":
+        # Past versions are cached under keys with the version appended
+        # and never go stale
+        response_cache.invalidate(lambda key: key[0] == "maps" and len(key) == 3, event["version"])
+
+
+def store_json_response(key, version, content):
+    """Encode and cache a response at write time so the next read skips it"""
+    response_cache.put(key, version, dumps(content))
@@ -0,0 +1,351 @@
+from array import array
+from collections import defaultdict
+from heapq import heapify, heappush, heappop
+from math import floor, hypot, inf
+from .cache import FloorCache
+
+# Same degree-to-metre conversion as the builder (components/MapBuilder.jsx),
+# and the radius within which services/snap.py merges route points
+METERS_PER_DEGREE = 111000
+MERGE_THRESHOLD = 0.0001
+
+# Route points closer than this (in degrees) are treated as the same node
+COORD_PRECISION = 1e7
+
+
+class NavGraph:
+    """
+    Navigation graph of one floor in compressed sparse row form.
+
+    Node i sits at (xs[i], ys[i]) using the builder's convention of
+    x = longitude and y = latitude. Its outgoing edges are
+    targets[offsets[i]:offsets[i + 1]] with matching weights in metres.
+    """
+
+    __slots__ = (
+        "floor_id", "version", "xs", "ys",
+        "offsets", "targets", "weights",
+        "object_nodes", "node_objects", "object_types", "connector_keys",
+    )
+
+    def __init__(self, floor_id, version, xs, ys, offsets, targets, weights,
+                 object_nodes, object_types, connector_keys):
+        self.floor_id = floor_id
+        self.version = version
+        self.xs = xs
+        self.ys = ys
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        # object id -> node index, and the reverse for annotating paths
+        self.object_nodes = object_nodes
+        self.node_objects = {node: object_id for object_id, node in object_nodes.items()}
+        self.object_types = object_types
+        # Optional "connectorId" shared by stairs/elevators that link floors
+        self.connector_keys = connector_keys
+
+    def __len__(self):
+        return len(self.xs)
+
+    def distance(self, u, v):
+        """Straight-line distance between two nodes in metres"""
+        return hypot(self.xs[u] - self.xs[v], self.ys[u] - self.ys[v]) * METERS_PER_DEGREE
+
+    def point(self, node):
+        return {"x": self.xs[node], "y": self.ys[node]}
+
+
+class _GraphBuilder:
+    def __init__(self):
+        self.xs = array("d")
+        self.ys = array("d")
+        self.edges = []
+        self._exact = {}
+        # Spatial hash of route nodes so merged points can find their partners
+        self._grid = defaultdict(list)
+
+    def _cell(self, x, y):
+        return (floor(x / MERGE_THRESHOLD), floor(y / MERGE_THRESHOLD))
+
+    def _new_node(self, x, y):
+        node = len(self.xs)
+        self.xs.append(x)
+        self.ys.append(y)
+        return node
+
+    def object_node(self, x, y):
+        key = (round(x * COORD_PRECISION), round(y * COORD_PRECISION))
+        node = self._exact.get(key)
+        if node is None:
+            node = self._exact[key] = self._new_node(x, y)
+        return node
+
+    def route_node(self, x, y, owner, merged):
+        key = (round(x * COORD_PRECISION), round(y * COORD_PRECISION))
+        node = self._exact.get(key)
+        if node is not None:
+            return node
+
+        cx, cy = self._cell(x, y)
+        if merged:
+            # A merged point was averaged with points of other routes within
+            # MERGE_THRESHOLD, so join it to the closest of those
+            best, best_distance = None, MERGE_THRESHOLD
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for candidate, candidate_owner in self._grid.get((cx + dx, cy + dy), ()):
+                        if candidate_owner == owner:
+                            continue
+                        d = hypot(self.xs[candidate] - x, self.ys[candidate] - y)
+                        if d < best_distance:
+                            best, best_distance = candidate, d
+            if best is not None:
+                return best
+
+        node = self._exact[key] = self._new_node(x, y)
+        self._grid[(cx, cy)].append((node, owner))
+        return node
+
+    def add_edge(self, u, v):
+        if u == v:
+            return
+        w = hypot(self.xs[u] - self.xs[v], self.ys[u] - self.ys[v]) * METERS_PER_DEGREE
+        self.edges.append((u, v, w))
+        self.edges.append((v, u, w))
+
+    def build(self, floor_id, version, object_nodes, object_types, connector_keys):
+        n = len(self.xs)
+        offsets = array("l", [0]) * (n + 1)
+        for u, _, _ in self.edges:
+            offsets[u + 1] += 1
+        for i in range(n):
+            offsets[i + 1] += offsets[i]
+
+        targets = array("l", [0]) * len(self.edges)
+        weights = array("d", [0.0]) * len(self.edges)
+        cursor = array("l", offsets[:n])
+        for u, v, w in self.edges:
+            i = cursor[u]
+            targets[i] = v
+            weights[i] = w
+            cursor[u] = i + 1
+
+        return NavGraph(
+            floor_id, version, self.xs, self.ys, offsets, targets, weights,
+            object_nodes, object_types, connector_keys
+        )
+
+
+def _object_xy(obj):
+    latlng = obj.get("latlng")
+    if not isinstance(latlng, (list, tuple)) or len(latlng) < 2:
+        return None
+    lat, lng = latlng[0], latlng[1]
+    return float(lng), float(lat)
+
+
+def build_graph(floor_id, version, map_data):
+    """Build the navigation graph of a floor from its map_data objects and routes"""
+    builder = _GraphBuilder()
+    object_nodes = {}
+    object_types = {}
+    connector_keys = {}
+
+    for obj in map_data.get("objects", []) or []:
+        xy = _object_xy(obj)
+        if xy is None or obj.get("id") is None:
+            continue
+        object_nodes[obj["id"]] = builder.object_node(*xy)
+        object_types[obj["id"]] = obj.get("type")
+        if obj.get("connectorId") is not None:
+            connector_keys[obj["id"]] = obj["connectorId"]
+
+    for route_index, route in enumerate(map_data.get("routes", []) or []):
+        points = [
+            p for p in route.get("path", []) or []
+            if isinstance(p, dict) and p.get("x") is not None and p.get("y") is not None
+        ]
+        previous = None
+        for i, point in enumerate(points):
+            node = builder.route_node(
+                float(point["x"]), float(point["y"]),
+                route_index, bool(point.get("merged"))
+            )
+            # Route ends are drawn from/to markers; link them even if the
+            # marker was moved after the route was drawn
+            if i == 0 and route.get("from") in object_nodes:
+                builder.add_edge(object_nodes[route["from"]], node)
+            if i == len(points) - 1 and route.get("to") in object_nodes:
+                builder.add_edge(node, object_nodes[route["to"]])
+            if previous is not None:
+                builder.add_edge(previous, node)
+            previous = node
+
+    return builder.build(floor_id, version, object_nodes, object_types, connector_keys)
+
+
+def shortest_path(graph, source, target):
+    """
+    A* search from source to target node.
+    Returns (distance in metres, list of nodes) or None if unreachable.
+    """
+    n = len(graph)
+    xs, ys = graph.xs, graph.ys
+    offsets, targets, weights = graph.offsets, graph.targets, graph.weights
+    tx, ty = xs[target], ys[target]
+
+    def heuristic(node):
+        return hypot(xs[node] - tx, ys[node] - ty) * METERS_PER_DEGREE
+
+    dist = array("d", [inf]) * n
+    prev = array("l", [-1]) * n
+    dist[source] = 0.0
+    heap = [(heuristic(source), 0.0, source)]
+
+    while heap:
+        _, g, u = heappop(heap)
+        if u == target:
+            break
+        if g > dist[u]:
+            continue
+        for i in range(offsets[u], offsets[u + 1]):
+            v = targets[i]
+            candidate = g + weights[i]
+            if candidate < dist[v]:
+                dist[v] = candidate
+                prev[v] = u
+                heappush(heap, (candidate + heuristic(v), candidate, v))
+
+    if dist[target] == inf:
+        return None
+    return dist[target], path_to(prev, source, target)
+
+
+def shortest_path_tree(graph, source, stop_at=None):
+    """
+    Dijkstra from source over the whole graph, or until every node in
+    stop_at has been settled. Returns (dist, prev) arrays indexed by node.
+    """
+    n = len(graph)
+    offsets, targets, weights = graph.offsets, graph.targets, graph.weights
+
+    dist = array("d", [inf]) * n
+    prev = array("l", [-1]) * n
+    dist[source] = 0.0
+    heap = [(0.0, source)]
+    remaining = set(stop_at) if stop_at is not None else None
+
+    while heap:
+        g, u = heappop(heap)
+        if g > dist[u]:
+            continue
+        if remaining is not None:
+            remaining.discard(u)
+            if not remaining:
+                break
+        for i in range(offsets[u], offsets[u + 1]):
+            v = targets[i]
+            candidate = g + weights[i]
+            if candidate < dist[v]:
+                dist[v] = candidate
+                prev[v] = u
+                heappush(heap, (candidate, v))
+
+    return dist, prev
+
+
+def two_nearest_sources(graph, sources):
+    """
+    One Dijkstra sweep seeded with every source at distance 0 that settles
+    each node's two closest distinct sources, so a source can also find
+    the closest source other than itself. Returns (dist, owner) pairs of
+    arrays for the closest and the second closest: distances and
+    positions in sources, inf and -1 where there are not that many.
+    """
+    n = len(graph)
+    offsets, targets, weights = graph.offsets, graph.targets, graph.weights
+
+    dist = (array("d", [inf]) * n, array("d", [inf]) * n)
+    owner = (array("l", [-1]) * n, array("l", [-1]) * n)
+    heap = [(0.0, source, index) for index, source in enumerate(sources)]
+    heapify(heap)
+
+    # Each node takes at most two labels, so there are at most two
+    # relaxations per edge
+    while heap:
+        g, u, source = heappop(heap)
+        if owner[0][u] == -1:
+            rank = 0
+        elif owner[1][u] == -1 and owner[0][u] != source:
+            rank = 1
+        else:
+            continue
+        dist[rank][u] = g
+        owner[rank][u] = source
+        for i in range(offsets[u], offsets[u + 1]):
+            v = targets[i]
+            if owner[1][v] == -1 and owner[0][v] != source:
+                heappush(heap, (g + weights[i], v, source))
+
+    return (dist[0], owner[0]), (dist[1], owner[1])
+
+
+def distance_matrix(graph, sources, targets):
+    """
+    Walking distances from every source node to every target node as
+    rows of metres (inf where unreachable).
+
+    All sources share one heap of (distance, source, node) labels, and a
+    source stops expanding once it has settled all targets. Edges are
+    symmetric, so the sweep starts from the smaller side and the result
+    is transposed when needed.
+    """
+    if len(targets) < len(sources):
+        return [list(column) for column in zip(*distance_matrix(graph, targets, sources))]
+
+    offsets, edge_targets, weights = graph.offsets, graph.targets, graph.weights
+    columns = defaultdict(list)
+    for column, node in enumerate(targets):
+        columns[node].append(column)
+
+    rows = [[inf] * len(targets) for _ in sources]
+    dist = [{} for _ in sources]
+    remaining = [len(columns) for _ in sources]
+    heap = []
+    for index, source in enumerate(sources):
+        dist[index][source] = 0.0
+        heap.append((0.0, index, source))
+
+    while heap:
+        g, index, u = heappop(heap)
+        settled = dist[index]
+        if g > settled[u] or not remaining[index]:
+            continue
+        if u in columns:
+            row = rows[index]
+            if row[columns[u][0]] == inf:
+                for column in columns[u]:
+                    row[column] = g
+                remaining[index] -= 1
+                if not remaining[index]:
+                    continue
+        for i in range(offsets[u], offsets[u + 1]):
+            v = edge_targets[i]
+            candidate = g + weights[i]
+            if candidate < settled.get(v, inf):
+                settled[v] = candidate
+                heappush(heap, (candidate, index, v))
+
+    return rows
+
+
+def path_to(prev, source, target):
+    """Walk a predecessor array back from target to source"""
+    nodes = [target]
+    while nodes[-1] != source:
+        nodes.append(prev[nodes[-1]])
+    nodes.reverse()
+    return nodes
+
+
+graph_cache = FloorCache(build_graph, "graph")
@@ -0,0 +1,240 @@
+from collections import defaultdict
+from heapq import nlargest
+from itertools import count
+from math import hypot
+import re
+import threading
+from .cache import FloorCache
+from .routing import METERS_PER_DEGREE
+
+# Searched object fields and how much a match in each is worth
+FIELD_WEIGHTS = {"name": 1.0, "type": 0.7, "description": 0.4}
+
+# A query term matching a whole word scores 1, the start of a word
+# PREFIX_SCORE, and a misspelling FUZZY_SCORE scaled down by its edit distance
+PREFIX_SCORE = 0.8
+FUZZY_SCORE = 0.6
+# Words sharing less of their trigrams with a term than this are not
+# considered as misspellings of it
+MIN_SIMILARITY = 0.25
+# Edits allowed per this many letters of the term
+LETTERS_PER_EDIT = 4
+
+# With near=, a result NEAR_METERS away keeps half its text score
+NEAR_METERS = 50.0
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return _WORD.findall(str(text).lower()) if text else []
+
+
+def edit_distance(a, b):
+    """Levenshtein distance counting a swap of adjacent letters as one edit"""
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (a[i - 1] != b[j - 1]),
+            )
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+    return current[-1]
+
+
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _Trie:
+    """Prefix tree over the indexed words"""
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, word):
+        node = self.root
+        for char in word:
+            node = node.setdefault(char, {})
+        node[None] = True
+
+    def remove(self, word):
+        path = [self.root]
+        for char in word:
+            node = path[-1].get(char)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].pop(None, None)
+        # Prune branches that no longer lead to a word
+        for depth in range(len(word), 0, -1):
+            if path[depth]:
+                break
+            del path[depth - 1][word[depth - 1]]
+
+    def complete(self, prefix):
+        """Every indexed word starting with prefix"""
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        words, stack = [], [(node, prefix)]
+        while stack:
+            node, word = stack.pop()
+            for char, child in node.items():
+                if char is None:
+                    words.append(word)
+                else:
+                    stack.append((child, word + char))
+        return words
+
+
+class SearchIndex:
+    """
+    Word index over one floor's object names, types and descriptions:
+    a trie for prefix matches and a trigram index for misspellings. Kept
+    in sync with single-marker writes through add/remove.
+    """
+
+    def __init__(self, floor_id, version, map_data):
+        self.floor_id = floor_id
+        self.version = version
+        self._keys = count()
+        self._objects = {}
+        self._uids = defaultdict(list)
+        # word -> {key: best field weight of the word in that object}
+        self._postings = defaultdict(dict)
+        self._trie = _Trie()
+        self._trigrams = defaultdict(set)
+        self._lock = threading.Lock()
+
+        for item in map_data.get("objects", []) or []:
+            if isinstance(item, dict):
+                self._add(item)
+
+    def _add(self, item):
+        words = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for word in tokenize(item.get(field)):
+                words[word] = max(words.get(word, 0), weight)
+        if not words:
+            return
+        key = next(self._keys)
+        self._objects[key] = (item, words)
+        self._uids[item.get("id")].append(key)
+        for word, weight in words.items():
+            if word not in self._postings:
+                self._trie.add(word)
+                for trigram in trigrams(word):
+                    self._trigrams[trigram].add(word)
+            self._postings[word][key] = weight
+
+    def add(self, item):
+        with self._lock:
+            self._add(item)
+
+    def remove(self, uid):
+        with self._lock:
+            for key in self._uids.pop(uid, []):
+                _, words = self._objects.pop(key)
+                for word in words:
+                    postings = self._postings[word]
+                    postings.pop(key, None)
+                    if postings:
+                        continue
+                    del self._postings[word]
+                    self._trie.remove(word)
+                    for trigram in trigrams(word):
+                        self._trigrams[trigram].discard(word)
+                        if not self._trigrams[trigram]:
+                            del self._trigrams[trigram]
+
+    def _term_matches(self, term):
+        """{word: score} for the indexed words a query term matches"""
+        matches = {word: PREFIX_SCORE for word in self._trie.complete(term)}
+        if term in matches:
+            matches[term] = 1.0
+        if len(term) >= 3:
+            # Trigrams narrow the words down to likely misspellings, the
+            # edit distance decides
+            grams = trigrams(term)
+            shared = defaultdict(int)
+            for trigram in grams:
+                for word in self._trigrams.get(trigram, ()):
+                    shared[word] += 1
+            allowed = max(1, len(term) // LETTERS_PER_EDIT)
+            for word, n in shared.items():
+                if word in matches or n / (len(grams) + len(word) + 1 - n) < MIN_SIMILARITY:
+                    continue
+                # A partly typed word is compared with the same length prefix
+                edits = min(edit_distance(term, word), edit_distance(term, word[:len(term)]))
+                if edits <= allowed:
+                    matches[word] = FUZZY_SCORE * (1 - edits / (allowed + 1))
+        return matches
+
+    def search(self, terms):
+        """[(score, object)] for objects matching every term"""
+        with self._lock:
+            scores = None
+            for term in terms:
+                term_scores = {}
+                for word, score in self._term_matches(term).items():
+                    for key, weight in self._postings[word].items():
+                        if score * weight > term_scores.get(key, 0):
+                            term_scores[key] = score * weight
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {key: scores[key] + s for key, s in term_scores.items() if key in scores}
+                if not scores:
+                    return []
+            return [(score, self._objects[key][0]) for key, score in (scores or {}).items()]
+
+
+search_cache = FloorCache(SearchIndex, "search")
+
+
+def object_distance(item, lat, lng):
+    """Distance in metres from an object to a point, or None without a position"""
+    latlng = item.get("latlng")
+    if not isinstance(latlng, (list, tuple)) or len(latlng) < 2:
+        return None
+    return hypot(float(latlng[0]) - lat, float(latlng[1]) - lng) * METERS_PER_DEGREE
+
+
+def rank(indexes, query, near=None, limit=10):
+    """
+    The best `limit` objects across floors for a query, as
+    [{"floor_id", "score", "distance", "object"}]. Every word of the query
+    must match, as a whole word, the start of one (so partially typed
+    words complete) or a close misspelling. With near=(lat, lng) closer
+    objects rank higher.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return []
+    results = []
+    for index in indexes:
+        for score, item in index.search(terms):
+            distance = None
+            if near is not None:
+                distance = object_distance(item, *near)
+                if distance is not None:
+                    score /= 1 + distance / NEAR_METERS
+            results.append((score, index.floor_id, distance, item))
+
+    return [
+        {
+            "floor_id": floor_id,
+            "score": round(score, 4),
+            "distance": None if distance is None else round(distance, 2),
+            "object": item,
+        }
+        for score, floor_id, distance, item in nlargest(limit, results, key=lambda r: r[0])
+    ]
@@ -0,0 +1,168 @@
+import numpy as np
+
+# Levels of detail precomputed for every route and boundary. Level z keeps
+# the vertices that move the shape by more than one pixel at zoom z
+# (256 px tiles); zooms above the last level get full resolution.
+LOD_ZOOMS = (13, 15, 17)
+
+
+def zoom_tolerance(zoom):
+    """One screen pixel in degrees of longitude at a zoom level"""
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def lod_level(zoom=None, tolerance=None):
+    """
+    The precomputed level serving a zoom or a tolerance in degrees, or None
+    for full resolution: the coarsest level that is still at least as
+    detailed as asked for.
+    """
+    if zoom is not None:
+        levels = [z for z in LOD_ZOOMS if z >= zoom]
+    elif tolerance is not None:
+        levels = [z for z in LOD_ZOOMS if zoom_tolerance(z) <= tolerance]
+    else:
+        return None
+    return str(min(levels)) if levels else None
+
+
+def douglas_peucker(xs, ys, tolerance, pinned=()):
+    """
+    Indices of the vertices Douglas-Peucker keeps. Pinned indices and both
+    ends are always kept, so junctions shared with other routes survive
+    and the network stays connected. Distances of a whole span to its
+    chord are computed at once.
+    """
+    n = len(xs)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    keep[list(pinned)] = True
+
+    anchors = np.flatnonzero(keep)
+    stack = list(zip(anchors[:-1].tolist(), anchors[1:].tolist()))
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        px, py = xs[start + 1:end], ys[start + 1:end]
+        ax, ay = xs[start], ys[start]
+        dx, dy = xs[end] - ax, ys[end] - ay
+        length2 = dx * dx + dy * dy
+        if length2 > 0:
+            t = np.clip(((px - ax) * dx + (py - ay) * dy) / length2, 0.0, 1.0)
+        else:
+            t = np.zeros(len(px))
+        distance = np.hypot(px - (ax + t * dx), py - (ay + t * dy))
+        farthest = int(np.argmax(distance))
+        if distance[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return np.flatnonzero(keep).tolist()
+
+
+def _route_lines(item):
+    """Indices and coordinates of a route's usable path points"""
+    path = item.get("path")
+    if not isinstance(path, list):
+        return []
+    indices = [
+        i for i, p in enumerate(path)
+        if isinstance(p, dict) and p.get("x") is not None and p.get("y") is not None
+    ]
+    return [(indices, [float(path[i]["x"]) for i in indices], [float(path[i]["y"]) for i in indices])]
+
+
+def _boundary_rings(item):
+    geometry = item.get("geometry")
+    if not isinstance(geometry, dict) or not isinstance(geometry.get("coordinates"), list):
+        return []
+    rings = []
+    for ring in geometry["coordinates"]:
+        if not isinstance(ring, list):
+            ring = []
+        indices = [i for i, c in enumerate(ring) if isinstance(c, (list, tuple)) and len(c) >= 2]
+        rings.append((indices, [float(ring[i][0]) for i in indices], [float(ring[i][1]) for i in indices]))
+    return rings
+
+
+def _simplify_route(item, tolerance):
+    lines = []
+    for indices, xs, ys in _route_lines(item):
+        if len(indices) < 3:
+            lines.append(indices)
+            continue
+        path = item["path"]
+        # Merged points join this route to others in the navigation graph
+        pinned = [k for k, i in enumerate(indices) if path[i].get("merged") or (path[i].get("count") or 1) > 1]
+        kept = douglas_peucker(np.array(xs), np.array(ys), tolerance, pinned)
+        lines.append([indices[k] for k in kept])
+    return lines
+
+
+def _simplify_boundary(item, tolerance):
+    rings = []
+    for indices, xs, ys in _boundary_rings(item):
+        # A ring needs three corners plus its closing point to stay a polygon
+        if len(indices) < 5:
+            rings.append(indices)
+            continue
+        xs, ys = np.array(xs), np.array(ys)
+        # Also pin the corner farthest from the start so the ring cannot
+        # collapse onto its closing chord
+        far = int(np.argmax(np.hypot(xs - xs[0], ys - ys[0])))
+        kept = douglas_peucker(xs, ys, tolerance, [far])
+        if len(kept) < 4:
+            kept = list(range(len(indices)))
+        rings.append([indices[k] for k in kept])
+    return rings
+
+
+SIMPLIFIERS = {
+    "routes": _simplify_route,
+    "boundaries": _simplify_boundary,
+    "innerBoundaries": _simplify_boundary,
+}
+
+
+def compute_lod(collection, item):
+    """
+    {level: [kept vertex indices per line or ring]} for an item, or None for
+    collections without line geometry. Levels that keep every vertex are
+    left out since they are the same as full resolution.
+    """
+    simplify = SIMPLIFIERS.get(collection)
+    if simplify is None:
+        return None
+    if not isinstance(item, dict):
+        return {}
+    full = [indices for indices, _, _ in (_route_lines(item) if collection == "routes" else _boundary_rings(item))]
+    levels = {}
+    for zoom in LOD_ZOOMS:
+        kept = simplify(item, zoom_tolerance(zoom))
+        if kept != full:
+            levels[str(zoom)] = kept
+    return levels
+
+
+def apply_lod(collection, item, lod, level):
+    """The item with its geometry reduced to the vertices kept at level"""
+    if level is None or not lod or level not in lod or not isinstance(item, dict):
+        return item
+    kept = lod[level]
+    if collection == "routes":
+        path = item["path"]
+        return {**item, "path": [path[i] for i in kept[0]]} if kept else item
+    geometry = item["geometry"]
+    rings = geometry["coordinates"]
+    return {**item, "geometry": {**geometry, "coordinates": [
+        [ring[i] for i in indices] for ring, indices in zip(rings, kept)
+    ]}}
+
+
+def simplify_items(collection, items, level):
+    """Items at a level of detail, simplifying on the fly (for items read without their lod)"""
+    if level is None or collection not in SIMPLIFIERS:
+        return items
+    return [apply_lod(collection, item, compute_lod(collection, item), level) for item in items]
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import threading
+from sqlalchemy.exc import MissingGreenlet
+from sqlalchemy.util import await_only
+from .metrics import record_single_flight
+
+# Longest a request waits on another one's computation before giving up
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_TIMEOUT", 30))
+
+
+class CoalescedCallTimeout(TimeoutError):
+    """The computation this call was waiting on did not finish in time"""
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # (loop, future) of callers waiting on an event loop thread
+        self.waiters = []
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class SingleFlight:
+    """
+    Runs fn once per key at a time across threads: calls for a key that
+    is already being computed wait for that computation and share its
+    result or exception. Nothing is cached once it finishes; callers keep
+    their own caches and use this only on a miss. Per process, so each
+    worker still computes once.
+
+    Callers on the event loop thread (sync code under AsyncSession.run_sync)
+    must not block it, since the computation they wait for may need the
+    loop; they suspend their greenlet on a future instead.
+    """
+
+    def __init__(self, name, timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            finished = self._wait(call)
+            if finished is None:
+                # On the loop thread outside run_sync: neither blocking nor
+                # suspending is possible, so compute uncoalesced
+                return fn()
+            if not finished:
+                record_single_flight(self.name, "timeout")
+                raise CoalescedCallTimeout(f"{self.name} {key!r} still running after {self.timeout:g}s")
+            if isinstance(call.error, asyncio.CancelledError):
+                # The leader's request went away, not the computation failing
+                return self.do(key, fn)
+            record_single_flight(self.name, "coalesced" if call.error is None else "error")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            record_single_flight(self.name, "executed")
+            return call.result
+        except BaseException as e:
+            call.error = e
+            record_single_flight(self.name, "error")
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                call.done.set()
+            for loop, future in call.waiters:
+                loop.call_soon_threadsafe(_wake, future)
+
+    def _wait(self, call):
+        """True once call is done, False on timeout, None if this thread cannot wait"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return call.done.wait(self.timeout)
+
+        future = loop.create_future()
+        with self._lock:
+            if call.done.is_set():
+                return True
+            call.waiters.append((loop, future))
+        waiting = asyncio.wait_for(asyncio.shield(future), self.timeout)
+        try:
+            await_only(waiting)
+        except asyncio.TimeoutError:
+            return False
+        except MissingGreenlet:
+            waiting.close()
+            return None
+        return True
+
+
+class _LeaderCancelled(Exception):
+    """The request computing the value went away; a waiter takes over"""
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines on one event loop. fn runs in the first
+    caller's task; if that caller is cancelled (a client disconnecting),
+    one of the waiters runs fn again instead of failing them all.
+    """
+
+    def __init__(self, name, timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self._calls = {}
+
+    async def do(self, key, fn):
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                break
+            try:
+                result = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+            except _LeaderCancelled:
+                continue
+            except asyncio.TimeoutError:
+                record_single_flight(self.name, "timeout")
+                raise CoalescedCallTimeout(f"{self.name} {key!r} still running after {self.timeout:g}s")
+            except Exception:
+                record_single_flight(self.name, "error")
+                raise
+            record_single_flight(self.name, "coalesced")
+            return result
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.set_exception(_LeaderCancelled())
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            record_single_flight(self.name, "error")
+            raise
+        else:
+            future.set_result(result)
+            record_single_flight(self.name, "executed")
+            return result
+        finally:
+            del self._calls[key]
+            # Nobody may be waiting; do not log the exception as never retrieved
+            if future.done() and not future.cancelled():
+                future.exception()
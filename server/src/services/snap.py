@@ -0,0 +1,126 @@
+from math import floor
+import numpy as np
+from .cache import FloorCache
+from .routing import MERGE_THRESHOLD
+
+# Route points this close to an object are never merged
+OBJECT_BUFFER = 0.0002
+
+
+class SnapIndex:
+    """
+    Route points and objects of one floor as struct-of-arrays coordinates
+    hashed into grid cells, for merging a newly drawn corridor into the
+    existing ones.
+
+    Cells are as wide as the search radius, so every candidate within it
+    lies in the 3x3 block around a point. A path is merged with one
+    vectorized distance computation over its (point, candidate) pairs
+    instead of comparing each point with every point of every route.
+    """
+
+    __slots__ = ("floor_id", "version", "xs", "ys", "cells", "object_xs", "object_ys", "object_cells")
+
+    def __init__(self, floor_id, version, map_data):
+        self.floor_id = floor_id
+        self.version = version
+
+        object_xy = [
+            (float(obj["latlng"][1]), float(obj["latlng"][0]))
+            for obj in map_data.get("objects", []) or []
+            if isinstance(obj, dict) and isinstance(obj.get("latlng"), (list, tuple)) and len(obj["latlng"]) >= 2
+        ]
+        self.object_xs, self.object_ys = _finite(*_columns(object_xy))
+        self.object_cells = _hash(self.object_xs, self.object_ys, OBJECT_BUFFER)
+
+        route_xy = [
+            (float(point["x"]), float(point["y"]))
+            for route in map_data.get("routes", []) or [] if isinstance(route, dict)
+            for point in route.get("path", []) or []
+            if isinstance(point, dict) and point.get("x") is not None and point.get("y") is not None
+        ]
+        xs, ys = _finite(*_columns(route_xy))
+        # Points near an object are never merged into
+        keep = ~self.near_objects(xs, ys)
+        self.xs, self.ys = xs[keep], ys[keep]
+        self.cells = _hash(self.xs, self.ys, MERGE_THRESHOLD)
+
+    def near_objects(self, xs, ys):
+        """Boolean array: True where an object is closer than OBJECT_BUFFER"""
+        near = np.zeros(len(xs), dtype=bool)
+        p, o = _candidates(self.object_cells, xs, ys, OBJECT_BUFFER)
+        hits = np.hypot(xs[p] - self.object_xs[o], ys[p] - self.object_ys[o]) < OBJECT_BUFFER
+        near[p[hits]] = True
+        return near
+
+    def merge_path(self, path):
+        """
+        The path with each point averaged with the route points within
+        MERGE_THRESHOLD (exact duplicates excluded), unless it or they are
+        near an object. Merged points get merged=True and count = nearby + 1,
+        others keep their fields with merged=False and count=1.
+        """
+        for point in path:
+            if not isinstance(point, dict) or not _is_finite(point.get("x")) or not _is_finite(point.get("y")):
+                raise ValueError("Path points need finite numeric x and y")
+        xs, ys = _columns([(point["x"], point["y"]) for point in path])
+
+        p, c = _candidates(self.cells, xs, ys, MERGE_THRESHOLD)
+        d = np.hypot(xs[p] - self.xs[c], ys[p] - self.ys[c])
+        nearby = (d > 0) & (d < MERGE_THRESHOLD) & ~self.near_objects(xs, ys)[p]
+        p, c = p[nearby], c[nearby]
+
+        n = np.bincount(p, minlength=len(xs)) + 1
+        mx = (xs + np.bincount(p, weights=self.xs[c], minlength=len(xs))) / n
+        my = (ys + np.bincount(p, weights=self.ys[c], minlength=len(xs))) / n
+
+        merged_path = []
+        for i, point in enumerate(path):
+            if n[i] > 1:
+                merged_path.append({"x": float(mx[i]), "y": float(my[i]), "merged": True, "count": int(n[i])})
+            else:
+                merged_path.append({**point, "merged": False, "count": 1})
+        return merged_path
+
+
+def _columns(xy):
+    xy = np.array(xy, dtype=np.float64).reshape(-1, 2)
+    return xy[:, 0].copy(), xy[:, 1].copy()
+
+
+def _finite(xs, ys):
+    """Drop points with an infinite or NaN coordinate, which have no cell"""
+    keep = np.isfinite(xs) & np.isfinite(ys)
+    return xs[keep], ys[keep]
+
+
+def _hash(xs, ys, size):
+    """{cell: indices of the points in it}"""
+    cells = {}
+    for i, (x, y) in enumerate(zip(xs.tolist(), ys.tolist())):
+        cells.setdefault((floor(x / size), floor(y / size)), []).append(i)
+    return {cell: np.array(indices, dtype=np.int_) for cell, indices in cells.items()}
+
+
+def _candidates(cells, xs, ys, size):
+    """(query, candidate) index arrays pairing each point with those in its 3x3 cells"""
+    points, candidates = [], []
+    for i, (x, y) in enumerate(zip(xs.tolist(), ys.tolist())):
+        cx, cy = floor(x / size), floor(y / size)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                found = cells.get((cx + dx, cy + dy))
+                if found is not None:
+                    candidates.append(found)
+                    points.append(np.full(len(found), i))
+    if not candidates:
+        empty = np.empty(0, dtype=np.int_)
+        return empty, empty
+    return np.concatenate(points), np.concatenate(candidates)
+
+
+def _is_finite(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and np.isfinite(value)
+
+
+snap_cache = FloorCache(SnapIndex, "snap")
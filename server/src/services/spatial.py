@@ -0,0 +1,296 @@
+from collections import defaultdict
+from heapq import heappush, heappushpop
+from itertools import count
+from math import floor, hypot, isfinite
+import threading
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..models.base import Floor
+from .cache import FloorCache
+from .features import cached_floor_entry
+from .routing import METERS_PER_DEGREE
+
+# Grid cell edge in degrees (~55 m), a few corridor segments per cell
+CELL_SIZE = 0.0005
+
+COLLECTIONS = ("objects", "routes", "boundaries", "innerBoundaries")
+
+
+def item_bbox(collection, item):
+    """(min_x, min_y, max_x, max_y) of an item in lng/lat, or None if it has no geometry"""
+    if collection == "objects":
+        latlng = item.get("latlng")
+        if not isinstance(latlng, (list, tuple)) or len(latlng) < 2:
+            return None
+        x, y = float(latlng[1]), float(latlng[0])
+        return (x, y, x, y)
+
+    if collection == "routes":
+        points = [
+            (float(p["x"]), float(p["y"])) for p in item.get("path", []) or []
+            if isinstance(p, dict) and p.get("x") is not None and p.get("y") is not None
+        ]
+    else:
+        points = [(float(c[0]), float(c[1])) for c in polygon_ring(item)]
+    if not points:
+        return None
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def polygon_ring(item):
+    """Outer ring of a boundary's GeoJSON polygon as [lng, lat] pairs"""
+    geometry = item.get("geometry") or {}
+    coordinates = geometry.get("coordinates") or []
+    if not coordinates or not isinstance(coordinates[0], list):
+        return []
+    return [c for c in coordinates[0] if isinstance(c, (list, tuple)) and len(c) >= 2]
+
+
+def point_in_ring(x, y, ring):
+    """Even-odd ray casting test"""
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i][0], ring[i][1]
+        xj, yj = ring[j][0], ring[j][1]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+class _Grid:
+    """Uniform grid hash; each entry is registered in every cell its bbox covers"""
+
+    def __init__(self):
+        self.cells = defaultdict(set)
+        self.bboxes = {}
+        self.bounds = None
+
+    @staticmethod
+    def _cell_range(bbox):
+        return (
+            floor(bbox[0] / CELL_SIZE), floor(bbox[1] / CELL_SIZE),
+            floor(bbox[2] / CELL_SIZE), floor(bbox[3] / CELL_SIZE),
+        )
+
+    def __len__(self):
+        return len(self.bboxes)
+
+    def insert(self, key, bbox):
+        self.bboxes[key] = bbox
+        x0, y0, x1, y1 = self._cell_range(bbox)
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                self.cells[(cx, cy)].add(key)
+        if self.bounds is None:
+            self.bounds = (x0, y0, x1, y1)
+        else:
+            b = self.bounds
+            self.bounds = (min(b[0], x0), min(b[1], y0), max(b[2], x1), max(b[3], y1))
+
+    def remove(self, key):
+        bbox = self.bboxes.pop(key, None)
+        if bbox is None:
+            return
+        x0, y0, x1, y1 = self._cell_range(bbox)
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell is not None:
+                    cell.discard(key)
+                    if not cell:
+                        del self.cells[(cx, cy)]
+
+    def query(self, bbox):
+        """Keys whose bbox intersects bbox"""
+        x0, y0, x1, y1 = self._cell_range(bbox)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.cells):
+            # Viewport covers more cells than are occupied: walk the occupied ones
+            candidates = set()
+            for (cx, cy), keys in self.cells.items():
+                if x0 <= cx <= x1 and y0 <= cy <= y1:
+                    candidates |= keys
+        else:
+            candidates = set()
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    keys = self.cells.get((cx, cy))
+                    if keys:
+                        candidates |= keys
+
+        return [
+            key for key in candidates
+            if _intersects(self.bboxes[key], bbox)
+        ]
+
+    def nearest(self, x, y, limit):
+        """
+        Up to `limit` (distance in degrees, key) pairs closest to (x, y),
+        searching rings of cells outwards until no closer entry can exist.
+        Rings start at the first one that reaches the occupied cells, and
+        once the next ring would probe more cells than are occupied the
+        rest are scanned directly, so a point far from the floor costs no
+        more than one pass over the grid.
+        """
+        if self.bounds is None:
+            return []
+        cx, cy = floor(x / CELL_SIZE), floor(y / CELL_SIZE)
+        b = self.bounds
+        min_ring = max(b[0] - cx, cx - b[2], b[1] - cy, cy - b[3], 0)
+        max_ring = max(abs(cx - b[0]), abs(cx - b[2]), abs(cy - b[1]), abs(cy - b[3]))
+
+        best = []  # max-heap of (-distance, key)
+        seen = set()
+
+        def consider(key):
+            if key in seen:
+                return
+            seen.add(key)
+            bx0, by0, bx1, by1 = self.bboxes[key]
+            d = hypot(max(bx0 - x, 0, x - bx1), max(by0 - y, 0, y - by1))
+            if len(best) < limit:
+                heappush(best, (-d, key))
+            elif d < -best[0][0]:
+                heappushpop(best, (-d, key))
+
+        probed = 0
+        for ring in range(min_ring, max_ring + 1):
+            # Every entry in this ring or further is at least this far away
+            if len(best) >= limit and (ring - 1) * CELL_SIZE >= -best[0][0]:
+                break
+            ring_size = 8 * ring or 1
+            if probed + ring_size > len(self.cells):
+                for (gx, gy), keys in self.cells.items():
+                    if max(abs(gx - cx), abs(gy - cy)) >= ring:
+                        for key in keys:
+                            consider(key)
+                break
+            probed += ring_size
+            for cell in _ring_cells(cx, cy, ring):
+                for key in self.cells.get(cell, ()):
+                    consider(key)
+
+        return sorted((-d, key) for d, key in best)
+
+
+def _intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _ring_cells(cx, cy, ring):
+    if ring == 0:
+        yield (cx, cy)
+        return
+    for dx in range(-ring, ring + 1):
+        yield (cx + dx, cy - ring)
+        yield (cx + dx, cy + ring)
+    for dy in range(-ring + 1, ring):
+        yield (cx - ring, cy + dy)
+        yield (cx + ring, cy + dy)
+
+
+class SpatialIndex:
+    """
+    Grid index over one floor's objects, route polylines and boundary
+    polygons. Kept in sync with single-item writes through add/remove.
+    """
+
+    def __init__(self, floor_id, version, map_data):
+        self.floor_id = floor_id
+        self.version = version
+        self._keys = count()
+        # key -> (collection, item, bbox)
+        self._entries = {}
+        self._uids = defaultdict(list)
+        self._grids = {collection: _Grid() for collection in COLLECTIONS}
+        self._types = defaultdict(_Grid)
+        self._lock = threading.Lock()
+
+        for collection in COLLECTIONS:
+            for item in map_data.get(collection, []) or []:
+                if isinstance(item, dict):
+                    self._add(collection, item)
+
+    def _add(self, collection, item):
+        bbox = item_bbox(collection, item)
+        if bbox is None:
+            return
+        key = next(self._keys)
+        self._entries[key] = (collection, item, bbox)
+        self._uids[(collection, item.get("id"))].append(key)
+        self._grids[collection].insert(key, bbox)
+        if collection == "objects":
+            self._types[item.get("type")].insert(key, bbox)
+
+    def add(self, collection, item):
+        with self._lock:
+            self._add(collection, item)
+
+    def remove(self, collection, uid):
+        with self._lock:
+            for key in self._uids.pop((collection, uid), []):
+                _, item, _ = self._entries.pop(key)
+                self._grids[collection].remove(key)
+                if collection == "objects":
+                    self._types[item.get("type")].remove(key)
+
+    def query_bbox(self, collection, bbox):
+        """Items of a collection intersecting bbox, in their list order"""
+        with self._lock:
+            keys = self._grids[collection].query(bbox)
+            return [self._entries[key][1] for key in sorted(keys)]
+
+    def nearest(self, x, y, type=None, limit=1):
+        """[(distance in metres, object)] for the objects closest to (x, y)"""
+        with self._lock:
+            grid = self._grids["objects"] if type is None else self._types.get(type)
+            if grid is None:
+                return []
+            return [
+                (d * METERS_PER_DEGREE, self._entries[key][1])
+                for d, key in grid.nearest(x, y, limit)
+            ]
+
+    def containing(self, x, y):
+        """[(collection, boundary)] for every boundary or inner boundary containing (x, y)"""
+        point = (x, y, x, y)
+        result = []
+        with self._lock:
+            for collection in ("boundaries", "innerBoundaries"):
+                for key in sorted(self._grids[collection].query(point)):
+                    _, item, _ = self._entries[key]
+                    if point_in_ring(x, y, polygon_ring(item)):
+                        result.append((collection, item))
+        return result
+
+
+spatial_cache = FloorCache(SpatialIndex, "spatial")
+
+
+def parse_bbox(value):
+    """Parse Leaflet's toBBoxString() format: "west,south,east,north" """
+    try:
+        west, south, east, north = bounds = [float(part) for part in value.split(",")]
+    except ValueError:
+        raise ValueError("bbox must be west,south,east,north")
+    # float() accepts inf and nan, which the grid cannot index
+    if not all(isfinite(v) for v in bounds):
+        raise ValueError("bbox coordinates must be finite numbers")
+    return (min(west, east), min(south, north), max(west, east), max(south, north))
+
+
+def check_point(lat, lng):
+    """Raise ValueError unless lat and lng are finite numbers"""
+    if not (isfinite(lat) and isfinite(lng)):
+        raise ValueError("lat and lng must be finite numbers")
+
+
+async def floor_spatial_index(db: AsyncSession, floor_id: int):
+    """The floor's current spatial index, or None if the floor does not exist"""
+    version = await db.scalar(select(Floor.version).where(Floor.id == floor_id))
+    if version is None:
+        return None
+    return await cached_floor_entry(spatial_cache, floor_id, version)
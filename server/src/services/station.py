@@ -0,0 +1,232 @@
+from heapq import heappush, heappop
+from math import hypot, inf
+import threading
+from .routing import shortest_path_tree, path_to
+from .singleflight import SingleFlight
+
+# Extra walking-equivalent cost in metres for changing one level
+CONNECTOR_COSTS = {
+    "stairs": 15.0,
+    "escalator": 12.0,
+    "elevator": 30.0,
+}
+
+# Connectors usable in accessibility mode
+STEP_FREE_TYPES = {"elevator"}
+
+# Connectors without a shared connectorId are linked to the nearest connector
+# of the same type on the adjacent level within this distance (degrees)
+CONNECTOR_SNAP = 0.0005
+
+
+class StationGraph:
+    """
+    Overlay graph linking the floors of a station.
+
+    Every stairs/escalator/elevator object is an overlay node. Nodes on the
+    same floor are joined by precomputed shortcut edges holding the walking
+    distance and node path between them; nodes on adjacent levels are joined
+    by vertical edges. A cross-floor query then only searches its two end
+    floors up to their connectors plus this small overlay.
+    """
+
+    def __init__(self, key, floors):
+        self.key = key
+        # floor_id -> (level, NavGraph)
+        self.floors = {floor_id: (level, graph) for floor_id, level, graph in floors}
+        self.object_floors = {}
+        for floor_id, _, graph in floors:
+            for object_id in graph.object_nodes:
+                self.object_floors.setdefault(object_id, floor_id)
+
+        # Overlay nodes: (floor_id, graph node, connector type)
+        self.connectors = []
+        self.floor_connectors = {}
+        for floor_id, _, graph in floors:
+            for object_id, connector_type in graph.object_types.items():
+                if connector_type in CONNECTOR_COSTS:
+                    index = len(self.connectors)
+                    self.connectors.append((floor_id, graph.object_nodes[object_id], connector_type, object_id))
+                    self.floor_connectors.setdefault(floor_id, []).append(index)
+
+        # adjacency[i] = [(j, weight, shortcut nodes or None for vertical edges)]
+        self.adjacency = [[] for _ in self.connectors]
+        self._add_shortcuts()
+        self._add_vertical_links(floors)
+
+    def _add_shortcuts(self):
+        for floor_id, indexes in self.floor_connectors.items():
+            _, graph = self.floors[floor_id]
+            nodes = {self.connectors[i][1]: i for i in indexes}
+            for i in indexes:
+                source = self.connectors[i][1]
+                dist, prev = shortest_path_tree(graph, source, stop_at=nodes.keys())
+                for node, j in nodes.items():
+                    if j != i and dist[node] < inf:
+                        self.adjacency[i].append((j, dist[node], path_to(prev, source, node)))
+
+    def _add_vertical_links(self, floors):
+        levels = sorted({level for _, level, _ in floors})
+        by_level = {}
+        for floor_id, level, _ in floors:
+            by_level.setdefault(level, []).extend(self.floor_connectors.get(floor_id, []))
+
+        for lower, upper in zip(levels, levels[1:]):
+            uppers = by_level.get(upper, [])
+            for i in by_level.get(lower, []):
+                j = self._match(i, uppers)
+                if j is None:
+                    continue
+                weight = CONNECTOR_COSTS[self.connectors[i][2]] * (upper - lower)
+                self.adjacency[i].append((j, weight, None))
+                self.adjacency[j].append((i, weight, None))
+
+    def _match(self, i, candidates):
+        floor_id, node, connector_type, object_id = self.connectors[i]
+        graph = self.floors[floor_id][1]
+        key = graph.connector_keys.get(object_id)
+        x, y = graph.xs[node], graph.ys[node]
+
+        best, best_distance = None, CONNECTOR_SNAP
+        for j in candidates:
+            other_floor, other_node, other_type, other_id = self.connectors[j]
+            if other_type != connector_type:
+                continue
+            other_graph = self.floors[other_floor][1]
+            other_key = other_graph.connector_keys.get(other_id)
+            if key is not None or other_key is not None:
+                if key == other_key:
+                    return j
+                continue
+            d = hypot(other_graph.xs[other_node] - x, other_graph.ys[other_node] - y)
+            if d < best_distance:
+                best, best_distance = j, d
+        return best
+
+    def route(self, from_id, to_id, accessible=False):
+        """
+        Shortest route between two objects anywhere in the station.
+        Returns (distance, [(floor_id, [nodes]), ...]) or None.
+        """
+        source_floor = self.object_floors.get(from_id)
+        target_floor = self.object_floors.get(to_id)
+        if source_floor is None or target_floor is None:
+            raise KeyError(from_id if source_floor is None else to_id)
+
+        source_graph = self.floors[source_floor][1]
+        target_graph = self.floors[target_floor][1]
+        source = source_graph.object_nodes[from_id]
+        target = target_graph.object_nodes[to_id]
+
+        source_exits = self.floor_connectors.get(source_floor, [])
+        target_exits = self.floor_connectors.get(target_floor, [])
+
+        stop_at = {self.connectors[i][1] for i in source_exits}
+        if source_floor == target_floor:
+            stop_at.add(target)
+        dist_s, prev_s = shortest_path_tree(source_graph, source, stop_at=stop_at)
+        dist_t, prev_t = shortest_path_tree(
+            target_graph, target, stop_at={self.connectors[i][1] for i in target_exits}
+        )
+
+        best = inf
+        best_end = None
+        if source_floor == target_floor and dist_s[target] < inf:
+            best = dist_s[target]
+
+        # Dijkstra over the overlay, seeded with the walk to each exit
+        dist = [inf] * len(self.connectors)
+        prev = [None] * len(self.connectors)
+        heap = []
+        for i in source_exits:
+            d = dist_s[self.connectors[i][1]]
+            if d < inf:
+                dist[i] = d
+                heappush(heap, (d, i))
+
+        exits = set(target_exits)
+        while heap:
+            d, i = heappop(heap)
+            if d > dist[i] or d >= best:
+                continue
+            if i in exits:
+                total = d + dist_t[self.connectors[i][1]]
+                if total < best:
+                    best, best_end = total, i
+            for j, weight, shortcut in self.adjacency[i]:
+                if shortcut is None and accessible and self.connectors[i][2] not in STEP_FREE_TYPES:
+                    continue
+                candidate = d + weight
+                if candidate < dist[j]:
+                    dist[j] = candidate
+                    prev[j] = (i, shortcut)
+                    heappush(heap, (candidate, j))
+
+        if best == inf:
+            return None
+        if best_end is None:
+            return best, [(source_floor, path_to(prev_s, source, target))]
+
+        # Unpack overlay hops back into per-floor node paths
+        hops = []
+        i = best_end
+        while prev[i] is not None:
+            hops.append((i, prev[i][1]))
+            i = prev[i][0]
+        hops.reverse()
+
+        first = self.connectors[i]
+        legs = [(source_floor, path_to(prev_s, source, first[1]))]
+        for j, shortcut in hops:
+            floor_id = self.connectors[j][0]
+            if shortcut is None:
+                legs.append((floor_id, [self.connectors[j][1]]))
+            else:
+                legs[-1][1].extend(shortcut[1:])
+
+        end = self.connectors[best_end][1]
+        tail = path_to(prev_t, target, end)
+        tail.reverse()
+        legs[-1][1].extend(tail[1:])
+        return best, legs
+
+
+class StationCache:
+    """Holds the station graph for the current set of floor versions"""
+
+    def __init__(self):
+        self._station = None
+        self._lock = threading.Lock()
+        self._flight = SingleFlight("station")
+
+    @staticmethod
+    def _key(floors):
+        return tuple((floor_id, level, graph.version) for floor_id, level, graph in floors)
+
+    def peek(self, floors):
+        """The station graph for these floors if it is already built, else None"""
+        station = self._station
+        key = self._key(sorted(floors, key=lambda f: (f[1], f[0])))
+        return station if station is not None and station.key == key else None
+
+    def get(self, floors):
+        """floors: iterable of (floor_id, level, NavGraph)"""
+        floors = sorted(floors, key=lambda f: (f[1], f[0]))
+        key = self._key(floors)
+        station = self._station
+        if station is not None and station.key == key:
+            return station
+        return self._flight.do(key, lambda: self._build(key, floors))
+
+    def _build(self, key, floors):
+        station = StationGraph(key, floors)
+        with self._lock:
+            self._station = station
+        return station
+
+    def invalidate(self):
+        with self._lock:
+            self._station = None
+
+
+station_cache = StationCache()
@@ -0,0 +1,448 @@
+from collections import OrderedDict, deque
+from hashlib import blake2b
+from math import atan, cos, degrees, log, pi, radians, sinh, tan
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import numpy as np
+from sqlalchemy.engine import make_url
+from ..database import SQLALCHEMY_DATABASE_URL
+from .simplify import douglas_peucker
+from .spatial import item_bbox, polygon_ring
+
+# Tile coordinate space and the margin kept around it so strokes and
+# polygon edges do not show seams between neighbouring tiles
+EXTENT = 4096
+BUFFER = 64
+MAX_ZOOM = 24
+# One screen pixel in tile units (tiles are drawn 256 px wide): lines and
+# rings are simplified to this tolerance, so a zoomed-out tile only carries
+# the vertices that show
+PIXEL = EXTENT / 256
+
+TILE_CACHE_DIR = os.getenv("TILE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "raildisha-tiles"))
+TILE_MEMORY_TILES = int(os.getenv("TILE_MEMORY_TILES", 4096))
+# Writes remembered per floor for deciding which cached tiles they touched
+TILE_WRITE_LOG = 256
+
+LAYERS = ("boundaries", "innerBoundaries", "routes", "objects")
+
+GEOMETRY_POINT = 1
+GEOMETRY_LINESTRING = 2
+GEOMETRY_POLYGON = 3
+
+
+# --- Web Mercator tile math (the scheme Leaflet's default CRS uses) ---
+
+def tile_bbox(z, x, y, buffer=0):
+    """(west, south, east, north) of a tile in lng/lat, grown by buffer tile units"""
+    n = 2 ** z
+    margin = buffer / EXTENT
+
+    def lng(tx):
+        return tx / n * 360.0 - 180.0
+
+    def lat(ty):
+        return degrees(atan(sinh(pi * (1 - 2 * ty / n))))
+
+    return (lng(x - margin), lat(y + 1 + margin), lng(x + 1 + margin), lat(y - margin))
+
+
+def _projector(z, x, y):
+    """Function mapping (lng, lat) to float coordinates inside tile (z, x, y)"""
+    scale = 2 ** z * EXTENT
+
+    def project(lng, lat):
+        world_x = (lng + 180.0) / 360.0
+        world_y = (1 - log(tan(radians(lat)) + 1 / cos(radians(lat))) / pi) / 2
+        return world_x * scale - x * EXTENT, world_y * scale - y * EXTENT
+
+    return project
+
+
+# --- Clipping in tile coordinates ---
+
+def _clip_polygon(ring, low, high):
+    """Sutherland-Hodgman clip of a ring against the square [low, high]"""
+    def clip(points, inside, intersect):
+        result = []
+        for i, current in enumerate(points):
+            previous = points[i - 1]
+            if inside(current):
+                if not inside(previous):
+                    result.append(intersect(previous, current))
+                result.append(current)
+            elif inside(previous):
+                result.append(intersect(previous, current))
+        return result
+
+    def at_x(bound):
+        return lambda a, b: (bound, a[1] + (b[1] - a[1]) * (bound - a[0]) / (b[0] - a[0]))
+
+    def at_y(bound):
+        return lambda a, b: (a[0] + (b[0] - a[0]) * (bound - a[1]) / (b[1] - a[1]), bound)
+
+    for inside, intersect in (
+        (lambda p: p[0] >= low, at_x(low)),
+        (lambda p: p[0] <= high, at_x(high)),
+        (lambda p: p[1] >= low, at_y(low)),
+        (lambda p: p[1] <= high, at_y(high)),
+    ):
+        if not ring:
+            break
+        ring = clip(ring, inside, intersect)
+    return ring
+
+
+def _clip_line(points, low, high):
+    """Liang-Barsky clip of a polyline against [low, high]; returns the parts inside"""
+    parts, current = [], []
+    for a, b in zip(points, points[1:]):
+        t0, t1 = 0.0, 1.0
+        dx, dy = b[0] - a[0], b[1] - a[1]
+        visible = True
+        for p, q in ((-dx, a[0] - low), (dx, high - a[0]), (-dy, a[1] - low), (dy, high - a[1])):
+            if p == 0:
+                if q < 0:
+                    visible = False
+                    break
+                continue
+            r = q / p
+            if p < 0:
+                t0 = max(t0, r)
+            else:
+                t1 = min(t1, r)
+            if t0 > t1:
+                visible = False
+                break
+        if not visible:
+            if current:
+                parts.append(current)
+                current = []
+            continue
+        start = (a[0] + t0 * dx, a[1] + t0 * dy)
+        end = (a[0] + t1 * dx, a[1] + t1 * dy)
+        if not current:
+            current = [start]
+        current.append(end)
+        if t1 < 1.0:
+            parts.append(current)
+            current = []
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _simplify_line(points, pinned=()):
+    """Douglas-Peucker to one pixel, keeping the ends and pinned indices"""
+    if len(points) < 3:
+        return points
+    xs, ys = np.array(points).T
+    return [points[i] for i in douglas_peucker(xs, ys, PIXEL, pinned)]
+
+
+def _simplify_ring(ring):
+    """_simplify_line for a closed ring; the corner farthest from the start is pinned so it cannot collapse"""
+    if len(ring) < 5:
+        return ring
+    xs, ys = np.array(ring).T
+    far = int(np.argmax(np.hypot(xs - xs[0], ys - ys[0])))
+    return [ring[i] for i in douglas_peucker(xs, ys, PIXEL, [far])]
+
+
+def _quantize(points):
+    """Round to the tile grid and drop points that land on the previous one"""
+    result = []
+    for px, py in points:
+        point = (int(round(px)), int(round(py)))
+        if not result or result[-1] != point:
+            result.append(point)
+    return result
+
+
+# --- MVT encoding (protobuf, written by hand to avoid a dependency) ---
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _field(number, wire_type):
+    return _varint((number << 3) | wire_type)
+
+
+def _bytes_field(number, payload):
+    return _field(number, 2) + _varint(len(payload)) + payload
+
+
+def _varint_field(number, value):
+    return _field(number, 0) + _varint(value)
+
+
+def _packed(number, values):
+    return _bytes_field(number, b"".join(_varint(v) for v in values))
+
+
+def _command(command_id, count):
+    return (command_id & 0x7) | (count << 3)
+
+
+def _geometry(parts, close):
+    """Command stream for a list of point lists (rings when close=True)"""
+    commands = []
+    cx = cy = 0
+    for part in parts:
+        x, y = part[0]
+        commands += [_command(1, 1), _zigzag(x - cx), _zigzag(y - cy)]
+        cx, cy = x, y
+        rest = part[1:]
+        if rest:
+            commands.append(_command(2, len(rest)))
+            for x, y in rest:
+                commands += [_zigzag(x - cx), _zigzag(y - cy)]
+                cx, cy = x, y
+        if close:
+            commands.append(_command(7, 1))
+    return commands
+
+
+def _points_geometry(points):
+    commands = [_command(1, len(points))]
+    cx = cy = 0
+    for x, y in points:
+        commands += [_zigzag(x - cx), _zigzag(y - cy)]
+        cx, cy = x, y
+    return commands
+
+
+def _value(value):
+    if isinstance(value, bool):
+        return _varint_field(7, int(value))
+    if isinstance(value, int):
+        return _varint_field(6, _zigzag(value))
+    if isinstance(value, float):
+        return _field(3, 1) + struct.pack("<d", value)
+    return _bytes_field(1, str(value).encode())
+
+
+class _Layer:
+    def __init__(self, name):
+        self.name = name
+        self.keys = {}
+        self.values = {}
+        self.features = []
+
+    def _index(self, table, item):
+        index = table.get(item)
+        if index is None:
+            index = table[item] = len(table)
+        return index
+
+    def add(self, geometry_type, commands, properties):
+        tags = []
+        for key, value in properties.items():
+            tags.append(self._index(self.keys, key))
+            tags.append(self._index(self.values, (type(value).__name__, value)))
+        feature = _packed(2, tags) + _varint_field(3, geometry_type) + _packed(4, commands)
+        self.features.append(feature)
+
+    def encode(self):
+        body = _varint_field(15, 2) + _bytes_field(1, self.name.encode())
+        body += b"".join(_bytes_field(2, feature) for feature in self.features)
+        body += b"".join(_bytes_field(3, key.encode()) for key in self.keys)
+        body += b"".join(_bytes_field(4, _value(value)) for _, value in self.values)
+        body += _varint_field(5, EXTENT)
+        return _bytes_field(3, body)
+
+
+def _properties(item):
+    """Scalar top-level fields of an item, which is what a tile can carry"""
+    return {
+        key: value for key, value in item.items()
+        if isinstance(value, (str, int, float, bool))
+    }
+
+
+def _signed_area(ring):
+    return sum(a[0] * b[1] - b[0] * a[1] for a, b in zip(ring, ring[1:] + ring[:1])) / 2
+
+
+def build_tile(index, z, x, y):
+    """
+    Encode the floor geometry inside tile (z, x, y) from its SpatialIndex,
+    simplified to one pixel at the tile's zoom and clipped to the tile
+    """
+    project = _projector(z, x, y)
+    bbox = tile_bbox(z, x, y, BUFFER)
+    low, high = -BUFFER, EXTENT + BUFFER
+    tile = b""
+
+    for name in LAYERS:
+        layer = _Layer(name)
+        for item in index.query_bbox(name, bbox):
+            properties = _properties(item)
+            if name == "objects":
+                lat, lng = item["latlng"][0], item["latlng"][1]
+                point = _quantize([project(float(lng), float(lat))])[0]
+                if low <= point[0] <= high and low <= point[1] <= high:
+                    layer.add(GEOMETRY_POINT, _points_geometry([point]), properties)
+            elif name == "routes":
+                path = [
+                    p for p in item.get("path", []) or []
+                    if isinstance(p, dict) and p.get("x") is not None and p.get("y") is not None
+                ]
+                # Merged points are junctions with other routes; keep them
+                # so corridors still meet at low zoom
+                pinned = [i for i, p in enumerate(path) if p.get("merged") or (p.get("count") or 1) > 1]
+                points = _simplify_line([project(float(p["x"]), float(p["y"])) for p in path], pinned)
+                parts = [_quantize(part) for part in _clip_line(points, low, high)]
+                parts = [part for part in parts if len(part) >= 2]
+                if parts:
+                    layer.add(GEOMETRY_LINESTRING, _geometry(parts, close=False), properties)
+            else:
+                ring = _simplify_ring([project(float(c[0]), float(c[1])) for c in polygon_ring(item)])
+                if len(ring) > 1 and ring[0] == ring[-1]:
+                    ring = ring[:-1]
+                ring = _quantize(_clip_polygon(ring, low, high))
+                if len(ring) > 1 and ring[0] == ring[-1]:
+                    ring = ring[:-1]
+                if len(ring) < 3 or _signed_area(ring) == 0:
+                    continue
+                # Exterior rings wind clockwise on screen (positive area with y down)
+                if _signed_area(ring) < 0:
+                    ring.reverse()
+                layer.add(GEOMETRY_POLYGON, _geometry([ring], close=True), properties)
+        if layer.features:
+            tile += layer.encode()
+    return tile
+
+
+# --- Caching ---
+
+def _intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def database_namespace(url=SQLALCHEMY_DATABASE_URL):
+    """Directory name for one database's tiles, so databases sharing TILE_CACHE_DIR never share floor ids"""
+    rendered = make_url(url).render_as_string(hide_password=True)
+    return blake2b(rendered.encode(), digest_size=8).hexdigest()
+
+
+class TileCache:
+    """
+    Encoded tiles in an LRU in memory and on disk under TILE_CACHE_DIR, in
+    a directory per database, each stamped with the floor version it was
+    built at. A deleted floor's tiles are removed, as its id may be reused.
+
+    A tile built at an older version is still served if every write since
+    then is in this worker's write log and none of their bounding boxes
+    touch the tile; otherwise it is rebuilt. Writes with an unknown extent,
+    or made by another worker, therefore only cost a rebuild.
+    """
+
+    def __init__(self, directory=os.path.join(TILE_CACHE_DIR, database_namespace()), max_tiles=TILE_MEMORY_TILES):
+        self.directory = directory
+        self.max_tiles = max_tiles
+        self._tiles = OrderedDict()
+        self._writes = {}
+        self._lock = threading.Lock()
+
+    def touch(self, floor_id, version, bboxes=None):
+        """Record that a write produced `version`; bboxes None means it may touch anything"""
+        with self._lock:
+            log = self._writes.setdefault(floor_id, deque(maxlen=TILE_WRITE_LOG))
+            log.append((version, None if bboxes is None else list(bboxes)))
+
+    def forget(self, floor_id):
+        with self._lock:
+            self._writes.pop(floor_id, None)
+            for key in [key for key in self._tiles if key[0] == floor_id]:
+                del self._tiles[key]
+        shutil.rmtree(self._floor_directory(floor_id), ignore_errors=True)
+
+    def _untouched(self, floor_id, since, version, bbox):
+        writes = {v: bboxes for v, bboxes in self._writes.get(floor_id, ())}
+        for v in range(since + 1, version + 1):
+            bboxes = writes.get(v, False)
+            if bboxes is False or bboxes is None:
+                return False
+            if any(_intersects(b, bbox) for b in bboxes):
+                return False
+        return True
+
+    def _floor_directory(self, floor_id):
+        return os.path.join(self.directory, str(floor_id))
+
+    def _path(self, floor_id, z, x, y):
+        return os.path.join(self._floor_directory(floor_id), str(z), str(x), f"{y}.mvt")
+
+    def get(self, floor_id, version, z, x, y):
+        key = (floor_id, z, x, y)
+        bbox = tile_bbox(z, x, y, BUFFER)
+        with self._lock:
+            entry = self._tiles.get(key)
+            if entry is not None:
+                built_at, body = entry
+                if built_at == version or (
+                    built_at < version and self._untouched(floor_id, built_at, version, bbox)
+                ):
+                    self._tiles[key] = (version, body)
+                    self._tiles.move_to_end(key)
+                    return body
+
+        # Disk: 8-byte version header then the tile
+        try:
+            with open(self._path(floor_id, z, x, y), "rb") as f:
+                built_at = struct.unpack("<q", f.read(8))[0]
+                body = f.read()
+        except (OSError, struct.error):
+            return None
+        with self._lock:
+            if built_at == version or (
+                built_at < version and self._untouched(floor_id, built_at, version, bbox)
+            ):
+                self._remember(key, version, body)
+                return body
+        return None
+
+    def _remember(self, key, version, body):
+        self._tiles[key] = (version, body)
+        self._tiles.move_to_end(key)
+        while len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+
+    def put(self, floor_id, version, z, x, y, body):
+        with self._lock:
+            self._remember((floor_id, z, x, y), version, body)
+        path = self._path(floor_id, z, x, y)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename so other workers never read a partial tile
+            temporary = f"{path}.{os.getpid()}.{threading.get_ident()}"
+            with open(temporary, "wb") as f:
+                f.write(struct.pack("<q", version) + body)
+            os.replace(temporary, path)
+        except OSError:
+            pass
+
+
+tile_cache = TileCache()
+
+
+def item_bboxes(collection, items):
+    """Bounding boxes of written items, for TileCache.touch"""
+    return [bbox for bbox in (item_bbox(collection, item) for item in items) if bbox is not None]
@@ -0,0 +1,337 @@
+from math import floor
+import os
+import threading
+import time
+import numpy as np
+from .cache import FloorCache
+from .routing import graph_cache, METERS_PER_DEGREE
+from .spatial import check_point
+
+# Filter and step settings of utils/KalmanFilter.js and DR_CONFIG in the builder
+KALMAN_Q = 0.1
+KALMAN_R = 1.0
+STEP_LENGTH = 0.7
+STEP_THRESHOLD = 1.0
+STEP_INTERVAL_MS = 250
+
+# Dead-reckoned positions further than this from every route are left as is
+SNAP_MAX_METERS = float(os.getenv("TRACKING_SNAP_METERS", 10))
+# Devices not heard from for this long give their slot back
+DEVICE_IDLE_SECONDS = int(os.getenv("TRACKING_IDLE_SECONDS", 300))
+
+# Grid cell edge in degrees for the segment hash; larger than the snap radius
+SNAP_CELL = 0.0005
+
+SAMPLE_FIELDS = ("t", "ax", "ay", "az", "heading")
+
+
+class SegmentIndex:
+    """
+    Edges of a floor's navigation graph as struct-of-arrays segments, hashed
+    into grid cells so a batch of positions is snapped with one vectorized
+    projection over the candidate (position, segment) pairs.
+    """
+
+    __slots__ = ("floor_id", "version", "ax", "ay", "bx", "by", "cells")
+
+    def __init__(self, floor_id, version, map_data):
+        self.floor_id = floor_id
+        self.version = version
+        graph = graph_cache.get(floor_id, version, lambda: map_data)
+
+        offsets = np.array(graph.offsets, dtype=np.int_)
+        targets = np.array(graph.targets, dtype=np.int_)
+        sources = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        # Every edge is stored in both directions; keep one of each pair
+        forward = sources < targets
+        xs = np.array(graph.xs, dtype=np.float64)
+        ys = np.array(graph.ys, dtype=np.float64)
+        u, v = sources[forward], targets[forward]
+        self.ax, self.ay, self.bx, self.by = xs[u], ys[u], xs[v], ys[v]
+
+        cells = {}
+        for i in range(len(u)):
+            x0, x1 = sorted((self.ax[i], self.bx[i]))
+            y0, y1 = sorted((self.ay[i], self.by[i]))
+            for cx in range(floor(x0 / SNAP_CELL), floor(x1 / SNAP_CELL) + 1):
+                for cy in range(floor(y0 / SNAP_CELL), floor(y1 / SNAP_CELL) + 1):
+                    cells.setdefault((cx, cy), []).append(i)
+        self.cells = {cell: np.array(segments, dtype=np.int_) for cell, segments in cells.items()}
+
+    def snap(self, xs, ys):
+        """
+        Closest point on any segment to each (x, y).
+        Returns (sx, sy, distance in metres); distance is inf where no
+        segment is in the neighbouring cells.
+        """
+        points, segments = [], []
+        for i, (x, y) in enumerate(zip(xs.tolist(), ys.tolist())):
+            cx, cy = floor(x / SNAP_CELL), floor(y / SNAP_CELL)
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    candidates = self.cells.get((cx + dx, cy + dy))
+                    if candidates is not None:
+                        segments.append(candidates)
+                        points.append(np.full(len(candidates), i))
+
+        sx, sy = xs.copy(), ys.copy()
+        distance = np.full(len(xs), np.inf)
+        if not segments:
+            return sx, sy, distance
+
+        p = np.concatenate(points)
+        s = np.concatenate(segments)
+        px, py = xs[p], ys[p]
+        ax, ay = self.ax[s], self.ay[s]
+        dx, dy = self.bx[s] - ax, self.by[s] - ay
+        length2 = dx * dx + dy * dy
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.where(length2 > 0, ((px - ax) * dx + (py - ay) * dy) / length2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        qx, qy = ax + t * dx, ay + t * dy
+        d = np.hypot(px - qx, py - qy) * METERS_PER_DEGREE
+
+        # Nearest candidate per point: sort by point, then distance
+        order = np.lexsort((d, p))
+        _, first = np.unique(p[order], return_index=True)
+        best = order[first]
+        points_with_candidates = p[best]
+        sx[points_with_candidates] = qx[best]
+        sy[points_with_candidates] = qy[best]
+        distance[points_with_candidates] = d[best]
+        return sx, sy, distance
+
+
+segment_cache = FloorCache(SegmentIndex, "segments")
+
+
+class DeviceTable:
+    """
+    Per-device tracking state as preallocated parallel arrays, one slot per
+    device. The table doubles when full and freed slots are reused, so
+    updates for a whole batch of devices are single array operations.
+    """
+
+    FIELDS = {
+        "lat": np.float64,
+        "lng": np.float64,
+        "floor_id": np.int64,
+        # Kalman state (estimate, error) of acceleration magnitude and heading
+        "accel": np.float64,
+        "accel_p": np.float64,
+        "heading": np.float64,
+        "heading_p": np.float64,
+        "last_step": np.int64,
+        "last_seen": np.float64,
+    }
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        for name, dtype in self.FIELDS.items():
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+        self.device_ids = [None] * capacity
+        self.slots = {}
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _grow(self):
+        old = self.capacity
+        self.capacity *= 2
+        for name in self.FIELDS:
+            column = getattr(self, name)
+            grown = np.zeros(self.capacity, dtype=column.dtype)
+            grown[:old] = column
+            setattr(self, name, grown)
+        self.device_ids.extend([None] * old)
+        self._free.extend(range(self.capacity - 1, old - 1, -1))
+
+    def allocate(self, device_id):
+        if not self._free:
+            self._grow()
+        slot = self._free.pop()
+        self.slots[device_id] = slot
+        self.device_ids[slot] = device_id
+        self.accel[slot] = 0.0
+        self.accel_p[slot] = 1.0
+        self.heading_p[slot] = 1.0
+        self.last_step[slot] = 0
+        return slot
+
+    def release(self, device_id):
+        slot = self.slots.pop(device_id, None)
+        if slot is not None:
+            self.device_ids[slot] = None
+            self._free.append(slot)
+
+    def evict_idle(self, now):
+        for device_id, slot in list(self.slots.items()):
+            if now - self.last_seen[slot] > DEVICE_IDLE_SECONDS:
+                self.release(device_id)
+
+    def position(self, device_id):
+        slot = self.slots.get(device_id)
+        if slot is None:
+            return None
+        return {
+            "device_id": device_id,
+            "floor_id": int(self.floor_id[slot]),
+            "lat": float(self.lat[slot]),
+            "lng": float(self.lng[slot]),
+            "heading": float(self.heading[slot]),
+        }
+
+
+def _kalman(estimate, error, measurement):
+    """Vectorized scalar Kalman step; returns the new (estimate, error)"""
+    error = error + KALMAN_Q
+    gain = error / (error + KALMAN_R)
+    return estimate + gain * (measurement - estimate), (1 - gain) * error
+
+
+def parse_batch(batch):
+    """
+    Validate one device's batch: {"device_id", "floor_id", "t": [ms, ...],
+    "ax", "ay", "az", "heading": [...], optional "lat"/"lng" fix}.
+    Raises ValueError.
+    """
+    if not isinstance(batch, dict):
+        raise ValueError("Each batch must be an object")
+    device_id = batch.get("device_id")
+    if not isinstance(device_id, str) or not device_id:
+        raise ValueError("device_id is required")
+    floor_id = batch.get("floor_id")
+    if not isinstance(floor_id, int) or isinstance(floor_id, bool):
+        raise ValueError(f"{device_id}: floor_id must be an integer")
+
+    try:
+        columns = [np.asarray(batch.get(name, []), dtype=np.float64) for name in SAMPLE_FIELDS]
+    except (TypeError, ValueError):
+        raise ValueError(f"{device_id}: samples must be numbers")
+    if any(column.ndim != 1 or len(column) != len(columns[0]) for column in columns):
+        raise ValueError(f"{device_id}: {', '.join(SAMPLE_FIELDS)} must be lists of equal length")
+    # JSON bodies may carry NaN and Infinity, which would poison the filter state
+    if not all(np.isfinite(column).all() for column in columns):
+        raise ValueError(f"{device_id}: samples must be finite numbers")
+
+    fix = None
+    if batch.get("lat") is not None or batch.get("lng") is not None:
+        try:
+            fix = (float(batch["lat"]), float(batch["lng"]))
+            check_point(*fix)
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"{device_id}: lat and lng must both be finite numbers")
+    return device_id, floor_id, fix, columns
+
+
+class Tracker:
+    """
+    Dead reckoning for all active devices. Each ingest() call is one tick:
+    the k-th sample of every device in the batch is filtered and stepped
+    together, then the resulting positions are snapped to route segments.
+    """
+
+    def __init__(self, capacity=1024):
+        self.devices = DeviceTable(capacity)
+        self.lock = threading.Lock()
+        self._last_eviction = time.monotonic()
+
+    def ingest(self, batches, indexes):
+        """
+        Apply parsed batches (see parse_batch) and return map-matched
+        positions. indexes maps floor_id to its SegmentIndex.
+        """
+        with self.lock:
+            return self._ingest(batches, indexes)
+
+    def _ingest(self, batches, indexes):
+        devices = self.devices
+        now = time.monotonic()
+        if now - self._last_eviction > DEVICE_IDLE_SECONDS:
+            devices.evict_idle(now)
+            self._last_eviction = now
+
+        if len({device_id for device_id, _, _, _ in batches}) != len(batches):
+            raise ValueError("A device may appear only once per batch")
+        for device_id, _, fix, _ in batches:
+            if fix is None and device_id not in devices.slots:
+                raise ValueError(f"{device_id}: the first batch of a device needs a lat/lng fix")
+
+        slots = np.empty(len(batches), dtype=np.int_)
+        for i, (device_id, floor_id, fix, columns) in enumerate(batches):
+            slot = devices.slots.get(device_id)
+            if slot is None:
+                slot = devices.allocate(device_id)
+                if len(columns[4]):
+                    devices.heading[slot] = columns[4][0]
+            if fix is not None:
+                devices.lat[slot], devices.lng[slot] = fix
+            devices.floor_id[slot] = floor_id
+            devices.last_seen[slot] = now
+            slots[i] = slot
+
+        # Samples as (device, k) matrices padded to the longest batch
+        lengths = np.array([len(columns[0]) for _, _, _, columns in batches], dtype=np.int_)
+        width = int(lengths.max()) if len(lengths) else 0
+        valid = np.arange(width) < lengths[:, None]
+        t, ax, ay, az, heading = (np.zeros((len(batches), width)) for _ in SAMPLE_FIELDS)
+        for i, (_, _, _, columns) in enumerate(batches):
+            n = lengths[i]
+            for matrix, column in zip((t, ax, ay, az, heading), columns):
+                matrix[i, :n] = column
+        magnitude = np.sqrt(ax * ax + ay * ay + az * az)
+        steps = np.zeros(len(batches), dtype=np.int_)
+
+        for k in range(width):
+            rows = np.flatnonzero(valid[:, k])
+            s = slots[rows]
+
+            devices.accel[s], devices.accel_p[s] = _kalman(devices.accel[s], devices.accel_p[s], magnitude[rows, k])
+            # Filter the heading innovation on the circle so 359 -> 1 is a 2 degree turn
+            innovation = (heading[rows, k] - devices.heading[s] + 180.0) % 360.0 - 180.0
+            filtered, devices.heading_p[s] = _kalman(0.0, devices.heading_p[s], innovation)
+            devices.heading[s] = (devices.heading[s] + filtered) % 360.0
+
+            sample_t = t[rows, k].astype(np.int64)
+            stepped = (devices.accel[s] > STEP_THRESHOLD) & (sample_t - devices.last_step[s] > STEP_INTERVAL_MS)
+            if stepped.any():
+                ss = s[stepped]
+                radians = np.radians(devices.heading[ss])
+                lat = devices.lat[ss]
+                devices.lat[ss] = lat + STEP_LENGTH * np.cos(radians) / METERS_PER_DEGREE
+                devices.lng[ss] += STEP_LENGTH * np.sin(radians) / (METERS_PER_DEGREE * np.cos(np.radians(lat)))
+                devices.last_step[ss] = sample_t[stepped]
+                steps[rows[stepped]] += 1
+
+        # Map matching: pull each position onto the nearest route segment,
+        # which also corrects the drift of the dead-reckoned state
+        snapped = np.zeros(len(batches), dtype=bool)
+        floor_ids = devices.floor_id[slots]
+        for floor_id in np.unique(floor_ids).tolist():
+            index = indexes.get(floor_id)
+            if index is None:
+                continue
+            rows = np.flatnonzero(floor_ids == floor_id)
+            s = slots[rows]
+            sx, sy, distance = index.snap(devices.lng[s], devices.lat[s])
+            close = distance <= SNAP_MAX_METERS
+            devices.lng[s[close]] = sx[close]
+            devices.lat[s[close]] = sy[close]
+            snapped[rows[close]] = True
+
+        return [
+            {
+                "device_id": device_id,
+                "floor_id": floor_id,
+                "lat": float(devices.lat[slots[i]]),
+                "lng": float(devices.lng[slots[i]]),
+                "heading": float(devices.heading[slots[i]]),
+                "steps": int(steps[i]),
+                "snapped": bool(snapped[i]),
+            }
+            for i, (device_id, floor_id, _, _) in enumerate(batches)
+        ]
+
+
+tracker = Tracker()
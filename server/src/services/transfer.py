@@ -0,0 +1,458 @@
+from datetime import datetime
+import json
+from math import isfinite
+import os
+import re
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import Session
+from ..database import AsyncSessionLocal
+from ..models.base import Floor, FEATURE_MODELS
+from .features import bundle_query, load_map_data
+from .maps import store_map_data
+from .response_cache import dumps
+from .simplify import compute_lod
+
+# Stations travel as GeoJSON: every item becomes a Feature whose
+# properties are the item's own fields plus "floor" (the floor's level)
+# and "layer" (objects, routes, boundaries or innerBoundaries); the
+# item's id is the Feature id. Objects are Points, routes LineStrings and
+# boundaries their own Polygons. Per-point route fields such as merge
+# counts go in a "pathProperties" list parallel to the coordinates.
+#
+# Floor names travel in a "floors" member of the FeatureCollection,
+# written before "features", or as {"type": "Floor", "level", "name"}
+# lines before the floor's features in the line-delimited format.
+
+# Rows written per bulk insert while importing
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", 2000))
+# Largest single feature (or line) accepted, so malformed input cannot
+# make the reader buffer the whole upload
+IMPORT_MAX_FEATURE_BYTES = int(os.getenv("IMPORT_MAX_FEATURE_BYTES", 16 * 1024 * 1024))
+# Export output is written in chunks of about this many bytes
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+GEOMETRY_LAYERS = {"Point": "objects", "LineString": "routes", "Polygon": "boundaries"}
+LAYER_GEOMETRIES = {"objects": "Point", "routes": "LineString", "boundaries": "Polygon", "innerBoundaries": "Polygon"}
+RESERVED = ("floor", "layer")
+
+
+class StationImportError(ValueError):
+    """The upload is not a valid station; nothing of it is saved"""
+
+
+def to_feature(collection, item, level):
+    """A floor item as a GeoJSON Feature"""
+    properties = {key: value for key, value in item.items() if key != "id"}
+    geometry = None
+    if collection == "objects":
+        latlng = properties.get("latlng")
+        if isinstance(latlng, (list, tuple)) and len(latlng) == 2:
+            del properties["latlng"]
+            geometry = {"type": "Point", "coordinates": [latlng[1], latlng[0]]}
+    elif collection == "routes":
+        path = properties.get("path")
+        if isinstance(path, list) and all(isinstance(p, dict) and "x" in p and "y" in p for p in path):
+            del properties["path"]
+            geometry = {"type": "LineString", "coordinates": [[p["x"], p["y"]] for p in path]}
+            extras = [{k: v for k, v in p.items() if k not in ("x", "y")} for p in path]
+            if any(extras):
+                properties["pathProperties"] = extras
+    else:
+        geometry = properties.pop("geometry", None)
+
+    feature = {"type": "Feature"}
+    if "id" in item:
+        feature["id"] = item["id"]
+    feature["geometry"] = geometry
+    feature["properties"] = {"floor": level, "layer": collection, **properties}
+    return feature
+
+
+def _position(value):
+    return (
+        isinstance(value, list) and len(value) >= 2
+        and all(isinstance(c, (int, float)) and not isinstance(c, bool) and isfinite(c) for c in value[:2])
+    )
+
+
+def from_feature(feature):
+    """(level, collection, item) of a GeoJSON Feature, validated"""
+    if not isinstance(feature, dict) or feature.get("type") != "Feature":
+        raise StationImportError("not a GeoJSON Feature")
+    properties = feature.get("properties")
+    if properties is None:
+        properties = {}
+    if not isinstance(properties, dict):
+        raise StationImportError("properties must be an object")
+    geometry = feature.get("geometry")
+    if geometry is not None and not isinstance(geometry, dict):
+        raise StationImportError("geometry must be an object or null")
+
+    level = properties.get("floor")
+    if not isinstance(level, int) or isinstance(level, bool):
+        raise StationImportError("properties.floor must be the floor's level, an integer")
+    geometry_type = geometry.get("type") if geometry else None
+    collection = properties.get("layer") or GEOMETRY_LAYERS.get(geometry_type)
+    if collection not in FEATURE_MODELS:
+        raise StationImportError(f"properties.layer must be one of {', '.join(FEATURE_MODELS)}")
+    if geometry is not None and geometry_type != LAYER_GEOMETRIES[collection]:
+        raise StationImportError(f"{collection} need {LAYER_GEOMETRIES[collection]} geometry, got {geometry_type}")
+
+    item = {"id": feature["id"]} if "id" in feature else {}
+    item.update((key, value) for key, value in properties.items() if key not in RESERVED)
+    if geometry is None:
+        return level, collection, item
+
+    coordinates = geometry.get("coordinates")
+    if collection == "objects":
+        if not _position(coordinates):
+            raise StationImportError("Point coordinates must be [lng, lat]")
+        item["latlng"] = [coordinates[1], coordinates[0]]
+    elif collection == "routes":
+        if not isinstance(coordinates, list) or not all(_position(c) for c in coordinates):
+            raise StationImportError("LineString coordinates must be a list of [lng, lat]")
+        extras = item.pop("pathProperties", None) or [{}] * len(coordinates)
+        if not isinstance(extras, list) or len(extras) != len(coordinates) or not all(isinstance(e, dict) for e in extras):
+            raise StationImportError("pathProperties must have one object per coordinate")
+        item["path"] = [{"x": c[0], "y": c[1], **extra} for c, extra in zip(coordinates, extras)]
+    else:
+        if not isinstance(coordinates, list) or not coordinates or not all(
+            isinstance(ring, list) and len(ring) >= 4 and all(_position(c) for c in ring) for ring in coordinates
+        ):
+            raise StationImportError("Polygon coordinates must be rings of at least 4 [lng, lat] positions")
+        item["geometry"] = geometry
+    return level, collection, item
+
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"[ \t\n\r]*")
+
+
+def _decode(buffer, pos, final):
+    """(value, end) of the JSON value at pos, or None if more input is needed"""
+    try:
+        value, end = _decoder.raw_decode(buffer, pos)
+    except json.JSONDecodeError as e:
+        if final:
+            raise StationImportError(f"Invalid JSON: {e.msg}")
+        if len(buffer) - pos > IMPORT_MAX_FEATURE_BYTES:
+            raise StationImportError("Feature too large, or invalid JSON")
+        return None
+    # A number at the end of the buffer may continue in the next chunk
+    if end == len(buffer) and not final:
+        return None
+    return value, end
+
+
+class FeatureCollectionReader:
+    """
+    Incremental reader of a GeoJSON FeatureCollection. feed() takes text
+    as it arrives and returns ("floors", value) for a floors member and
+    ("feature", value) for each complete feature; only the feature being
+    read is buffered.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._state = "start"
+        self._key = None
+        self._type = None
+        self.features = 0
+
+    def feed(self, text, final=False):
+        buffer = self._buffer + text
+        events = []
+        pos = 0
+        while True:
+            pos = _whitespace.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            char, state = buffer[pos], self._state
+
+            if state == "start":
+                if char != "{":
+                    raise StationImportError("Expected a GeoJSON FeatureCollection object")
+                pos, self._state = pos + 1, "key"
+            elif state in ("key", "next") and char == "}":
+                pos, self._state = pos + 1, "end"
+            elif state == "next":
+                if char != ",":
+                    raise StationImportError("Expected , or } between FeatureCollection members")
+                pos, self._state = pos + 1, "key"
+            elif state == "key":
+                decoded = _decode(buffer, pos, final)
+                if decoded is None:
+                    break
+                self._key, pos = decoded
+                if not isinstance(self._key, str):
+                    raise StationImportError("Expected a member name")
+                self._state = "colon"
+            elif state == "colon":
+                if char != ":":
+                    raise StationImportError("Expected : after a member name")
+                pos, self._state = pos + 1, "value"
+            elif state == "value" and self._key == "features":
+                if char != "[":
+                    raise StationImportError("features must be an array")
+                pos, self._state = pos + 1, "first_feature"
+            elif state == "value":
+                decoded = _decode(buffer, pos, final)
+                if decoded is None:
+                    break
+                value, pos = decoded
+                if self._key == "type":
+                    self._type = value
+                elif self._key == "floors":
+                    events.append(("floors", value))
+                self._state = "next"
+            elif state in ("first_feature", "after_feature") and char == "]":
+                pos, self._state = pos + 1, "next"
+            elif state == "after_feature":
+                if char != ",":
+                    raise StationImportError("Expected , or ] between features")
+                pos, self._state = pos + 1, "feature"
+            elif state in ("first_feature", "feature"):
+                decoded = _decode(buffer, pos, final)
+                if decoded is None:
+                    break
+                value, pos = decoded
+                self.features += 1
+                events.append(("feature", value))
+                self._state = "after_feature"
+            else:
+                raise StationImportError("Unexpected data after the FeatureCollection")
+
+        self._buffer = buffer[pos:]
+        if final:
+            if self._state != "end":
+                raise StationImportError("The FeatureCollection is incomplete")
+            if self._type not in (None, "FeatureCollection"):
+                raise StationImportError(f"Expected a FeatureCollection, got {self._type}")
+        return events
+
+
+class LineReader:
+    """
+    Incremental reader of line-delimited GeoJSON: one Feature per line,
+    with {"type": "Floor", "level", "name"} lines naming floors. Record
+    separators of GeoJSON text sequences are accepted too.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self.line = 0
+
+    def feed(self, text, final=False):
+        lines = (self._buffer + text).split("\n")
+        self._buffer = "" if final else lines.pop()
+        if len(self._buffer) > IMPORT_MAX_FEATURE_BYTES:
+            raise StationImportError(f"Line {self.line + 1} is too long")
+        events = []
+        for line in lines:
+            self.line += 1
+            line = line.strip().strip("\x1e")
+            if not line:
+                continue
+            try:
+                value = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise StationImportError(f"Line {self.line}: invalid JSON: {e.msg}")
+            if isinstance(value, dict) and value.get("type") == "Floor":
+                events.append(("floors", [value]))
+            else:
+                events.append(("feature", value))
+        return events
+
+
+class StationImporter:
+    """
+    Replaces the station's floors and items with an upload, in one
+    transaction that also saves the upload as the builder's /api/maps
+    document, so MapBuilder and the viewers see it too. Floors are matched
+    to existing ones by level so their ids survive the import; items are
+    validated as they arrive and bulk inserted IMPORT_BATCH rows at a
+    time, so memory does not grow with the size of the station until the
+    document is built at the end.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.names = {}
+        self.counts = {key: 0 for key in FEATURE_MODELS}
+        self.features = 0
+        self.changed = []
+        self.deleted = []
+        self._existing = {}
+        self._floors = {}
+        self._seq = {}
+        self._pending = []
+
+    def begin(self):
+        for floor in self.db.query(Floor).order_by(Floor.id):
+            self._existing.setdefault(floor.level, []).append(floor)
+
+    def add(self, event):
+        """Take one reader event; True when a batch is ready to flush()"""
+        kind, value = event
+        if kind == "floors":
+            if not isinstance(value, list):
+                raise StationImportError("floors must be a list of {level, name}")
+            for floor in value:
+                level = floor.get("level") if isinstance(floor, dict) else None
+                if not isinstance(level, int) or isinstance(level, bool):
+                    raise StationImportError("Every floor needs an integer level")
+                self.names[level] = str(floor.get("name") or f"Floor {level}")
+            return False
+
+        self.features += 1
+        try:
+            self._pending.append(from_feature(value))
+        except StationImportError as e:
+            raise StationImportError(f"Feature {self.features}: {e}")
+        return len(self._pending) >= IMPORT_BATCH
+
+    def _floor_id(self, level):
+        floor = self._floors.get(level)
+        if floor is None:
+            existing = self._existing.get(level)
+            if existing:
+                floor = existing.pop(0)
+                for model in FEATURE_MODELS.values():
+                    self.db.execute(delete(model).where(model.floor_id == floor.id))
+            else:
+                floor = Floor(name=self.names.get(level) or f"Floor {level}", level=level)
+                self.db.add(floor)
+                self.db.flush()
+            self._floors[level] = floor
+        return floor.id
+
+    def flush(self):
+        rows = {key: [] for key in FEATURE_MODELS}
+        for level, collection, item in self._pending:
+            floor_id = self._floor_id(level)
+            seq = self._seq.get((floor_id, collection), 0)
+            self._seq[(floor_id, collection)] = seq + 1
+            rows[collection].append({
+                "floor_id": floor_id,
+                "seq": seq,
+                "uid": item.get("id"),
+                "type": item.get("type"),
+                "data": item,
+                "lod": compute_lod(collection, item),
+            })
+        self._pending = []
+        for collection, batch in rows.items():
+            if batch:
+                self.db.execute(insert(FEATURE_MODELS[collection]), batch)
+                self.counts[collection] += len(batch)
+
+    def finish(self, background_tasks, dry_run=False):
+        """
+        Write what is left, drop floors the upload does not have, and commit
+        the floors together with the builder's /api/maps document rebuilt
+        from them (or roll everything back)
+        """
+        self.flush()
+        # Named floors without items are still part of the station
+        for level in self.names:
+            self._floor_id(level)
+        if not self._floors:
+            raise StationImportError("The upload has no floors")
+
+        now = datetime.utcnow()
+        for level, floor in self._floors.items():
+            floor.name = self.names.get(level, floor.name)
+            # Bumps the version of floors that existed, so caches rebuild
+            floor.updated_at = now
+        for leftovers in self._existing.values():
+            for floor in leftovers:
+                for model in FEATURE_MODELS.values():
+                    self.db.execute(delete(model).where(model.floor_id == floor.id))
+                self.db.delete(floor)
+                self.deleted.append(floor.id)
+        self.db.flush()
+        self.changed = [(floor.id, floor.version) for floor in self._floors.values()]
+
+        summary = {
+            "floors": len(self._floors),
+            "deleted_floors": len(self.deleted),
+            "features": self.counts,
+            "dry_run": dry_run,
+        }
+        if dry_run:
+            self.db.rollback()
+        else:
+            # An import replaces the station wholesale: diffing it against
+            # the previous document would cost more than storing it
+            map_data = store_map_data(self.db, self.document(), background_tasks, snapshot=True)
+            summary["map_version"] = map_data.version
+        return summary
+
+    def document(self):
+        """
+        The imported station as the builder's {floors, floorData} document.
+        Unlike the import itself this holds the whole station in memory, as
+        the document is stored as one value.
+        """
+        floors = sorted(self._floors.items())
+        map_data = load_map_data(self.db, [floor.id for _, floor in floors])
+        document = {"floors": [], "floorData": {}}
+        for level, floor in floors:
+            # The builder's floor ids carry the level, as save_map_data expects
+            builder_id = f"floor_{level}"
+            document["floors"].append({"id": builder_id, "name": floor.name})
+            document["floorData"][builder_id] = map_data[floor.id]
+        document["selectedFloor"] = document["floors"][0]["id"]
+        return document
+
+
+async def stream_station(floors, format):
+    """
+    Yield the given floor rows (ordered by id) and all their items as a
+    GeoJSON FeatureCollection or as lines. Items come from one streamed
+    query, so memory stays flat however large the station is.
+
+    Uses its own session: the request's session is closed before the body
+    is streamed.
+    """
+    lines = format == "ndjson"
+    levels = {floor.id: floor.level for floor in floors}
+    headers = {floor.id: {"type": "Floor", "level": floor.level, "name": floor.name} for floor in floors}
+    fields = list(FEATURE_MODELS)
+    chunk = []
+    size = 0
+
+    if lines:
+        announced = set()
+    else:
+        header = {"type": "FeatureCollection", "floors": [{"level": floor.level, "name": floor.name} for floor in floors]}
+        chunk.append(dumps(header)[:-1] + b',"features":[')
+
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(bundle_query([floor.id for floor in floors], fields))
+        first = True
+        async for floor_id, field, _, data in result:
+            if lines and floor_id not in announced:
+                announced.add(floor_id)
+                chunk.append(dumps(headers[floor_id]) + b"\n")
+            body = dumps(to_feature(fields[field], data, levels[floor_id]))
+            if lines:
+                body += b"\n"
+            elif not first:
+                body = b"," + body
+            first = False
+            chunk.append(body)
+            size += len(body)
+            if size >= EXPORT_CHUNK_BYTES:
+                yield b"".join(chunk)
+                chunk, size = [], 0
+
+    if lines:
+        # Floors without items still need their line
+        for floor in floors:
+            if floor.id not in announced:
+                chunk.append(dumps(headers[floor.id]) + b"\n")
+    else:
+        chunk.append(b"]}")
+    yield b"".join(chunk)
+
@@ -0,0 +1,88 @@
+import logging
+import threading
+import time
+from sqlalchemy.orm import Session
+from ..models.base import Floor
+from .features import floor_query
+from .routing import graph_cache
+from .floor_caches import FLOOR_CACHES
+from .station import station_cache
+from .response_cache import store_json_response
+
+logger = logging.getLogger(__name__)
+
+
+class WarmupState:
+    """Progress of warming this process's caches, for the readiness endpoint"""
+
+    def __init__(self):
+        # cold, warming, warm, failed or off
+        self.status = "cold"
+        self.floors_total = 0
+        self.floors_warm = 0
+        self.seconds = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    def begin(self):
+        """False if warming already started in this process (or the one it was forked from)"""
+        with self._lock:
+            if self.status != "cold":
+                return False
+            self.status = "warming"
+            return True
+
+    def as_dict(self):
+        return {
+            "status": self.status,
+            "floors": {"warm": self.floors_warm, "total": self.floors_total},
+            "seconds": self.seconds,
+            "error": self.error,
+        }
+
+
+warmup_state = WarmupState()
+
+
+def warm_floors(db: Session):
+    """
+    Build every floor's derived structures and encode its full response,
+    as the first requests after a start would. Floors change while this
+    runs are fine: a newer version is simply rebuilt on its next read.
+    """
+    floors = db.query(Floor.id).order_by(Floor.id).all()
+    warmup_state.floors_total = len(floors)
+    graphs = []
+    for (floor_id,) in floors:
+        floor = floor_query(db).filter(Floor.id == floor_id).first()
+        if floor is None:
+            continue
+        map_data = floor.map_data
+        for cache in FLOOR_CACHES:
+            cache.get(floor_id, floor.version, lambda: map_data)
+        store_json_response(("floor", floor_id, "full", None), floor.version, floor.to_dict())
+        graphs.append((floor_id, floor.level, graph_cache.get(floor_id, floor.version, lambda: map_data)))
+        warmup_state.floors_warm += 1
+        # Each floor's items are only needed while it is built
+        db.expunge_all()
+    station_cache.get(graphs)
+
+
+def run_warmup(warm):
+    """Run warm() once per process, recording its progress and outcome"""
+    if not warmup_state.begin():
+        return
+    start = time.perf_counter()
+    try:
+        warm()
+        warmup_state.status = "warm"
+    except Exception as e:
+        # Serving still works, every cache fills on first use instead
+        logger.exception("Warming caches failed")
+        warmup_state.status = "failed"
+        warmup_state.error = str(e)
+    warmup_state.seconds = round(time.perf_counter() - start, 3)
+    logger.info(
+        "Warmed %s of %s floors in %.1f s",
+        warmup_state.floors_warm, warmup_state.floors_total, warmup_state.seconds
+    )
@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+# Importing src connects its engines; point them at a scratch SQLite
+# database so tests need neither Postgres nor a running server
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ.setdefault("WARMUP", "off")
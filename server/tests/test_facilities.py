@@ -0,0 +1,69 @@
+import random
+import pytest
+from src.services.facilities import FacilityTable
+from src.services.routing import build_graph, shortest_path_tree
+
+
+def _obj(object_id, x, type):
+    return {"id": object_id, "type": type, "latlng": [0.0, x]}
+
+
+def _line(*xs):
+    return {"path": [{"x": x, "y": 0.0} for x in xs]}
+
+
+def test_a_facility_is_not_its_own_nearest():
+    floor = {
+        "objects": [_obj("stairs_a", 0.0, "stairs"), _obj("platform", 0.001, "platform"),
+                    _obj("stairs_b", 0.003, "stairs"), _obj("toilet", 0.004, "toilet")],
+        "routes": [_line(0.0, 0.001, 0.003, 0.004)],
+    }
+    # Tables take the floor's graph from graph_cache, so each test uses its own floor id
+    table = FacilityTable(181, 1, floor)
+
+    nearest = table.lookup("stairs_a")
+    assert nearest["stairs"][0] == "stairs_b"
+    assert nearest["stairs"][1] == pytest.approx(333.0)
+    assert nearest["toilet"][0] == "toilet"
+    assert table.lookup("stairs_b", "stairs")["stairs"][0] == "stairs_a"
+    assert table.lookup("platform", "stairs")["stairs"][0] == "stairs_a"
+    # The only toilet has no other toilet to point to
+    assert table.lookup("toilet", "toilet") == {}
+    assert table.lookup("nowhere") is None
+
+
+def test_facilities_sharing_a_spot_point_at_each_other():
+    floor = {"objects": [_obj("lift_1", 0.0, "elevator"), _obj("lift_2", 0.0, "elevator")], "routes": []}
+    table = FacilityTable(182, 1, floor)
+    assert table.lookup("lift_1", "elevator") == {"elevator": ("lift_2", 0.0)}
+    assert table.lookup("lift_2", "elevator") == {"elevator": ("lift_1", 0.0)}
+
+
+def test_lookups_match_a_sweep_from_each_object():
+    rng = random.Random(18)
+    types = ["stairs", "toilet", "exit", "shop"]
+    objects = [_obj(f"o{i}", rng.random() * 0.01, rng.choice(types)) for i in range(40)]
+    for o in objects:
+        o["latlng"][0] = rng.random() * 0.01
+    routes = [
+        {"path": [{"x": o["latlng"][1], "y": o["latlng"][0]} for o in rng.sample(objects, rng.randint(2, 4))]}
+        for _ in range(50)
+    ]
+    graph = build_graph(1, 1, {"objects": objects, "routes": routes})
+    table = FacilityTable(183, 1, {"objects": objects, "routes": routes})
+
+    for o in objects:
+        dist, _ = shortest_path_tree(graph, graph.object_nodes[o["id"]])
+        for facility_type in types:
+            others = [
+                dist[graph.object_nodes[f["id"]]] for f in objects
+                if f["type"] == facility_type and f["id"] != o["id"]
+            ]
+            best = min(others, default=float("inf"))
+            found = table.lookup(o["id"], facility_type)
+            if best == float("inf"):
+                assert found == {}
+            else:
+                facility, distance = found[facility_type]
+                assert facility != o["id"]
+                assert distance == pytest.approx(best)
@@ -0,0 +1,22 @@
+import random
+from src.services.geometry import compact_route, compact_boundary, decode_polyline, encode_polyline
+
+
+def test_polyline_round_trip():
+    rng = random.Random(3)
+    points = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(200)]
+    decoded = decode_polyline(encode_polyline(points))
+    assert len(decoded) == len(points)
+    for (lat, lng), (dlat, dlng) in zip(points, decoded):
+        assert abs(lat - dlat) <= 1e-7 and abs(lng - dlng) <= 1e-7
+
+
+def test_compact_route_and_boundary_decode_to_the_original_points():
+    route = {"id": "r", "path": [{"x": 77.21, "y": 28.64, "merged": True, "count": 3}, {"x": 77.22, "y": 28.65, "merged": False, "count": 1}]}
+    compact = compact_route(route)
+    assert compact["counts"] == [3, 1]
+    assert decode_polyline(compact["path"]) == [(28.64, 77.21), (28.65, 77.22)]
+
+    ring = [[77.1, 28.1], [77.2, 28.1], [77.2, 28.3], [77.1, 28.1]]
+    boundary = compact_boundary({"id": "b", "geometry": {"type": "Polygon", "coordinates": [ring]}})
+    assert [[lng, lat] for lat, lng in decode_polyline(boundary["geometry"]["coordinates"][0])] == ring
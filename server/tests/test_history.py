@@ -0,0 +1,49 @@
+import copy
+import json
+import random
+from src.services.history import apply_ops, diff
+
+SCALARS = [0, 1, 1.0, True, False, None, "1", "", 2.5]
+
+
+def _value(rng, depth=0):
+    kind = rng.random()
+    if depth > 2 or kind < 0.5:
+        return rng.choice(SCALARS)
+    if kind < 0.75:
+        return [_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    return {rng.choice("abcd"): _value(rng, depth + 1) for _ in range(rng.randint(0, 4))}
+
+
+def _mutate(rng, value):
+    if isinstance(value, dict) and value and rng.random() < 0.7:
+        key = rng.choice(list(value))
+        value[key] = _mutate(rng, value[key])
+        return value
+    if isinstance(value, list) and value and rng.random() < 0.7:
+        i = rng.randrange(len(value))
+        if rng.random() < 0.2:
+            value.insert(i, _value(rng))
+        else:
+            value[i] = _mutate(rng, value[i])
+        return value
+    return _value(rng)
+
+
+def _strict(value):
+    # json.dumps keeps 1, 1.0 and true apart
+    return json.dumps(value, sort_keys=True)
+
+
+def test_diff_apply_round_trip_keeps_json_types():
+    rng = random.Random(22)
+    for _ in range(5000):
+        old = _value(rng)
+        new = _mutate(rng, copy.deepcopy(old))
+        assert _strict(apply_ops(copy.deepcopy(old), diff(old, new))) == _strict(new)
+
+
+def test_bool_int_and_float_changes_are_diffed():
+    assert diff({"a": 1}, {"a": True}) == [["set", ["a"], True]]
+    assert diff([1, 2, 3], [1, 2.0, 3]) == [["set", [1], 2.0]]
+    assert diff({"a": [1]}, {"a": [1]}) == []
@@ -0,0 +1,42 @@
+from fastapi.testclient import TestClient
+from src.main import app
+
+
+def _document(name):
+    return {
+        "floors": [{"id": "floor_0", "name": name}],
+        "floorData": {"floor_0": {"objects": [], "routes": [], "boundaries": [], "innerBoundaries": []}},
+        "selectedFloor": "floor_0",
+    }
+
+
+def test_second_of_two_editors_loaded_together_cannot_overwrite():
+    with TestClient(app) as client:
+        client.post("/api/maps", json=_document("Start"))
+
+        # Both editors open the map at the same time
+        loaded = client.get("/api/maps")
+        version = int(loaded.headers["X-Map-Version"])
+        assert loaded.json()["floors"][0]["name"] == "Start"
+
+        first = client.post(f"/api/maps?base_version={version}", json=_document("First"))
+        assert first.status_code == 200
+        assert first.json()["version"] == version + 1
+
+        second = client.post(f"/api/maps?base_version={version}", json=_document("Second"))
+        assert second.status_code == 409
+        assert client.get("/api/maps").json()["floors"][0]["name"] == "First"
+
+
+def test_version_header_is_sent_with_not_modified_and_compact_responses():
+    with TestClient(app) as client:
+        version = client.post("/api/maps", json=_document("Cached")).json()["version"]
+        full = client.get("/api/maps")
+        assert full.headers["X-Map-Version"] == str(version)
+
+        revalidated = client.get("/api/maps", headers={"If-None-Match": full.headers["ETag"]})
+        assert revalidated.status_code == 304
+        assert revalidated.headers["X-Map-Version"] == str(version)
+
+        assert client.get("/api/maps?format=compact").headers["X-Map-Version"] == str(version)
+        assert client.get(f"/api/maps?version={version}").headers["X-Map-Version"] == str(version)
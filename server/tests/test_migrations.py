@@ -0,0 +1,61 @@
+import json
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from src.migrations import upgrade
+from src.models.base import Floor, Marker, Path
+
+BLOB = {
+    "objects": [{"id": "gate", "type": "exit", "latlng": [28.64, 77.21]}, {"id": "shop", "type": "shop", "latlng": [28.65, 77.22]}],
+    "routes": [{"id": "r1", "path": [{"x": 77.21, "y": 28.64}, {"x": 77.22, "y": 28.65}]}],
+    "boundaries": [],
+}
+
+
+def _legacy_database(tmp_path):
+    """A database as created before the feature tables and version columns"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE floors (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, level INTEGER NOT NULL, "
+            "map_data JSON NOT NULL, created_at DATETIME, updated_at DATETIME)"
+        ))
+        conn.execute(
+            text("INSERT INTO floors (id, name, level, map_data) VALUES (1, 'Concourse', 0, :blob)"),
+            {"blob": json.dumps(BLOB)}
+        )
+    return engine
+
+
+def test_blobs_move_into_feature_tables(tmp_path):
+    engine = _legacy_database(tmp_path)
+    upgrade(engine)
+
+    with Session(engine) as db:
+        floor = db.get(Floor, 1)
+        # Moving the items is a change of the floor
+        assert floor.version == 2
+        assert floor.legacy_map_data == {}
+        assert floor.map_data == {**BLOB, "innerBoundaries": []}
+        assert [(m.seq, m.uid, m.type) for m in db.query(Marker).order_by(Marker.seq)] == [(0, "gate", "exit"), (1, "shop", "shop")]
+        assert db.query(Path).one().lod is not None
+
+
+def test_upgrade_is_safe_to_run_again(tmp_path):
+    engine = _legacy_database(tmp_path)
+    upgrade(engine)
+    upgrade(engine)
+
+    with Session(engine) as db:
+        assert db.query(Marker).count() == 2
+        assert db.get(Floor, 1).version == 2
+
+
+def test_single_items_are_rows_of_their_floor(tmp_path):
+    engine = _legacy_database(tmp_path)
+    upgrade(engine)
+
+    with Session(engine) as db:
+        shop = db.query(Marker).filter(Marker.floor_id == 1, Marker.uid == "shop").one()
+        db.delete(shop)
+        db.commit()
+        assert [item["id"] for item in db.get(Floor, 1).map_data["objects"]] == ["gate"]
@@ -0,0 +1,46 @@
+import copy
+import os
+from benchmarks.station import generate_station
+from src.services.offline import BundleStore, apply_delta, compile_bundle, make_delta, read_sections
+
+
+def _object_names(sections):
+    strings = bytes(sections["STRINGS"])
+    floor = sections["FLOORS"][0]
+    base = int(floor["strings"])
+    return [
+        strings[base + int(o["name_off"]):base + int(o["name_off"]) + int(o["name_len"])].decode()
+        for o in sections["OBJECTS"][int(floor["objects"]):int(floor["objects"]) + int(floor["object_count"])]
+    ]
+
+
+def test_compile_delta_apply_read_round_trip():
+    old = generate_station(floors=2, objects=60, route_points=400, boundaries=4)
+    new = copy.deepcopy(old)
+    first_floor = new["floors"][0]["id"]
+    new["floorData"][first_floor]["objects"][0]["name"] = "Renamed Exit"
+
+    base, target = compile_bundle(1, old), compile_bundle(2, new)
+    delta = make_delta(base, 1, target, 2)
+    assert len(delta) < len(target) // 4
+    rebuilt = apply_delta(base, delta)
+    assert rebuilt == target
+
+    sections = read_sections(rebuilt)
+    assert sections["version"] == 2
+    assert len(sections["FLOORS"]) == 2
+    assert _object_names(sections)[0] == "Renamed Exit"
+
+
+def test_prune_keeps_other_maps_files(tmp_path):
+    store = BundleStore(directory=str(tmp_path), keep=2)
+    data = generate_station(floors=1, objects=10, route_points=50, boundaries=1)
+    for version in (1, 5):
+        store.bundle(11, version, data)
+    assert store.delta(11, 1, 5) is not None
+    # Map 1 rolling over must not touch map 11's files, delta-11-1-5.bin included
+    for version in (1, 2, 3):
+        store.bundle(1, version, data)
+    assert set(os.listdir(tmp_path)) == {
+        "station-11-1.bin", "station-11-5.bin", "delta-11-1-5.bin", "station-1-2.bin", "station-1-3.bin"
+    }
@@ -0,0 +1,82 @@
+import pytest
+from fastapi.testclient import TestClient
+from src.main import app
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def _floor(client, level=0):
+    response = client.post("/api/floors/", json={"name": "Concourse", "level": level, "map_data": {
+        "objects": [{"id": "gate", "type": "exit", "name": "Gate 1", "latlng": [28.64, 77.21]}]
+    }})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_patch_touches_one_item_and_bumps_the_version(client):
+    floor = _floor(client)
+    response = client.patch(f"/api/floors/{floor['id']}", json={"version": floor["version"], "ops": [
+        {"op": "replace", "path": "/objects/gate/name", "value": "Gate 2"},
+        {"op": "add", "path": "/objects/-", "value": {"id": "shop", "type": "shop", "latlng": [28.65, 77.22]}},
+    ]})
+    assert response.status_code == 200, response.text
+    assert response.json()["version"] == floor["version"] + 1
+
+    objects = client.get(f"/api/floors/{floor['id']}").json()["map_data"]["objects"]
+    assert [(o["id"], o.get("name")) for o in objects] == [("gate", "Gate 2"), ("shop", None)]
+
+
+def test_stale_version_is_refused_and_changes_nothing(client):
+    floor = _floor(client)
+    rename = {"op": "replace", "path": "/objects/gate/name", "value": "First"}
+    assert client.patch(f"/api/floors/{floor['id']}", json={"version": floor["version"], "ops": [rename]}).status_code == 200
+
+    # A second editor still holding the version both started from
+    stale = {"op": "replace", "path": "/objects/gate/name", "value": "Second"}
+    response = client.patch(f"/api/floors/{floor['id']}", json={"version": floor["version"], "ops": [stale]})
+    assert response.status_code == 409
+    assert client.get(f"/api/floors/{floor['id']}").json()["map_data"]["objects"][0]["name"] == "First"
+
+
+def test_multi_floor_patch_is_all_or_nothing(client):
+    first, second = _floor(client), _floor(client, level=1)
+    response = client.patch("/api/floors/", json={"floors": [
+        {"id": first["id"], "version": first["version"], "ops": [{"op": "replace", "path": "/name", "value": "Renamed"}]},
+        {"id": second["id"], "version": second["version"] - 1, "ops": []},
+    ]})
+    assert response.status_code == 409
+    assert client.get(f"/api/floors/{first['id']}").json()["name"] == "Concourse"
+
+
+@pytest.mark.parametrize("path, value", [
+    ("/level", "abc"),
+    ("/level", True),
+    ("/level", 1.5),
+    ("/level", None),
+    ("/name", ""),
+    ("/name", "   "),
+    ("/name", 3),
+])
+def test_floor_fields_are_validated(client, path, value):
+    floor = _floor(client)
+    response = client.patch(f"/api/floors/{floor['id']}", json={
+        "version": floor["version"], "ops": [{"op": "replace", "path": path, "value": value}]
+    })
+    assert response.status_code == 400
+    after = client.get(f"/api/floors/{floor['id']}").json()
+    assert (after["name"], after["level"], after["version"]) == ("Concourse", 0, floor["version"])
+
+
+def test_floor_fields_can_be_replaced(client):
+    floor = _floor(client)
+    response = client.patch(f"/api/floors/{floor['id']}", json={"version": floor["version"], "ops": [
+        {"op": "replace", "path": "/level", "value": -1},
+        {"op": "replace", "path": "/name", "value": "Basement"},
+    ]})
+    assert response.status_code == 200, response.text
+    after = client.get(f"/api/floors/{floor['id']}").json()
+    assert (after["name"], after["level"]) == ("Basement", -1)
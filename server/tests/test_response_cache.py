@@ -0,0 +1,26 @@
+from src.services.response_cache import response_cache, drop_stale_responses, store_json_response
+
+
+def test_change_events_drop_only_stale_responses():
+    response_cache.invalidate()
+    store_json_response(("floor", 1, "full", None), 3, {"id": 1})
+    store_json_response(("objects", 1, 0, 100), 3, [])
+    store_json_response(("floor", 2, "full", None), 5, {"id": 2})
+    store_json_response(("maps", 1, "full"), 7, {})
+    store_json_response(("maps", 1, "full", 6), 6, {})
+
+    drop_stale_responses({"topic": 1, "floor_id": 1, "version": 4, "ops": None})
+    assert response_cache.get(("floor", 1, "full", None), 3) is None
+    assert response_cache.get(("objects", 1, 0, 100), 3) is None
+    assert response_cache.get(("floor", 2, "full", None), 5) is not None
+
+    # The writer stored the new version before announcing it
+    drop_stale_responses({"topic": "maps", "version": 7, "ops": None})
+    assert response_cache.get(("maps", 1, "full"), 7) is not None
+    drop_stale_responses({"topic": "maps", "version": 8, "ops": None})
+    assert response_cache.get(("maps", 1, "full"), 7) is None
+    assert response_cache.get(("maps", 1, "full", 6), 6) is not None
+
+    drop_stale_responses({"topic": 2, "floor_id": 2, "version": None, "ops": None, "deleted": True})
+    assert response_cache.get(("floor", 2, "full", None), 5) is None
+    assert response_cache.size == sum(entry.size for entry in response_cache._entries.values())
@@ -0,0 +1,84 @@
+from math import inf
+import random
+import pytest
+from src.services.routing import METERS_PER_DEGREE, build_graph, shortest_path, shortest_path_tree
+
+
+def _obj(object_id, x, y, type="shop"):
+    return {"id": object_id, "type": type, "latlng": [y, x]}
+
+
+def _route(*points, **ends):
+    path = []
+    for point in points:
+        x, y, *extra = point
+        path.append({"x": x, "y": y, **(extra[0] if extra else {})})
+    return {"path": path, **ends}
+
+
+# An L-shaped corridor from a to c past b, and a longer detour from a to c
+FLOOR = {
+    "objects": [_obj("a", 0.0, 0.0), _obj("b", 0.001, 0.0), _obj("c", 0.001, 0.001), _obj("island", 0.005, 0.005)],
+    "routes": [
+        _route((0.0, 0.0), (0.001, 0.0), (0.001, 0.001)),
+        _route((0.0, 0.0), (0.0, 0.002), (0.001, 0.002), (0.001, 0.001)),
+    ],
+}
+
+
+def test_shortest_path_takes_the_short_corridor():
+    graph = build_graph(1, 1, FLOOR)
+    distance, nodes = shortest_path(graph, graph.object_nodes["a"], graph.object_nodes["c"])
+    assert distance == pytest.approx(0.002 * METERS_PER_DEGREE)
+    assert [graph.node_objects.get(node) for node in nodes] == ["a", "b", "c"]
+
+
+def test_unreachable_object_has_no_route():
+    graph = build_graph(1, 1, FLOOR)
+    assert shortest_path(graph, graph.object_nodes["a"], graph.object_nodes["island"]) is None
+
+
+def test_graph_is_compressed_sparse_rows_of_symmetric_edges():
+    graph = build_graph(1, 1, FLOOR)
+    assert len(graph.offsets) == len(graph) + 1
+    assert graph.offsets[-1] == len(graph.targets) == len(graph.weights)
+    edges = {
+        (u, graph.targets[i]): graph.weights[i]
+        for u in range(len(graph)) for i in range(graph.offsets[u], graph.offsets[u + 1])
+    }
+    assert all(edges[(v, u)] == w for (u, v), w in edges.items())
+
+
+def test_merged_points_join_routes_and_route_ends_join_their_markers():
+    floor = {
+        "objects": [_obj("gate", 0.0, 0.0), _obj("shop", 0.002, 0.001)],
+        "routes": [
+            _route((0.0, 0.0), (0.001, 0.0)),
+            # Drawn to end near the first route, with the averaged point marked merged
+            _route((0.00104, 0.00003, {"merged": True, "count": 2}), (0.002, 0.0009), to="shop"),
+        ],
+    }
+    graph = build_graph(1, 1, floor)
+    result = shortest_path(graph, graph.object_nodes["gate"], graph.object_nodes["shop"])
+    assert result is not None
+    assert [graph.node_objects.get(node) for node in result[1]] == ["gate", None, None, "shop"]
+
+
+def test_a_star_matches_dijkstra_on_a_random_floor():
+    rng = random.Random(3)
+    objects = [_obj(f"o{i}", rng.random() * 0.01, rng.random() * 0.01) for i in range(30)]
+    routes = [
+        _route(*[(o["latlng"][1], o["latlng"][0]) for o in rng.sample(objects, rng.randint(2, 5))])
+        for _ in range(40)
+    ]
+    graph = build_graph(1, 1, {"objects": objects, "routes": routes})
+    for _ in range(50):
+        source, target = (graph.object_nodes[o["id"]] for o in rng.sample(objects, 2))
+        dist, _ = shortest_path_tree(graph, source)
+        result = shortest_path(graph, source, target)
+        if dist[target] == inf:
+            assert result is None
+        else:
+            assert result[0] == pytest.approx(dist[target])
+            nodes = result[1]
+            assert nodes[0] == source and nodes[-1] == target
@@ -0,0 +1,165 @@
+import asyncio
+import threading
+import pytest
+from src.services.metrics import single_flight_calls
+from src.services.singleflight import AsyncSingleFlight, CoalescedCallTimeout, SingleFlight
+
+
+def _outcomes(name):
+    return {outcome: count for (n, outcome), count in single_flight_calls._values.items() if n == name}
+
+
+def _run_threads(n, target):
+    threads = [threading.Thread(target=target) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert not any(thread.is_alive() for thread in threads)
+
+
+def test_concurrent_misses_run_one_build():
+    flight = SingleFlight("test_threads")
+    entered = threading.Semaphore(0)
+    builds, results = [], []
+
+    def build():
+        builds.append(1)
+        # Hold the build until every caller has asked for it
+        for _ in range(8):
+            assert entered.acquire(timeout=5)
+        threading.Event().wait(0.05)
+        return {"floor": "1"}
+
+    def call():
+        entered.release()
+        results.append(flight.do("floor_1", build))
+
+    _run_threads(8, call)
+
+    assert len(builds) == 1
+    assert len(results) == 8
+    assert all(result is results[0] for result in results)
+    assert _outcomes("test_threads") == {"executed": 1, "coalesced": 7}
+
+
+def test_nothing_is_cached_after_a_build():
+    flight = SingleFlight("test_sequential")
+    builds = []
+
+    def build():
+        builds.append(1)
+        return len(builds)
+
+    assert flight.do("key", build) == 1
+    assert flight.do("key", build) == 2
+    assert flight._calls == {}
+
+
+def test_build_error_reaches_every_waiter():
+    flight = SingleFlight("test_errors")
+    started, release = threading.Event(), threading.Event()
+    errors = []
+
+    def build():
+        started.set()
+        release.wait(5)
+        raise ValueError("bad floor")
+
+    def call():
+        try:
+            flight.do("floor_1", build)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    assert started.wait(5)
+    waiter = threading.Thread(target=call)
+    waiter.start()
+    release.wait(0.1)
+    release.set()
+    leader.join(5)
+    waiter.join(5)
+
+    assert len(errors) == 2
+    assert errors[0] is errors[1]
+    assert flight._calls == {}
+
+
+def test_waiter_times_out():
+    flight = SingleFlight("test_timeout", timeout=0.05)
+    started, release = threading.Event(), threading.Event()
+
+    def build():
+        started.set()
+        release.wait(5)
+        return 1
+
+    leader = threading.Thread(target=lambda: flight.do("floor_1", build))
+    leader.start()
+    assert started.wait(5)
+    try:
+        with pytest.raises(CoalescedCallTimeout):
+            flight.do("floor_1", build)
+    finally:
+        release.set()
+        leader.join(5)
+    assert _outcomes("test_timeout") == {"timeout": 1, "executed": 1}
+
+
+def test_async_concurrent_misses_run_one_build():
+    flight = AsyncSingleFlight("test_async")
+    builds = []
+
+    async def build():
+        builds.append(1)
+        await asyncio.sleep(0.05)
+        return {"floor": "1"}
+
+    async def main():
+        return await asyncio.gather(*(flight.do("floor_1", build) for _ in range(8)))
+
+    results = asyncio.run(main())
+    assert len(builds) == 1
+    assert all(result is results[0] for result in results)
+    assert _outcomes("test_async") == {"executed": 1, "coalesced": 7}
+    assert flight._calls == {}
+
+
+def test_async_waiter_takes_over_when_leader_is_cancelled():
+    flight = AsyncSingleFlight("test_async_cancel")
+    builds = []
+
+    async def build():
+        builds.append(1)
+        await asyncio.sleep(0.05)
+        return len(builds)
+
+    async def main():
+        leader = asyncio.create_task(flight.do("floor_1", build))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flight.do("floor_1", build))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    assert asyncio.run(main()) == 2
+    assert len(builds) == 2
+
+
+def test_async_build_error_reaches_every_waiter():
+    flight = AsyncSingleFlight("test_async_errors")
+
+    async def build():
+        await asyncio.sleep(0.01)
+        raise ValueError("bad floor")
+
+    async def main():
+        return await asyncio.gather(*(flight.do("floor_1", build) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert all(isinstance(e, ValueError) for e in errors)
+    assert flight._calls == {}
@@ -0,0 +1,83 @@
+from math import sqrt
+import random
+import pytest
+from fastapi.testclient import TestClient
+from src.main import app
+from src.services.snap import MERGE_THRESHOLD, OBJECT_BUFFER, SnapIndex
+
+
+def _near_object(point, objects):
+    return any(sqrt((point["x"] - o["latlng"][1]) ** 2 + (point["y"] - o["latlng"][0]) ** 2) < OBJECT_BUFFER for o in objects)
+
+
+def _builder_merge(path, routes, objects):
+    """getMergedPath as MapBuilder ran it, point by point against every point"""
+    merged = []
+    for point in path:
+        nearby = [] if _near_object(point, objects) else [
+            p for route in routes for p in route["path"]
+            if not _near_object(p, objects)
+            and 0 < sqrt((point["x"] - p["x"]) ** 2 + (point["y"] - p["y"]) ** 2) < MERGE_THRESHOLD
+        ]
+        if nearby:
+            n = len(nearby) + 1
+            merged.append({"x": (point["x"] + sum(p["x"] for p in nearby)) / n,
+                           "y": (point["y"] + sum(p["y"] for p in nearby)) / n, "merged": True, "count": n})
+        else:
+            merged.append({**point, "merged": False, "count": 1})
+    return merged
+
+
+def _floor(rng):
+    def point():
+        return {"x": 77.21 + rng.random() * 0.002, "y": 28.64 + rng.random() * 0.002}
+    routes = [{"id": f"r{i}", "path": [point() for _ in range(rng.randint(2, 30))]} for i in range(40)]
+    objects = [{"id": f"o{i}", "latlng": [p["y"], p["x"]]} for i, p in enumerate(point() for _ in range(10))]
+    return routes, objects, point
+
+
+def _assert_same(merged, expected):
+    assert len(merged) == len(expected)
+    for got, want in zip(merged, expected):
+        assert (got["merged"], got["count"]) == (want["merged"], want["count"])
+        assert got["x"] == pytest.approx(want["x"], abs=1e-12)
+        assert got["y"] == pytest.approx(want["y"], abs=1e-12)
+
+
+def test_merge_matches_the_builders_merge():
+    rng = random.Random(10)
+    routes, objects, point = _floor(rng)
+    index = SnapIndex(1, 1, {"routes": routes, "objects": objects})
+    for _ in range(20):
+        path = [point() for _ in range(rng.randint(2, 40))]
+        # Exact duplicates of existing points are not merged with themselves
+        path.append(dict(routes[0]["path"][0]))
+        _assert_same(index.merge_path(path), _builder_merge(path, routes, objects))
+
+
+def test_merge_keeps_unmerged_point_fields():
+    index = SnapIndex(1, 1, {})
+    assert index.merge_path([{"x": 1.0, "y": 2.0, "anchor": True}]) == [
+        {"x": 1.0, "y": 2.0, "anchor": True, "merged": False, "count": 1}
+    ]
+    assert index.merge_path([]) == []
+    with pytest.raises(ValueError):
+        index.merge_path([{"x": "1", "y": 2.0}])
+
+
+def test_snap_endpoint_merges_into_the_routes_sent():
+    routes, objects, point = _floor(random.Random(11))
+    path = [point() for _ in range(25)]
+    with TestClient(app) as client:
+        response = client.post("/api/floors/routes:snap", json={"path": path, "routes": routes, "objects": objects})
+        assert response.status_code == 200, response.text
+        _assert_same(response.json()["path"], _builder_merge(path, routes, objects))
+
+        assert client.post("/api/floors/routes:snap", json={"path": "nope"}).status_code == 400
+        assert client.post("/api/floors/routes:snap", json={"path": [], "routes": [{"path": [{"x": "a", "y": 1}]}]}).status_code == 400
+        assert client.post("/api/floors/routes:snap", json={"path": [{"x": 1e308, "y": 1}]}).status_code == 400
+
+        # Unusable points of existing routes are skipped
+        broken = [{"path": [{"x": float("nan"), "y": 1.0}, {"x": float("inf"), "y": 1.0}]}]
+        response = client.post("/api/floors/routes:snap", json={"path": [{"x": 1.0, "y": 1.0}], "routes": broken})
+        assert response.json()["path"] == [{"x": 1.0, "y": 1.0, "merged": False, "count": 1}]
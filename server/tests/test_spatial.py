@@ -0,0 +1,64 @@
+from math import hypot
+import random
+import time
+import pytest
+from fastapi.testclient import TestClient
+from src.main import app
+from src.services.spatial import SpatialIndex, parse_bbox
+
+
+def _floor(rng, count=500):
+    return {"objects": [
+        {"id": f"o{i}", "type": rng.choice(["shop", "exit"]), "latlng": [28.64 + rng.random() * 0.004, 77.21 + rng.random() * 0.004]}
+        for i in range(count)
+    ]}
+
+
+def _brute_force(map_data, x, y, limit):
+    distances = sorted(hypot(o["latlng"][1] - x, o["latlng"][0] - y) for o in map_data["objects"])
+    return distances[:limit]
+
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(5)
+    map_data = _floor(rng)
+    index = SpatialIndex(1, 1, map_data)
+    for _ in range(200):
+        x, y = 77.205 + rng.random() * 0.014, 28.635 + rng.random() * 0.014
+        limit = rng.randint(1, 8)
+        found = [d for d, _ in index._grids["objects"].nearest(x, y, limit)]
+        assert found == _brute_force(map_data, x, y, limit)
+
+
+def test_nearest_far_from_the_floor_is_fast():
+    map_data = _floor(random.Random(6))
+    index = SpatialIndex(1, 1, map_data)
+    start = time.perf_counter()
+    # No GPS fix: phones send 0,0, thousands of km from the station
+    for x, y in [(0.0, 0.0), (77.71, 28.64), (-120.0, -45.0)]:
+        found = [d for d, _ in index._grids["objects"].nearest(x, y, 3)]
+        assert found == _brute_force(map_data, x, y, 3)
+    assert time.perf_counter() - start < 1
+
+
+@pytest.mark.parametrize("bbox", ["0,0,inf,inf", "nan,0,1,1", "0,-Infinity,1,1", "0,0,1", "a,b,c,d"])
+def test_parse_bbox_rejects_non_finite_and_malformed(bbox):
+    with pytest.raises(ValueError):
+        parse_bbox(bbox)
+
+
+def test_non_finite_points_are_rejected():
+    with TestClient(app) as client:
+        floor = client.post("/api/floors/", json={"name": "Concourse", "level": 0}).json()
+        for path in ("/api/nearest", "/api/locate"):
+            for lat, lng in (("inf", "77.2"), ("28.6", "nan"), ("-inf", "inf")):
+                response = client.get(path, params={"floor_id": floor["id"], "lat": lat, "lng": lng})
+                assert response.status_code == 400, (path, lat, lng)
+        assert client.get("/api/markers/", params={"floor_id": floor["id"], "bbox": "0,0,inf,inf"}).status_code == 400
+        assert client.get("/api/search", params={"q": "gate", "near": "nan,77.2"}).status_code == 400
+
+        batch = {"device_id": "phone", "floor_id": floor["id"], "lat": float("inf"), "lng": 77.2,
+                 "t": [0], "ax": [0], "ay": [0], "az": [9.8], "heading": [0]}
+        assert client.post("/api/tracking/samples", json={"devices": [batch]}).status_code == 400
+        batch.update(lat=28.6, ax=[float("nan")])
+        assert client.post("/api/tracking/samples", json={"devices": [batch]}).status_code == 400
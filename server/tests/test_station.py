@@ -0,0 +1,90 @@
+from math import hypot
+import pytest
+from src.services.routing import METERS_PER_DEGREE, build_graph
+from src.services.station import CONNECTOR_COSTS, StationCache, StationGraph
+
+
+def _obj(object_id, x, y, type="shop", **extra):
+    return {"id": object_id, "type": type, "latlng": [y, x], **extra}
+
+
+def _route(start, end):
+    return {"path": [{"x": start["latlng"][1], "y": start["latlng"][0]}, {"x": end["latlng"][1], "y": end["latlng"][0]}]}
+
+
+def _metres(a, b):
+    return hypot(a["latlng"][1] - b["latlng"][1], a["latlng"][0] - b["latlng"][0]) * METERS_PER_DEGREE
+
+
+PLATFORM = _obj("platform", 0.0, 0.0)
+STAIRS_0 = _obj("stairs_0", 0.001, 0.0, "stairs")
+LIFT_0 = _obj("lift_0", 0.003, 0.0, "elevator")
+STAIRS_1 = _obj("stairs_1", 0.001, 0.0, "stairs")
+LIFT_1 = _obj("lift_1", 0.003, 0.0, "elevator")
+CONCOURSE = _obj("concourse", 0.001, 0.001)
+
+
+def _station():
+    ground = build_graph(1, 1, {
+        "objects": [PLATFORM, STAIRS_0, LIFT_0],
+        "routes": [_route(PLATFORM, STAIRS_0), _route(PLATFORM, LIFT_0)],
+    })
+    upper = build_graph(2, 1, {
+        "objects": [STAIRS_1, LIFT_1, CONCOURSE],
+        "routes": [_route(STAIRS_1, CONCOURSE), _route(LIFT_1, CONCOURSE)],
+    })
+    return StationCache().get([(2, 1, upper), (1, 0, ground)])
+
+
+def _objects(station, legs):
+    return [
+        [station.floors[floor_id][1].node_objects.get(node) for node in nodes]
+        for floor_id, nodes in legs
+    ]
+
+
+def test_route_changes_level_by_the_shortest_connector():
+    station = _station()
+    distance, legs = station.route("platform", "concourse")
+    assert distance == pytest.approx(
+        _metres(PLATFORM, STAIRS_0) + CONNECTOR_COSTS["stairs"] + _metres(STAIRS_1, CONCOURSE)
+    )
+    assert [floor_id for floor_id, _ in legs] == [1, 2]
+    assert _objects(station, legs) == [["platform", "stairs_0"], ["stairs_1", "concourse"]]
+
+
+def test_accessible_route_avoids_stairs():
+    station = _station()
+    distance, legs = station.route("platform", "concourse", accessible=True)
+    assert distance == pytest.approx(
+        _metres(PLATFORM, LIFT_0) + CONNECTOR_COSTS["elevator"] + _metres(LIFT_1, CONCOURSE)
+    )
+    assert _objects(station, legs) == [["platform", "lift_0"], ["lift_1", "concourse"]]
+
+
+def test_connector_id_links_connectors_that_are_not_stacked():
+    ramp_0 = _obj("ramp_0", 0.001, 0.0, "stairs", connectorId="ramp")
+    ground = build_graph(1, 1, {"objects": [PLATFORM, ramp_0], "routes": [_route(PLATFORM, ramp_0)]})
+    ramp_1 = _obj("ramp_1", 0.004, 0.004, "stairs", connectorId="ramp")
+    upper = build_graph(2, 1, {"objects": [ramp_1, CONCOURSE], "routes": [_route(ramp_1, CONCOURSE)]})
+    station = StationGraph(None, [(1, 0, ground), (2, 1, upper)])
+    assert _objects(station, station.route("platform", "concourse")[1]) == [["platform", "ramp_0"], ["ramp_1", "concourse"]]
+    # Without a step-free connector there is no accessible route
+    assert station.route("platform", "concourse", accessible=True) is None
+
+
+def test_same_floor_routes_and_unknown_objects():
+    station = _station()
+    distance, legs = station.route("platform", "lift_0")
+    assert distance == pytest.approx(_metres(PLATFORM, LIFT_0))
+    assert len(legs) == 1
+    with pytest.raises(KeyError):
+        station.route("platform", "nowhere")
+
+
+def test_station_is_rebuilt_only_when_a_floor_version_changes():
+    ground = build_graph(1, 1, {"objects": [PLATFORM], "routes": []})
+    cache = StationCache()
+    station = cache.get([(1, 0, ground)])
+    assert cache.get([(1, 0, ground)]) is station
+    assert cache.get([(1, 0, build_graph(1, 2, {"objects": [PLATFORM], "routes": []}))]) is not station
@@ -0,0 +1,69 @@
+from math import cos, hypot, log, pi, radians, sin, tan
+import os
+import random
+from src.services import tiles
+from src.services.spatial import SpatialIndex
+from src.services.tiles import TileCache, build_tile, database_namespace
+
+
+def test_forget_removes_a_floors_tiles_from_disk(tmp_path):
+    cache = TileCache(directory=str(tmp_path), max_tiles=16)
+    cache.put(7, 1, 18, 1, 2, b"old floor")
+    cache.put(8, 1, 18, 1, 2, b"other floor")
+    cache.forget(7)
+    assert not os.path.exists(tmp_path / "7")
+
+    # A new floor reusing the id starts at version 1 again
+    fresh = TileCache(directory=str(tmp_path), max_tiles=16)
+    assert fresh.get(7, 1, 18, 1, 2) is None
+    assert fresh.get(8, 1, 18, 1, 2) == b"other floor"
+
+
+def test_databases_get_separate_directories():
+    assert database_namespace("sqlite:////tmp/a.db") != database_namespace("sqlite:////tmp/b.db")
+    # Passwords are not part of the name
+    assert database_namespace("postgresql://u:one@h/db") == database_namespace("postgresql://u:two@h/db")
+
+
+def _tile_of(lng, lat, z):
+    n = 2 ** z
+    return int((lng + 180) / 360 * n), int((1 - log(tan(radians(lat)) + 1 / cos(radians(lat))) / pi) / 2 * n)
+
+
+def _wiggly_floor():
+    rng = random.Random(15)
+    # A 200 m corridor drawn with a vertex every 20 cm and centimetre jitter
+    path = [{"x": 77.21 + i * 0.000002, "y": 28.64 + rng.uniform(-1e-7, 1e-7)} for i in range(1000)]
+    path[500].update(merged=True, count=2)
+    ring = [[77.21 + 0.001 * cos(a / 50 * pi), 28.64 + 0.001 * sin(a / 50 * pi)] for a in range(100)]
+    return {
+        "routes": [{"id": "corridor", "path": path}],
+        "boundaries": [{"id": "hall", "geometry": {"type": "Polygon", "coordinates": [ring + [ring[0]]]}}],
+    }
+
+
+def test_low_zoom_tiles_carry_only_visible_vertices(monkeypatch):
+    index = SpatialIndex(1, 1, _wiggly_floor())
+    z = 15
+    x, y = _tile_of(77.211, 28.64, z)
+    simplified = build_tile(index, z, x, y)
+    monkeypatch.setattr(tiles, "PIXEL", 0)
+    full = build_tile(index, z, x, y)
+    assert len(simplified) * 3 < len(full)
+
+
+def _segment_distance(p, a, b):
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    t = max(0.0, min(1.0, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / (dx * dx + dy * dy)))
+    return hypot(p[0] - a[0] - t * dx, p[1] - a[1] - t * dy)
+
+
+def test_simplified_lines_stay_within_a_pixel_and_keep_junctions():
+    rng = random.Random(16)
+    points = [(i * 3.0, rng.uniform(-20, 20)) for i in range(300)]
+    kept = [points.index(p) for p in tiles._simplify_line(points, pinned=[123])]
+    assert kept[0] == 0 and kept[-1] == len(points) - 1 and 123 in kept
+    assert len(kept) < len(points)
+    for start, end in zip(kept, kept[1:]):
+        for p in points[start + 1:end]:
+            assert _segment_distance(p, points[start], points[end]) <= tiles.PIXEL
@@ -0,0 +1,56 @@
+import json
+from fastapi.testclient import TestClient
+from src.main import app
+
+STATION = {
+    "type": "FeatureCollection",
+    "floors": [{"level": 0, "name": "Concourse"}, {"level": 1, "name": "Platforms"}],
+    "features": [
+        {"type": "Feature", "id": "gate", "geometry": {"type": "Point", "coordinates": [77.2194, 28.6419]},
+         "properties": {"floor": 0, "layer": "objects", "type": "exit", "name": "Gate 1"}},
+        {"type": "Feature", "id": "walk", "geometry": {"type": "LineString", "coordinates": [[77.2194, 28.6419], [77.2195, 28.6420]]},
+         "properties": {"floor": 1, "layer": "routes", "pathProperties": [{"merged": False, "count": 1}, {"merged": True, "count": 2}]}},
+    ],
+}
+
+
+def test_imported_station_is_the_builders_map_and_exports_back():
+    with TestClient(app) as client:
+        response = client.post("/api/station/import", content=json.dumps(STATION), headers={"content-type": "application/geo+json"})
+        assert response.status_code == 200, response.text
+        assert response.json()["features"]["objects"] == 1
+
+        # MapBuilder and the viewers read the /api/maps document
+        maps = client.get("/api/maps").json()
+        assert maps["floors"] == [{"id": "floor_0", "name": "Concourse"}, {"id": "floor_1", "name": "Platforms"}]
+        assert maps["floorData"]["floor_0"]["objects"] == [
+            {"id": "gate", "type": "exit", "name": "Gate 1", "latlng": [28.6419, 77.2194]}
+        ]
+        assert maps["floorData"]["floor_1"]["routes"][0]["path"][1] == {"x": 77.2195, "y": 28.642, "merged": True, "count": 2}
+
+        exported = json.loads(client.get("/api/station/export").content)
+        assert exported["floors"] == STATION["floors"]
+        assert sorted(exported["features"], key=lambda f: f["id"]) == sorted(STATION["features"], key=lambda f: f["id"])
+
+
+def test_invalid_upload_changes_nothing():
+    with TestClient(app) as client:
+        before = client.get("/api/maps").json()
+        bad = {**STATION, "features": STATION["features"] + [{"type": "Feature", "geometry": None, "properties": {"floor": "x"}}]}
+        response = client.post("/api/station/import", content=json.dumps(bad))
+        assert response.status_code == 422
+        assert client.get("/api/maps").json() == before
+
+
+def test_import_is_stored_as_a_snapshot():
+    renamed = {**STATION, "floors": [{"level": 0, "name": "Hall"}, {"level": 1, "name": "Platforms"}]}
+    with TestClient(app) as client:
+        versions = []
+        for station in (STATION, renamed):
+            response = client.post("/api/station/import", content=json.dumps(station), headers={"content-type": "application/geo+json"})
+            assert response.status_code == 200, response.text
+            versions.append(response.json()["map_version"])
+
+        # Not diffed against the previous document, however small the change
+        history = client.get("/api/maps/history").json()["versions"]
+        assert {v["version"]: v["kind"] for v in history if v["version"] in versions} == dict.fromkeys(versions, "snapshot")
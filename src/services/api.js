@@ -1,4 +1,6 @@
-const API_BASE_URL = 'https://raildisha.divyanshvijay.in';
+import { expandMapData } from './geometry';
+
+export const API_BASE_URL = 'https://raildisha.divyanshvijay.in';
 
 // Floor operations
 export const createFloor = async (floorData) => {
@@ -55,32 +57,57 @@ export const createBoundary = async (boundaryData) => {
   return response.json();
 };
 
+// Get several floors with only the requested collections in one request
+export async function getFloorBundle(floorIds, fields = ['objects', 'routes', 'boundaries']) {
+    // Geometry comes as encoded polylines, a fraction of the size
+    const params = new URLSearchParams({ ids: floorIds.join(','), fields: fields.join(','), format: 'compact' });
+    const response = await fetch(`${API_BASE_URL}/api/floors/bundle?${params}`);
+    if (!response.ok) {
+        throw new Error('Failed to fetch floor bundle');
+    }
+    const { floors } = await response.json();
+    return floors.map(floor => ({ ...floor, map_data: expandMapData(floor.map_data) }));
+}
+
+// Merge a newly drawn corridor ([{x, y}, ...]) into a floor's existing
+// routes on the server. floor is the builder's { routes, objects } for the
+// floor; resolves to the path with merged/count set on every point.
+export async function snapRoute(path, { routes = [], objects = [] } = {}) {
+    const response = await fetch(`${API_BASE_URL}/api/floors/routes:snap`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ path, routes, objects })
+    });
+    if (!response.ok) {
+        throw new Error('Failed to merge path');
+    }
+    return (await response.json()).path;
+}
+
+// Objects matching a search across all floors, best first
+export async function searchObjects(query, { floorId, near, limit = 10 } = {}) {
+    const params = new URLSearchParams({ q: query, limit });
+    if (floorId !== undefined) params.set('floor', floorId);
+    if (near) params.set('near', near.join(','));
+    const response = await fetch(`${API_BASE_URL}/api/search?${params}`);
+    if (!response.ok) {
+        throw new Error('Failed to search objects');
+    }
+    const { results } = await response.json();
+    return results;
+}
+
 // Get all data for a floor
 export async function getFloorData(floorId) {
     try {
-        // Get markers
-        const markersResponse = await fetch(`${API_BASE_URL}/api/markers?floor_id=${floorId}`);
-        if (!markersResponse.ok) {
-            throw new Error('Failed to fetch markers');
-        }
-        const markers = await markersResponse.json();
-        console.log('Raw markers from API:', markers);
-
-        // Get paths
-        const pathsResponse = await fetch(`${API_BASE_URL}/api/paths?floor_id=${floorId}`);
-        if (!pathsResponse.ok) {
-            throw new Error('Failed to fetch paths');
-        }
-        const paths = await pathsResponse.json();
-        console.log('Raw paths from API:', paths);
-
-        // Get boundaries
-        const boundariesResponse = await fetch(`${API_BASE_URL}/api/boundaries?floor_id=${floorId}`);
-        if (!boundariesResponse.ok) {
-            throw new Error('Failed to fetch boundaries');
-        }
-        const boundaries = await boundariesResponse.json();
-        console.log('Raw boundaries from API:', boundaries);
+        // Markers, paths and boundaries in a single round trip
+        const [floor] = await getFloorBundle([floorId]);
+        const {
+            objects: markers = [],
+            routes: paths = [],
+            boundaries = []
+        } = floor.map_data;
+        console.log('Raw floor data from API:', floor.map_data);
 
         // Combine the data in the same format as localStorage
         const combinedData = {
@@ -196,14 +223,43 @@ export const saveCompleteMap = async (data) => {
     }
 };
 
-// Get all map data
-export const getMapData = async () => {
+// Version of the map this editor last loaded or saved, kept with the
+// localStorage copy so a reload still knows what it is based on
+const MAP_VERSION_KEY = 'rd_map_version';
+
+export const getSavedMapVersion = () => {
+    const version = parseInt(localStorage.getItem(MAP_VERSION_KEY), 10);
+    return Number.isNaN(version) ? null : version;
+};
+
+export const setSavedMapVersion = (version) => {
+    if (version == null) {
+        localStorage.removeItem(MAP_VERSION_KEY);
+    } else {
+        localStorage.setItem(MAP_VERSION_KEY, String(version));
+    }
+};
+
+// Get all map data. Editors keep the version it was read at, so their
+// next save is refused if someone else saves first; viewers pass
+// { trackVersion: false } to leave the editor's version alone.
+export const getMapData = async ({ trackVersion = true } = {}) => {
     try {
-        const response = await fetch(`${API_BASE_URL}/api/maps`);
+        // Geometry comes as encoded polylines, a fraction of the size
+        const response = await fetch(`${API_BASE_URL}/api/maps?format=compact`);
         if (!response.ok) {
             throw new Error('Failed to fetch map data');
         }
         const data = await response.json();
+        const version = parseInt(response.headers.get('X-Map-Version'), 10);
+        if (trackVersion && !Number.isNaN(version)) {
+            setSavedMapVersion(version);
+        }
+        if (data?.floorData) {
+            data.floorData = Object.fromEntries(
+                Object.entries(data.floorData).map(([floorId, floorData]) => [floorId, expandMapData(floorData)])
+            );
+        }
         console.log('Received map data:', data);
         
         // Ensure data has the expected structure
@@ -218,17 +274,22 @@ export const getMapData = async () => {
     }
 };
 
-// Save map data
+// Save map data. The save is based on the last version this editor loaded
+// or saved, so if someone else saved in between the server refuses it with
+// 409 and this returns { success: false, conflict: true } instead of
+// overwriting.
 export const saveMapData = async (data) => {
     try {
+        const baseVersion = getSavedMapVersion();
+        const params = baseVersion == null ? '' : `?base_version=${baseVersion}`;
         // Log the request data
         console.log('Sending data to API:', {
-            url: `${API_BASE_URL}/api/maps`,
+            url: `${API_BASE_URL}/api/maps${params}`,
             method: 'POST',
             data: data
         });
 
-        const response = await fetch(`${API_BASE_URL}/api/maps`, {
+        const response = await fetch(`${API_BASE_URL}/api/maps${params}`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -252,12 +313,99 @@ export const saveMapData = async (data) => {
                 statusText: response.statusText,
                 data: responseData
             });
-            return { success: false, error: responseData.message || 'Server error' };
+            return {
+                success: false,
+                conflict: response.status === 409,
+                error: responseData.detail || responseData.message || 'Server error'
+            };
         }
         
+        setSavedMapVersion(responseData.version);
         return responseData;
     } catch (error) {
         console.error('Error saving map data:', error);
         return { success: false, error: error.message };
     }
-}; 
\ No newline at end of file
+};
+
+// Saved versions of the map, newest first
+export async function getMapHistory({ before, limit = 50 } = {}) {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (before) params.set('before', String(before));
+    const response = await fetch(`${API_BASE_URL}/api/maps/history?${params}`);
+    if (!response.ok) {
+        throw new Error('Failed to fetch map history');
+    }
+    return response.json();
+}
+
+// The map as it was saved at a version
+export async function getMapVersion(version) {
+    const response = await fetch(`${API_BASE_URL}/api/maps?version=${version}`);
+    if (!response.ok) {
+        throw new Error(`Failed to fetch map version ${version}`);
+    }
+    return response.json();
+}
+
+// Ops between two saved versions; toVersion defaults to the current one
+export async function getMapDiff(fromVersion, toVersion) {
+    const params = new URLSearchParams({ from_version: String(fromVersion) });
+    if (toVersion) params.set('to_version', String(toVersion));
+    const response = await fetch(`${API_BASE_URL}/api/maps/diff?${params}`);
+    if (!response.ok) {
+        throw new Error('Failed to fetch map diff');
+    }
+    return response.json();
+}
+
+// Save an earlier version again as the newest one
+export async function restoreMapVersion(version) {
+    const response = await fetch(`${API_BASE_URL}/api/maps/restore?version=${version}`, { method: 'POST' });
+    if (!response.ok) {
+        throw new Error(`Failed to restore map version ${version}`);
+    }
+    return response.json();
+}
+
+// Download link for every floor and item as GeoJSON, or one Feature per
+// line with format 'ndjson'
+export const stationExportUrl = (format = 'geojson') =>
+    `${API_BASE_URL}/api/station/export?format=${format}`;
+
+// Replace the station with an exported file (a File or Blob, streamed as
+// is). dryRun only validates and counts what would be imported.
+export async function importStation(file, { format, dryRun = false } = {}) {
+    const params = new URLSearchParams({ dry_run: String(dryRun) });
+    if (format) params.set('format', format);
+    const response = await fetch(`${API_BASE_URL}/api/station/import?${params}`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': format === 'ndjson' || file.name?.endsWith('.ndjson')
+                ? 'application/x-ndjson'
+                : 'application/geo+json',
+        },
+        body: file
+    });
+    if (!response.ok) {
+        const error = await response.json().catch(() => ({}));
+        throw new Error(error.detail || 'Failed to import station');
+    }
+    const summary = await response.json();
+    // The import is saved as a new /api/maps version too
+    if (summary.map_version != null) setSavedMapVersion(summary.map_version);
+    return summary;
+}
+
+// Subscribe to committed changes instead of polling /api/maps.
+// onChange gets { floor_id, version, ops } (ops null: re-read the floor) or
+// { version, ops: null } for the /api/maps document; onResync means events
+// were dropped and everything shown should be re-read.
+// Returns a function that closes the subscription.
+export const subscribeToMapChanges = ({ floorIds = [], maps = false }, onChange, onResync) => {
+    const params = new URLSearchParams({ floors: floorIds.join(','), maps: String(maps) });
+    const source = new EventSource(`${API_BASE_URL}/api/feed?${params}`);
+    source.addEventListener('change', (event) => onChange(JSON.parse(event.data)));
+    source.addEventListener('resync', () => onResync?.());
+    return () => source.close();
+};
@@ -0,0 +1,72 @@
+// Decoder for the compact geometry served with format=compact (see
+// server/src/services/geometry.py): route paths and boundary rings come
+// as encoded polylines of 1e-7 degree, delta-encoded coordinates.
+
+const COMPACT_ENCODING = 'polyline7';
+const SCALE = 1e7;
+
+// Encoded polyline -> [[lat, lng], ...]
+export function decodePolyline(encoded) {
+    const points = [];
+    let index = 0;
+    let lat = 0;
+    let lng = 0;
+    while (index < encoded.length) {
+        const deltas = [];
+        for (let i = 0; i < 2; i++) {
+            // Values exceed 32 bits, so no bitwise operators on the total
+            let shift = 1;
+            let result = 0;
+            let byte;
+            do {
+                byte = encoded.charCodeAt(index++) - 63;
+                result += (byte & 0x1f) * shift;
+                shift *= 32;
+            } while (byte >= 0x20);
+            deltas.push(result % 2 ? -(result + 1) / 2 : result / 2);
+        }
+        lat += deltas[0];
+        lng += deltas[1];
+        points.push([lat / SCALE, lng / SCALE]);
+    }
+    return points;
+}
+
+// A compact route back in the builder's {x, y, merged, count} path shape
+function expandRoute(route) {
+    if (route?.encoding !== COMPACT_ENCODING) return route;
+    const { encoding, counts, ...rest } = route;
+    return {
+        ...rest,
+        path: decodePolyline(route.path).map(([lat, lng], i) => (
+            counts ? { x: lng, y: lat, merged: counts[i] > 1, count: counts[i] } : { x: lng, y: lat }
+        )),
+    };
+}
+
+// A compact boundary back to GeoJSON rings of [lng, lat]
+function expandBoundary(boundary) {
+    if (boundary?.encoding !== COMPACT_ENCODING) return boundary;
+    const { encoding, ...rest } = boundary;
+    return {
+        ...rest,
+        geometry: {
+            ...boundary.geometry,
+            coordinates: boundary.geometry.coordinates.map(
+                ring => decodePolyline(ring).map(([lat, lng]) => [lng, lat])
+            ),
+        },
+    };
+}
+
+// A floor's map_data (or floorData entry) fetched with format=compact,
+// in the same shape as format=full
+export function expandMapData(mapData) {
+    if (!mapData || typeof mapData !== 'object') return mapData;
+    const expanded = { ...mapData };
+    if (Array.isArray(mapData.routes)) expanded.routes = mapData.routes.map(expandRoute);
+    for (const key of ['boundaries', 'innerBoundaries']) {
+        if (Array.isArray(mapData[key])) expanded[key] = mapData[key].map(expandBoundary);
+    }
+    return expanded;
+}
@@ -0,0 +1,165 @@
+// Reader for the offline station bundle served by /api/maps/bundle.
+// The layout is documented in server/src/services/offline.py; every
+// section is 8-byte aligned so it can be viewed in place with typed arrays.
+
+import { API_BASE_URL } from './api';
+
+const SECTION_SIZE = 32;
+const HEADER_SIZE = 32;
+const DELTA_HEADER_SIZE = 60;
+
+// Field names of each section's fixed-size records, all 4-byte slots
+// (u32, or two slots for an f64)
+const RECORD_FIELDS = {
+    FLOORS: ['idOff', 'idLen', 'nameOff', 'nameLen', 'strings', 'stringsLen', 'nodes', 'nodeCount',
+        'edges', 'edgeCount', 'objects', 'objectCount', 'routes', 'routeCount', 'routePoints',
+        'routePointCount', 'areas', 'areaCount', 'areaPoints', 'areaPointCount'],
+    OBJECTS: ['idOff', 'idLen', 'nameOff', 'nameLen', 'typeOff', 'typeLen', 'node', 'reserved'],
+    ROUTES: ['idOff', 'idLen', 'nameOff', 'nameLen', 'points', 'pointCount'],
+    AREAS: ['idOff', 'idLen', 'nameOff', 'nameLen', 'typeOff', 'typeLen', 'inner', 'points', 'pointCount', 'reserved'],
+};
+const RECORD_BYTES = { FLOORS: 80, OBJECTS: 48, ROUTES: 24, AREAS: 40 };
+
+const decoder = new TextDecoder();
+
+export function openBundle(buffer) {
+    const view = new DataView(buffer);
+    const magic = decoder.decode(new Uint8Array(buffer, 0, 4));
+    if (magic !== 'RDSB' || view.getUint16(4, true) !== 1) {
+        throw new Error('Not a station bundle of a supported format');
+    }
+    const version = Number(view.getBigUint64(8, true));
+    const count = view.getUint32(16, true);
+
+    const sections = {};
+    for (let i = 0; i < count; i++) {
+        const at = HEADER_SIZE + i * SECTION_SIZE;
+        const tag = decoder.decode(new Uint8Array(buffer, at, 8)).replace(/\0+$/, '');
+        sections[tag] = {
+            offset: Number(view.getBigUint64(at + 8, true)),
+            length: Number(view.getBigUint64(at + 16, true)),
+            records: Number(view.getBigUint64(at + 24, true)),
+        };
+    }
+
+    const u32 = (tag) => new Uint32Array(buffer, sections[tag].offset, sections[tag].length / 4);
+    const f64 = (tag) => new Float64Array(buffer, sections[tag].offset, sections[tag].length / 8);
+    const strings = new Uint8Array(buffer, sections.STRINGS.offset, sections.STRINGS.length);
+
+    const record = (tag, index) => {
+        const fields = RECORD_FIELDS[tag];
+        const words = new Uint32Array(buffer, sections[tag].offset + index * RECORD_BYTES[tag], fields.length);
+        return Object.fromEntries(fields.map((name, i) => [name, words[i]]));
+    };
+    const floors = Array.from({ length: sections.FLOORS.records }, (_, i) => record('FLOORS', i));
+    const text = (floor, offset, length) => decoder.decode(strings.subarray(floor.strings + offset, floor.strings + offset + length));
+
+    const object = (floorIndex, index) => {
+        const floor = floors[floorIndex];
+        const r = record('OBJECTS', floor.objects + index);
+        const position = new Float64Array(buffer, sections.OBJECTS.offset + (floor.objects + index) * 48 + 32, 2);
+        return {
+            id: text(floor, r.idOff, r.idLen),
+            name: text(floor, r.nameOff, r.nameLen),
+            type: text(floor, r.typeOff, r.typeLen),
+            node: r.node === 0xFFFFFFFF ? null : r.node,
+            latlng: [position[0], position[1]],
+        };
+    };
+
+    return {
+        version,
+        floors: floors.map((floor) => ({ ...floor, id: text(floor, floor.idOff, floor.idLen), name: text(floor, floor.nameOff, floor.nameLen) })),
+        // [lng, lat] pairs of graph nodes, route points and area rings
+        nodes: f64('NODES'),
+        routePoints: f64('ROUTEPTS'),
+        areaPoints: f64('AREAPTS'),
+        // Per node: first edge (relative to the floor's edges) and edge count
+        adjacency: u32('ADJ'),
+        // Per edge: target node (relative to the floor's nodes) and float32 weight in metres
+        edges: new DataView(buffer, sections.EDGES.offset, sections.EDGES.length),
+        object,
+        // Objects whose name starts with prefix, by binary search over the name table
+        findByName(prefix, limit = 20) {
+            const names = u32('NAMES');
+            const key = prefix.toLowerCase();
+            const nameAt = (i) => object(names[2 * i], names[2 * i + 1]).name.toLowerCase();
+            let low = 0;
+            let high = sections.NAMES.records;
+            while (low < high) {
+                const mid = (low + high) >> 1;
+                if (nameAt(mid) < key) low = mid + 1; else high = mid;
+            }
+            const found = [];
+            for (let i = low; i < sections.NAMES.records && found.length < limit; i++) {
+                if (!nameAt(i).startsWith(key)) break;
+                found.push({ floor: names[2 * i], ...object(names[2 * i], names[2 * i + 1]) });
+            }
+            return found;
+        },
+    };
+}
+
+async function inflate(bytes) {
+    const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('deflate'));
+    return new Uint8Array(await new Response(stream).arrayBuffer());
+}
+
+export async function applyDelta(base, delta) {
+    const view = new DataView(delta);
+    if (decoder.decode(new Uint8Array(delta, 0, 4)) !== 'RDSD') {
+        throw new Error('Not a station bundle delta');
+    }
+    const length = Number(view.getBigUint64(20, true));
+    const digest = new Uint8Array(delta, 28, 32);
+    const ops = await inflate(new Uint8Array(delta, DELTA_HEADER_SIZE));
+    const source = new Uint8Array(base);
+    const out = new Uint8Array(length);
+
+    let i = 0;
+    let written = 0;
+    const varint = () => {
+        let value = 0;
+        let scale = 1;
+        for (;;) {
+            const byte = ops[i++];
+            value += (byte & 0x7f) * scale;
+            if (byte < 0x80) return value;
+            scale *= 128;
+        }
+    };
+    while (i < ops.length) {
+        const op = varint();
+        const size = Math.floor(op / 2);
+        if (op % 2) {
+            out.set(ops.subarray(i, i + size), written);
+            i += size;
+        } else {
+            const from = varint();
+            out.set(source.subarray(from, from + size), written);
+        }
+        written += size;
+    }
+
+    const actual = new Uint8Array(await crypto.subtle.digest('SHA-256', out));
+    if (written !== length || actual.some((byte, k) => byte !== digest[k])) {
+        throw new Error('Delta does not apply to this base');
+    }
+    return out.buffer;
+}
+
+// The current bundle, as a delta on top of `cached` (an ArrayBuffer from an
+// earlier call) when the server still has its version
+export async function fetchOfflineBundle(cached) {
+    if (cached) {
+        const version = openBundle(cached).version;
+        const response = await fetch(`${API_BASE_URL}/api/maps/bundle/delta?from_version=${version}`);
+        if (response.status === 204) return cached;
+        if (response.ok) return applyDelta(cached, await response.arrayBuffer());
+    }
+    const response = await fetch(`${API_BASE_URL}/api/maps/bundle`);
+    if (!response.ok) {
+        throw new Error('Failed to fetch offline bundle');
+    }
+    return response.arrayBuffer();
+}